@@ -0,0 +1,303 @@
+"""Background removal for animated GIF, WebP and PNG files and folders of frames.
+
+Frames are decoded one at a time and each output frame is written as soon
+as it is ready, into an animated PNG or a folder of numbered PNGs, so memory
+stays at a few frames however long the clip is. The model only runs when
+the picture has changed: a frame that nearly matches the last frame the
+model saw reuses its mask, and with warping a frame that matches it after a
+shift (a pan, or the subject sliding across a still background) reuses the
+mask moved by that shift. Every MAX_REUSED_FRAMES the model runs anyway, so
+small changes cannot pile up.
+"""
+import io
+import math
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+from PIL import Image, ImageChops
+
+from app_log import log
+from compositing import CompositeSource
+from perf import peak_rss_bytes
+from pipeline import predict_mask
+from png_stream import PNG_SIGNATURE, sub_filter_rows, write_png_chunk
+
+ANIMATION_EXTENSIONS = (".gif", ".webp", ".png", ".apng")
+FRAME_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".webp")
+# Frame rate of folders of frames, which have no timing of their own
+DEFAULT_FPS = 12
+# Longest side of the grayscale copy frames are compared at
+SIGNATURE_SIZE = 160
+# A signature pixel counts as changed when it moves by more than this (0-255)
+CHANGE_LEVEL = 12
+# Two frames share a mask when at most this fraction of pixels changed
+DEFAULT_REUSE_THRESHOLD = 0.005
+MAX_REUSED_FRAMES = 12
+# Shifts smaller than this (in signature pixels) reuse the mask unmoved
+MIN_WARP_SHIFT = 0.5
+# PNG color type of each mode APNGStreamWriter writes
+PNG_COLOR_TYPES = {"L": 0, "RGBA": 6}
+
+
+def is_animated(path):
+    """True if path is an image file with more than one frame"""
+    if not path.lower().endswith(ANIMATION_EXTENSIONS):
+        return False
+    try:
+        with Image.open(path) as image:
+            return getattr(image, "is_animated", False)
+    except OSError:
+        return False
+
+
+class FrameSource:
+    """The frames of an animated image (a path or encoded bytes) or a folder of frames, decoded lazily.
+
+    Iterating yields (frame, duration in ms) with frames as RGBA images.
+    """
+
+    def __init__(self, source, fps=DEFAULT_FPS):
+        self.source = source
+        self.fps = fps
+        self.loop = 0
+        if isinstance(source, str) and os.path.isdir(source):
+            self._paths = sorted(os.path.join(source, name) for name in os.listdir(source)
+                                 if name.lower().endswith(FRAME_EXTENSIONS))
+            if not self._paths:
+                raise FileNotFoundError(f"No frames found in {source}")
+            with Image.open(self._paths[0]) as first:
+                self.size = first.size
+            self.frame_count = len(self._paths)
+        else:
+            self._paths = None
+            with self._open() as image:
+                self.size = image.size
+                self.frame_count = getattr(image, "n_frames", 1)
+                self.loop = image.info.get("loop", 0)
+
+    def _open(self):
+        if isinstance(self.source, (bytes, bytearray)):
+            return Image.open(io.BytesIO(self.source))
+        return Image.open(self.source)
+
+    def __iter__(self):
+        frame_duration = round(1000 / self.fps)
+        if self._paths is not None:
+            for path in self._paths:
+                with Image.open(path) as frame:
+                    yield frame.convert("RGBA"), frame_duration
+            return
+        with self._open() as image:
+            for index in range(self.frame_count):
+                image.seek(index)
+                yield image.convert("RGBA"), image.info.get("duration", frame_duration)
+
+
+def frame_signature(frame):
+    """A small grayscale float copy of frame for comparing frames"""
+    small = frame.convert("L")
+    small.thumbnail((SIGNATURE_SIZE, SIGNATURE_SIZE), Image.Resampling.BILINEAR)
+    return np.asarray(small, dtype=np.float32)
+
+
+def estimate_shift(reference, signature):
+    """(dx, dy) in signature pixels that best moves reference onto signature, by phase correlation"""
+    window = np.outer(np.hanning(reference.shape[0]), np.hanning(reference.shape[1])).astype(np.float32)
+    spectrum = np.fft.rfft2((signature - signature.mean()) * window)
+    spectrum *= np.conj(np.fft.rfft2((reference - reference.mean()) * window))
+    correlation = np.fft.irfft2(spectrum / np.maximum(np.abs(spectrum), 1e-6), s=reference.shape)
+    peak_y, peak_x = np.unravel_index(np.argmax(correlation), correlation.shape)
+    height, width = reference.shape
+
+    def refine(before, peak, after):
+        # Vertex of the parabola through the peak and its neighbours
+        curvature = before - 2 * peak + after
+        return 0.0 if curvature >= 0 else 0.5 * (before - after) / curvature
+
+    row, column = correlation[:, peak_x], correlation[peak_y]
+    dx = peak_x + refine(column[peak_x - 1], column[peak_x], column[(peak_x + 1) % width])
+    dy = peak_y + refine(row[peak_y - 1], row[peak_y], row[(peak_y + 1) % height])
+    # Peaks past the middle are negative shifts wrapped around
+    return (dx - width if dx > width / 2 else dx), (dy - height if dy > height / 2 else dy)
+
+
+def translate(image, dx, dy):
+    """image moved by (dx, dy) pixels, which may be fractional; uncovered edges become 0"""
+    return image.transform(image.size, Image.Transform.AFFINE, (1, 0, -dx, 0, 1, -dy), Image.Resampling.BILINEAR)
+
+
+def changed_fraction(reference, signature, dx=0.0, dy=0.0):
+    """Fraction of pixels that differ between reference moved by (dx, dy) and signature, where they overlap"""
+    height, width = reference.shape
+    if abs(dx) >= width / 2 or abs(dy) >= height / 2:
+        return 1.0
+    if dx or dy:
+        reference = np.asarray(translate(Image.fromarray(reference, "F"), dx, dy))
+    margin_x, margin_y = math.ceil(abs(dx)), math.ceil(abs(dy))
+    window = (slice(margin_y, height - margin_y), slice(margin_x, width - margin_x))
+    difference = np.abs(reference[window] - signature[window])
+    return float(np.count_nonzero(difference > CHANGE_LEVEL)) / difference.size
+
+
+class TemporalMasker:
+    """Masks for consecutive frames, running the model only when the picture changes.
+
+    Each frame is compared with the last keyframe, the last frame the model
+    ran on. Counts of inferred, reused and warped frames are kept in stats.
+    """
+
+    def __init__(self, session, proxy_size=None, threshold=DEFAULT_REUSE_THRESHOLD, warp=True,
+                 max_reused=MAX_REUSED_FRAMES):
+        self.session = session
+        self.proxy_size = proxy_size
+        self.threshold = threshold
+        self.warp = warp
+        self.max_reused = max_reused
+        self.stats = {"inferred": 0, "reused": 0, "warped": 0}
+        self._key_signature = None
+        self._key_mask = None
+        self._reused = 0
+
+    def mask_for(self, frame):
+        signature = frame_signature(frame)
+        if self._key_signature is not None and signature.shape == self._key_signature.shape \
+                and self._reused < self.max_reused:
+            dx, dy = estimate_shift(self._key_signature, signature) if self.warp else (0.0, 0.0)
+            if max(abs(dx), abs(dy)) < MIN_WARP_SHIFT:
+                if changed_fraction(self._key_signature, signature) <= self.threshold:
+                    return self._reuse("reused", self._key_mask)
+            elif changed_fraction(self._key_signature, signature, dx, dy) <= self.threshold:
+                scale_x = frame.width / signature.shape[1]
+                scale_y = frame.height / signature.shape[0]
+                return self._reuse("warped", translate(self._key_mask, dx * scale_x, dy * scale_y))
+
+        mask = predict_mask(frame.convert("RGB"), self.session, self.proxy_size)
+        self._key_signature = signature
+        self._key_mask = mask
+        self._reused = 0
+        self.stats["inferred"] += 1
+        return mask
+
+    def _reuse(self, kind, mask):
+        self._reused += 1
+        self.stats[kind] += 1
+        return mask
+
+
+class APNGStreamWriter:
+    """Writes an 8-bit RGBA or grayscale ('L') animated PNG incrementally, one frame at a time.
+
+    The frame count in the header is filled in by close(), so the file must
+    be seekable.
+    """
+
+    def __init__(self, path, width, height, loop=0, compress_level=6, mode="RGBA"):
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.loop = loop
+        self.compress_level = compress_level
+        self.frames_written = 0
+        self._sequence = 0
+        self._file = open(path, "wb")
+        self._file.write(PNG_SIGNATURE)
+        # 8 bits per channel, no interlacing
+        header = struct.pack(">IIBBBBB", width, height, 8, PNG_COLOR_TYPES[mode], 0, 0, 0)
+        write_png_chunk(self._file, b"IHDR", header)
+        self._actl_offset = self._file.tell()
+        write_png_chunk(self._file, b"acTL", struct.pack(">II", 0, loop))
+
+    def add_frame(self, frame, duration):
+        """Append a frame the size of the animation, shown for duration ms"""
+        channels = len(self.mode)
+        rows = np.asarray(frame.convert(self.mode), dtype=np.uint8).reshape(self.height, self.width * channels)
+        data = zlib.compress(sub_filter_rows(rows, channels).tobytes(), self.compress_level)
+
+        # Each frame replaces the whole canvas: no disposal, "source" blending
+        write_png_chunk(self._file, b"fcTL", struct.pack(">IIIIIHHBB", self._sequence, self.width, self.height,
+                                                         0, 0, min(int(duration), 65535), 1000, 0, 0))
+        self._sequence += 1
+        if self.frames_written == 0:
+            write_png_chunk(self._file, b"IDAT", data)
+        else:
+            write_png_chunk(self._file, b"fdAT", struct.pack(">I", self._sequence) + data)
+            self._sequence += 1
+        self.frames_written += 1
+
+    def close(self):
+        if self.frames_written == 0:
+            self._file.close()
+            raise ValueError("An animated PNG needs at least one frame")
+        write_png_chunk(self._file, b"IEND", b"")
+        self._file.seek(self._actl_offset)
+        write_png_chunk(self._file, b"acTL", struct.pack(">II", self.frames_written, self.loop))
+        self._file.close()
+
+    def abort(self):
+        """Close the file without finishing it"""
+        self._file.close()
+
+
+def remove_background_animation(source, dst, session, proxy_size=None, variant=None, mask_only=False,
+                                threshold=DEFAULT_REUSE_THRESHOLD, warp=True, fps=DEFAULT_FPS, compress_level=6,
+                                on_frame=None):
+    """Remove the background of every frame of source, streaming the results to dst.
+
+    source is an animated image (a path or encoded bytes) or a folder of
+    frames. dst ending in .png is written as an animated PNG, anything else
+    as a folder of numbered PNG frames. variant is a compositing variant
+    (background and refinements); mask_only writes the masks instead, as
+    grayscale ('L') frames in either output.
+    on_frame(index, count) is called after each frame. Returns the frame
+    counts, time and peak RSS.
+    """
+    frames = FrameSource(source, fps)
+    masker = TemporalMasker(session, proxy_size, threshold, warp)
+    variant = variant or {}
+    start = time.perf_counter()
+
+    to_folder = not dst.lower().endswith(".png")
+    if to_folder:
+        os.makedirs(dst, exist_ok=True)
+        writer = None
+        partial_path = None
+    else:
+        partial_path = dst + ".partial"
+        writer = APNGStreamWriter(partial_path, *frames.size, loop=frames.loop, compress_level=compress_level,
+                                  mode="L" if mask_only else "RGBA")
+
+    try:
+        for index, (frame, duration) in enumerate(frames):
+            mask = masker.mask_for(frame)
+            # Transparent parts of the source frame stay transparent
+            alpha = frame.getchannel("A")
+            if alpha.getextrema()[0] < 255:
+                mask = ImageChops.multiply(mask, alpha)
+            output = mask if mask_only else CompositeSource(frame, mask).render(variant)
+            if to_folder:
+                output.save(os.path.join(dst, f"frame_{index + 1:05d}.png"), "PNG", compress_level=compress_level)
+            else:
+                if output.size != frames.size:
+                    raise ValueError(f"Frame {index + 1} is {output.size[0]}x{output.size[1]}, "
+                                     f"not {frames.size[0]}x{frames.size[1]}")
+                writer.add_frame(output, duration)
+            if on_frame:
+                on_frame(index, frames.frame_count)
+        if writer is not None:
+            writer.close()
+            os.replace(partial_path, dst)
+    except Exception:
+        if writer is not None:
+            writer.abort()
+            os.remove(partial_path)
+        raise
+
+    stats = dict(masker.stats, frames=sum(masker.stats.values()), seconds=time.perf_counter() - start,
+                 peak_rss=peak_rss_bytes())
+    name = "animation" if isinstance(source, (bytes, bytearray)) else os.path.basename(os.path.normpath(source))
+    log(f"{name}: {stats['frames']} frames, {stats['inferred']} inferred, "
+        f"{stats['reused']} reused, {stats['warped']} warped in {stats['seconds']:.1f}s")
+    return stats
@@ -0,0 +1,3 @@
+def log(message):
+    """Simple logging function"""
+    print(f"[LOG] {message}")
@@ -0,0 +1,12 @@
+import os
+
+APP_DIR_NAME = "BG_Remover_Pro"
+
+
+def app_data_dir():
+    """Per-user data folder (LOCALAPPDATA on Windows, XDG cache elsewhere)"""
+    if os.name == 'nt':
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, APP_DIR_NAME)
@@ -0,0 +1,194 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from app_log import log
+from model_session import DEFAULT_MODEL, create_session
+from result_cache import ResultCache
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".webp")
+
+# Per-process state created by _init_worker: one model session, the result
+# cache handle and the processing options shared by every job
+_worker = {}
+
+
+def find_images(in_dir, exclude_dir=None):
+    """Yield every image under in_dir, sorted for a stable processing order.
+
+    exclude_dir and everything below it are skipped, so an output folder
+    inside in_dir is never read back as input.
+    """
+    exclude_dir = os.path.abspath(exclude_dir) if exclude_dir else None
+    for root, dirs, files in os.walk(in_dir):
+        dirs[:] = sorted(name for name in dirs if os.path.abspath(os.path.join(root, name)) != exclude_dir)
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+def output_path_for(src, in_dir, out_dir):
+    """Mirror src's location under out_dir, always as a PNG"""
+    relative = os.path.relpath(src, in_dir)
+    return os.path.join(out_dir, os.path.splitext(relative)[0] + ".png")
+
+
+def is_done(src, dst):
+    """An output counts as done if it exists and is not older than its input"""
+    try:
+        return os.path.getmtime(dst) >= os.path.getmtime(src)
+    except OSError:
+        return False
+
+
+def _init_worker(model_name, options):
+    _worker.update(options)
+    _worker["session"] = create_session(model_name, options.get("session_settings"))
+    _worker["model_name"] = model_name
+    _worker["cache"] = ResultCache(options["cache_dir"]) if options.get("cache_dir") else None
+
+
+def process_file(src, dst):
+    """Remove the background of src into dst and return per-stage timings"""
+    from pipeline import load_image, get_mask, cutout, mask_options
+
+    if _worker.get("tiled"):
+        return process_file_tiled(src, dst)
+
+    session = _worker["session"]
+    cache = _worker["cache"]
+    proxy_size = _worker.get("proxy_size")
+    timings = {}
+
+    start = time.perf_counter()
+    with open(src, "rb") as f:
+        data = f.read()
+    original = load_image(data)
+    original.load()
+    timings["decode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cache_key = None
+    if cache:
+        cache_key = ResultCache.make_key(data, _worker["model_name"], mask_options(proxy_size))
+    mask, _ = get_mask(original, session, cache, cache_key, proxy_size)
+    output = cutout(original, mask)
+    timings["inference"] = time.perf_counter() - start
+
+    # Write to a temporary name first so an interrupted run never leaves a
+    # truncated file that a later run would mistake for a finished output
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+    partial_path = dst + ".partial"
+    output.save(partial_path, "PNG")
+    os.replace(partial_path, dst)
+    timings["encode"] = time.perf_counter() - start
+
+    return timings
+
+
+def process_file_tiled(src, dst):
+    """Strip-by-strip variant of process_file for very large images"""
+    from pipeline import DEFAULT_PROXY_SIZE
+    from tiled import remove_background_tiled
+
+    os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+    start = time.perf_counter()
+    remove_background_tiled(
+        src,
+        dst,
+        _worker["session"],
+        proxy_size=_worker.get("proxy_size") or DEFAULT_PROXY_SIZE,
+        tile_rows=_worker["tile_rows"],
+        memory_limit=_worker["memory_limit"]
+    )
+    return {"tiled": time.perf_counter() - start}
+
+
+def run_batch(in_dir, out_dir, workers=None, model_name=DEFAULT_MODEL, overwrite=False,
+              cache_dir=None, proxy_size=None, tiled=False, tile_rows=None, memory_limit=None,
+              session_settings=None):
+    """Process every image in in_dir into out_dir using a pool of worker processes.
+
+    cache_dir enables the shared mask cache; None disables it. proxy_size
+    turns on downscaled inference with full-resolution mask upsampling.
+    tiled composites strip by strip within memory_limit bytes per image and
+    always uses downscaled inference; it does not use the mask cache.
+    session_settings holds the onnxruntime options (see settings.py).
+    """
+    from tiled import DEFAULT_TILE_ROWS, DEFAULT_MEMORY_LIMIT
+
+    if not os.path.isdir(in_dir):
+        raise FileNotFoundError(f"Input directory not found: {in_dir}")
+
+    jobs = []
+    skipped = 0
+    # Never read our own outputs back when out_dir is inside in_dir
+    for src in find_images(in_dir, out_dir):
+        dst = output_path_for(src, in_dir, out_dir)
+        if not overwrite and is_done(src, dst):
+            skipped += 1
+        else:
+            jobs.append((src, dst))
+
+    workers = workers or os.cpu_count() or 1
+    log(f"Found {len(jobs) + skipped} images, {skipped} already done, "
+        f"processing {len(jobs)} with {workers} workers (model: {model_name})")
+
+    stats = {
+        "processed": 0,
+        "skipped": skipped,
+        "failed": 0,
+        "stage_totals": {},
+    }
+    options = {
+        "cache_dir": None if tiled else cache_dir,
+        "proxy_size": proxy_size,
+        "tiled": tiled,
+        "tile_rows": tile_rows or DEFAULT_TILE_ROWS,
+        "memory_limit": memory_limit or DEFAULT_MEMORY_LIMIT,
+        "session_settings": session_settings,
+    }
+
+    start = time.perf_counter()
+    if jobs:
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(jobs)),
+            # Spawned workers behave the same on every platform and never
+            # inherit onnxruntime thread pools from the parent
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name, options)
+        ) as executor:
+            futures = {executor.submit(process_file, src, dst): src for src, dst in jobs}
+            for future in as_completed(futures):
+                src = futures[future]
+                try:
+                    timings = future.result()
+                except Exception as e:
+                    stats["failed"] += 1
+                    log(f"Failed to process {src}: {e}")
+                    continue
+                stats["processed"] += 1
+                for stage, seconds in timings.items():
+                    stats["stage_totals"][stage] = stats["stage_totals"].get(stage, 0.0) + seconds
+                done = stats["processed"] + stats["failed"]
+                if done % 50 == 0 or done == len(jobs):
+                    log(f"Progress: {done}/{len(jobs)}")
+    stats["wall_seconds"] = time.perf_counter() - start
+    return stats
+
+
+def print_summary(stats):
+    """Print throughput and per-stage timings for a finished batch"""
+    processed = stats["processed"]
+    wall = stats["wall_seconds"]
+    throughput = processed / wall if wall > 0 else 0.0
+
+    print(f"Processed: {processed}  Skipped: {stats['skipped']}  Failed: {stats['failed']}")
+    print(f"Wall time: {wall:.2f}s  Throughput: {throughput:.2f} images/sec")
+    if processed:
+        print("Per-stage timings (summed across workers):")
+        for stage, total in stats["stage_totals"].items():
+            print(f"  {stage:<10} total {total:8.2f}s  mean {total / processed * 1000:8.1f}ms")
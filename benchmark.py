@@ -0,0 +1,267 @@
+"""Reproducible timings of the removal pipeline, one stage at a time.
+
+Runs without a display or network: the inputs are synthetic images generated
+from a fixed seed plus the bundled sample, and inference is skipped (with a
+stand-in mask) when the model has not been downloaded yet. Each case runs in
+a fresh process so its peak RSS is its own.
+"""
+import io
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app_log import log
+from app_paths import app_data_dir
+from perf import peak_rss_bytes, percentile, format_bytes
+
+REPORT_VERSION = 1
+REPORT_PATH = os.path.join(app_data_dir(), "pipeline_benchmark.json")
+BUNDLED_SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "bg_icon.png")
+DEFAULT_SIZES = [(640, 480), (1920, 1080), (4032, 3024)]
+# decode is the full-size decode for the output, preview_decode the reduced
+# decode (draft mode for JPEGs) the GUI previews and runs the model on
+STAGES = ["decode", "preview_decode", "inference", "composite", "preview", "encode"]
+# Canvas size the GUI previews are resized to
+PREVIEW_SIZE = (800, 600)
+SYNTHETIC_SEED = 1234
+DEFAULT_THRESHOLD = 0.10
+# Slowdowns smaller than this are timer noise, whatever the percentage
+MIN_REGRESSION_SECONDS = 0.002
+
+
+def synthetic_image(width, height, seed=SYNTHETIC_SEED):
+    """A deterministic photo-like JPEG: noisy gradient background, textured subject"""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    background = np.stack([x / width * 200, y / height * 200, np.full_like(x, 120)], axis=-1)
+    subject = ((x - width / 2) / (width * 0.3)) ** 2 + ((y - height / 2) / (height * 0.4)) ** 2 <= 1
+    background[subject] = [230, 180, 140]
+    background += rng.normal(0, 6, background.shape).astype(np.float32)
+    image = Image.fromarray(np.clip(background, 0, 255).astype(np.uint8), "RGB")
+
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def benchmark_cases(samples=(), sizes=DEFAULT_SIZES, include_bundled=True):
+    """Describe the inputs; the bytes are produced inside each worker process"""
+    cases = [{"name": f"synthetic-{width}x{height}", "size": (width, height)} for width, height in sizes]
+    paths = list(samples)
+    if include_bundled and os.path.exists(BUNDLED_SAMPLE):
+        paths.insert(0, BUNDLED_SAMPLE)
+    cases.extend({"name": os.path.basename(path), "path": path} for path in paths)
+    return cases
+
+
+def _summarize(seconds):
+    return {
+        "p50": percentile(seconds, 50),
+        "p95": percentile(seconds, 95),
+        "mean": sum(seconds) / len(seconds),
+    }
+
+
+def _benchmark_case(case, runs, model_name, proxy_size, session_settings):
+    """Time every stage of one case; runs in a fresh process"""
+    from pipeline import LazyImage, predict_mask, cutout
+    from preview import MAX_PREVIEW_SIZE, PreviewPyramid
+
+    if "path" in case:
+        with open(case["path"], "rb") as f:
+            data = f.read()
+    else:
+        data = synthetic_image(*case["size"])
+
+    session = None
+    if model_name:
+        import rembg  # noqa: F401 - imported before timing so inference is only the model
+        from model_session import create_session
+        session = create_session(model_name, session_settings)
+
+    timings = {stage: [] for stage in STAGES if session or stage != "inference"}
+    totals = []
+    decoded_bytes = {}
+    # The first pass is a warm-up and is not recorded
+    for run in range(runs + 1):
+        times = {}
+
+        start = time.perf_counter()
+        lazy = LazyImage(data)
+        image = lazy.decode()
+        times["decode"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        preview_image = lazy.decode(MAX_PREVIEW_SIZE)
+        times["preview_decode"] = time.perf_counter() - start
+        decoded_bytes = {"decode": lazy.decodes[0]["bytes"], "preview_decode": lazy.decodes[1]["bytes"]}
+
+        if session:
+            start = time.perf_counter()
+            mask = predict_mask(image, session, proxy_size)
+            times["inference"] = time.perf_counter() - start
+        else:
+            mask = image.convert("L")
+
+        start = time.perf_counter()
+        output = cutout(image, mask)
+        times["composite"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        PreviewPyramid(preview_image, lazy.size).get(*PREVIEW_SIZE)
+        PreviewPyramid(output).get(*PREVIEW_SIZE)
+        times["preview"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        output.save(io.BytesIO(), "PNG")
+        times["encode"] = time.perf_counter() - start
+
+        if run > 0:
+            for stage, seconds in times.items():
+                timings[stage].append(seconds)
+            totals.append(sum(times.values()))
+
+    megapixels = image.width * image.height / 1e6
+    return {
+        "name": case["name"],
+        "width": image.width,
+        "height": image.height,
+        "runs": runs,
+        "stages": {stage: _summarize(seconds) for stage, seconds in timings.items()},
+        "decoded_bytes": decoded_bytes,
+        "total": _summarize(totals),
+        "images_per_second": len(totals) / sum(totals),
+        "megapixels_per_second": megapixels * len(totals) / sum(totals),
+        "peak_rss": peak_rss_bytes(),
+    }
+
+
+def _package_version(name):
+    from importlib import metadata
+
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def environment():
+    """Versions and hardware that a baseline is only comparable across"""
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "packages": {name: _package_version(name) for name in ("pillow", "numpy", "onnxruntime", "rembg")},
+    }
+
+
+def run_benchmark(cases, runs=5, model_name=None, proxy_size=None, session_settings=None, path=REPORT_PATH):
+    """Run every case and save the report as JSON to path.
+
+    model_name None skips inference, which keeps the run offline.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for case in cases:
+        log(f"Benchmarking {case['name']} ({runs} runs)...")
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results.append(executor.submit(_benchmark_case, case, runs, model_name, proxy_size,
+                                               session_settings).result())
+        except Exception as e:
+            log(f"Benchmark of {case['name']} failed: {e}")
+            results.append({"name": case["name"], "error": str(e)})
+
+    report = {
+        "version": REPORT_VERSION,
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "environment": environment(),
+        "model": model_name,
+        "proxy_size": proxy_size,
+        "runs": runs,
+        "cases": results,
+    }
+    if path:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        except OSError as e:
+            log(f"Could not save benchmark report: {e}")
+    return report
+
+
+def load_report(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare_to_baseline(report, baseline, threshold=DEFAULT_THRESHOLD):
+    """Compare p50 stage times with a baseline report.
+
+    Returns one row per case and stage found in both; a row is a regression
+    when it is more than threshold (a fraction) and MIN_REGRESSION_SECONDS
+    slower than the baseline.
+    """
+    baseline_cases = {case["name"]: case for case in baseline.get("cases", []) if "error" not in case}
+    rows = []
+    for case in report["cases"]:
+        old_case = baseline_cases.get(case["name"])
+        if "error" in case or old_case is None:
+            continue
+        stages = dict(case["stages"])
+        old_stages = dict(old_case["stages"])
+        # Totals are only comparable when the same stages ran
+        if stages.keys() == old_stages.keys():
+            stages["total"] = case["total"]
+            old_stages["total"] = old_case["total"]
+        for stage, summary in stages.items():
+            if stage not in old_stages:
+                continue
+            old, new = old_stages[stage]["p50"], summary["p50"]
+            change = (new - old) / old if old else 0.0
+            rows.append({
+                "case": case["name"],
+                "stage": stage,
+                "baseline": old,
+                "current": new,
+                "change": change,
+                "regression": change > threshold and new - old > MIN_REGRESSION_SECONDS,
+            })
+    return rows
+
+
+def format_report(report):
+    """p50/p95 per stage, throughput and peak RSS as a fixed-width table"""
+    lines = [f"{'Case':<26}{'Stage':<15}{'p50':>9}{'p95':>9}{'Decoded':>11}"]
+    for case in report["cases"]:
+        if "error" in case:
+            lines.append(f"{case['name']:<26}failed: {case['error']}")
+            continue
+        stages = dict(case["stages"], total=case["total"])
+        # Reports from before the reduced decode have no decoded sizes
+        decoded = case.get("decoded_bytes", {})
+        for index, (stage, summary) in enumerate(stages.items()):
+            name = case["name"] if index == 0 else ""
+            size = format_bytes(decoded[stage]) if stage in decoded else ""
+            lines.append(f"{name:<26}{stage:<15}{summary['p50'] * 1000:>7.1f}ms{summary['p95'] * 1000:>7.1f}ms"
+                         f"{size:>11}")
+        lines.append(f"{'':<26}{case['images_per_second']:.2f} images/s, "
+                     f"{case['megapixels_per_second']:.1f} MP/s, peak RSS {format_bytes(case['peak_rss'])}")
+    return "\n".join(lines)
+
+
+def format_comparison(rows):
+    lines = [f"{'Case':<26}{'Stage':<15}{'Baseline':>10}{'Current':>10}{'Change':>9}"]
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        lines.append(f"{row['case']:<26}{row['stage']:<15}{row['baseline'] * 1000:>8.1f}ms"
+                     f"{row['current'] * 1000:>8.1f}ms{row['change'] * 100:>+8.1f}%{flag}")
+    return "\n".join(lines)
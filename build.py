@@ -1,3 +1,4 @@
+import hashlib
 import os
 import sys
 import shutil
@@ -85,9 +86,15 @@ def build_exe():
             '--hidden-import=PIL.ImageQt',
             '--hidden-import=rembg',
             '--hidden-import=customtkinter',
+            '--hidden-import=tkinterdnd2',
+            '--collect-data=tkinterdnd2',   # tkdnd Tcl library for drag and drop
             
             # Add icon
             f'--icon={os.path.join(assets_dir, "bg_icon.ico")}',
+
+            # Show a splash while the onefile archive unpacks; the app closes
+            # it as soon as its own window has been painted
+            f'--splash={os.path.join(assets_dir, "bg_icon.png")}',
             
             # Optimize
             '--noupx',                      # Disable UPX compression
@@ -103,7 +110,19 @@ def build_exe():
         PyInstaller.__main__.run(args)
         
         print("\nBuild completed successfully!")
-        print(f"Executable can be found in: {os.path.join(dist_dir, 'BG_Remover_Pro.exe')}")
+        exe_path = os.path.join(dist_dir, 'BG_Remover_Pro.exe')
+        print(f"Executable can be found in: {exe_path}")
+
+        # The in-app updater refuses releases without a checksum; upload this
+        # file next to the exe
+        if os.path.exists(exe_path):
+            digest = hashlib.sha256()
+            with open(exe_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            with open(exe_path + '.sha256', 'w') as f:
+                f.write(f"{digest.hexdigest()} *BG_Remover_Pro.exe\n")
+            print(f"SHA-256 written to: {exe_path}.sha256")
         
         # Clean up .spec file if it exists
         spec_file = os.path.join(script_dir, 'BG_Remover_Pro.spec')
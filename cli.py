@@ -0,0 +1,449 @@
+import argparse
+import contextlib
+import os
+import sys
+
+from animation import DEFAULT_FPS, DEFAULT_REUSE_THRESHOLD
+from refine_options import (MATTING_BACKGROUND_THRESHOLD, MATTING_EPS, MATTING_ERODE, MATTING_FOREGROUND_THRESHOLD,
+                            MATTING_ITERATIONS, MATTING_RADIUS)
+from model_session import DEFAULT_MODEL, AVAILABLE_MODELS
+from pipeline import DEFAULT_PROXY_SIZE
+from settings import load_settings
+
+
+def cmd_batch(args):
+    from batch import run_batch, print_summary
+    from result_cache import default_cache_dir
+
+    stats = run_batch(
+        args.in_dir,
+        args.out_dir,
+        workers=args.workers,
+        model_name=args.model,
+        overwrite=args.overwrite,
+        cache_dir=None if args.no_cache else (args.cache_dir or default_cache_dir()),
+        proxy_size=args.proxy_size,
+        tiled=args.tiled,
+        tile_rows=args.tile_rows,
+        memory_limit=args.memory_limit * 1024 * 1024 if args.memory_limit else None,
+        session_settings=load_settings()
+    )
+    print_summary(stats)
+    return 1 if stats["failed"] else 0
+
+
+def cmd_remove(args):
+    from compositing import CompositeSource, DEFAULT_VARIANT
+    from encoding import OUTPUT_FORMATS, encode, save_output
+    from model_session import create_session
+    from pipeline import load_image, get_mask, mask_options
+    from result_cache import ResultCache
+
+    settings = load_settings()
+    options = {key: settings[key] for key in ("output_format", "png_compress_level", "png_optimize", "webp_method")}
+    if args.format:
+        options["output_format"] = args.format
+    stdout = sys.stdout.buffer
+    # Log lines would corrupt an image written to stdout, so they go to stderr
+    with contextlib.redirect_stdout(sys.stderr) if args.output == "-" else contextlib.nullcontext():
+        # Read into memory once; the same bytes are decoded and key the mask cache
+        if args.input == "-":
+            data = sys.stdin.buffer.read()
+        else:
+            with open(args.input, "rb") as f:
+                data = f.read()
+        original = load_image(data)
+        cache = None if args.no_cache else ResultCache()
+        cache_key = ResultCache.make_key(data, args.model, mask_options(args.proxy_size))
+        session = create_session(args.model, settings)
+        mask, _ = get_mask(original, session, cache, cache_key, args.proxy_size)
+        variant = dict(DEFAULT_VARIANT, matting=args.matting, threshold=args.threshold, edge_shift=args.edge_shift,
+                       feather=args.feather, remove_islands=args.remove_islands,
+                       matting_foreground_threshold=args.matting_foreground_threshold,
+                       matting_background_threshold=args.matting_background_threshold,
+                       matting_erode_size=args.matting_erode_size, matting_radius=args.matting_radius,
+                       matting_eps=args.matting_eps, matting_iterations=args.matting_iterations)
+        source = CompositeSource(original, mask)
+        if options["output_format"] == "mask":
+            output, mask = None, source.effective_mask(variant)
+        else:
+            output = source.render(variant)
+
+        if args.output == "-":
+            encode(output, stdout, options, mask)
+            stdout.flush()
+        else:
+            seconds, size = save_output(output, args.output, options, mask)
+            print(f"Saved {args.output} ({OUTPUT_FORMATS[options['output_format']][0]}) in {seconds:.2f}s")
+    return 0
+
+
+def cmd_remove_animation(args):
+    from animation import is_animated, remove_background_animation
+    from model_session import create_session
+    from perf import format_bytes
+
+    # Checked before the model is loaded; a still image goes through 'remove'
+    if not os.path.isdir(args.input) and not is_animated(args.input):
+        print(f"{args.input} is not an animated image or a folder of frames; use 'remove' for a still image",
+              file=sys.stderr)
+        return 1
+    settings = load_settings()
+    session = create_session(args.model, settings)
+    stats = remove_background_animation(args.input, args.output, session, args.proxy_size, mask_only=args.mask,
+                                        threshold=args.reuse_threshold / 100, warp=not args.no_warp, fps=args.fps,
+                                        compress_level=settings["png_compress_level"])
+    print(f"Saved {args.output}: {stats['frames']} frames, model run on {stats['inferred']}, "
+          f"mask reused on {stats['reused']}, warped on {stats['warped']}, "
+          f"{stats['seconds']:.1f}s, peak RSS {format_bytes(stats['peak_rss'])}")
+    return 0
+
+
+def cmd_compare_modes(args):
+    from perf import compare_modes, print_mode_comparison
+
+    print_mode_comparison(compare_modes(args.image, args.model, args.proxy_size, load_settings()))
+    return 0
+
+
+def cmd_compare_matting(args):
+    from perf import compare_matting, print_matting_comparison
+
+    print_matting_comparison(compare_matting(args.image, args.model, args.proxy_size, load_settings(),
+                                             args.mask, reference=not args.no_reference))
+    return 0
+
+
+def cmd_model_memory(args):
+    from perf import compare_model_loading, print_model_loading
+
+    print_model_loading(compare_model_loading(args.model, args.workers, load_settings()))
+    return 0
+
+
+def cmd_benchmark_models(args):
+    from model_benchmark import benchmark_models, format_results, pick_fastest, BENCHMARK_PATH
+
+    settings = load_settings()
+    for key in ("provider", "intra_op_num_threads", "inter_op_num_threads", "graph_optimization_level"):
+        value = getattr(args, key)
+        if value is not None:
+            settings[key] = value
+
+    results = benchmark_models(args.models, args.samples, args.runs, settings, args.reference)
+    print(format_results(results))
+    fastest = pick_fastest(results, args.min_agreement)
+    if fastest:
+        print(f"Fastest model with IoU >= {args.min_agreement}: {fastest}")
+    print(f"Results saved to {BENCHMARK_PATH}")
+    return 0
+
+
+def cmd_benchmark_batch(args):
+    from model_benchmark import benchmark_batch_sizes, format_batch_results, BATCH_BENCHMARK_PATH
+
+    results = benchmark_batch_sizes(args.model, args.samples, args.batch_sizes, args.images, args.runs,
+                                    load_settings())
+    print(format_batch_results(results))
+    print(f"Results saved to {BATCH_BENCHMARK_PATH}")
+    return 0
+
+
+def _parse_size(text):
+    try:
+        width, height = (int(part) for part in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {text!r}")
+    return width, height
+
+
+def cmd_benchmark(args):
+    from benchmark import (run_benchmark, benchmark_cases, format_report, load_report,
+                           compare_to_baseline, format_comparison, REPORT_PATH)
+    from model_session import model_is_downloaded
+
+    model_name = None if args.no_inference else args.model
+    if model_name and not model_is_downloaded(model_name):
+        print(f"Model '{model_name}' is not downloaded; skipping the inference stage")
+        model_name = None
+
+    cases = benchmark_cases(args.samples, args.sizes)
+    output = args.output or REPORT_PATH
+    report = run_benchmark(cases, args.runs, model_name, args.proxy_size, load_settings(), output)
+    print(format_report(report))
+    print(f"Report saved to {output}")
+
+    if not args.baseline:
+        return 0
+    rows = compare_to_baseline(report, load_report(args.baseline), args.threshold / 100)
+    print()
+    print(format_comparison(rows))
+    regressions = sum(row["regression"] for row in rows)
+    if regressions:
+        print(f"{regressions} stage(s) slower than the baseline by more than {args.threshold:g}%")
+        return 1
+    return 0
+
+
+def cmd_serve(args):
+    from server import serve
+
+    serve(
+        args.model,
+        load_settings(),
+        host=args.host,
+        port=args.port,
+        max_batch_size=args.max_batch_size,
+        max_wait=args.max_wait_ms / 1000,
+        max_queue=args.max_queue,
+        max_upload_bytes=args.max_upload_mb * 1024 * 1024
+    )
+    return 0
+
+
+def cmd_watch(args):
+    from watcher import FolderWatcher
+    from result_cache import default_cache_dir
+
+    watcher = FolderWatcher(args.in_dir, args.out_dir, args.state, args.interval, args.settle)
+    options = {
+        "cache_dir": None if args.no_cache else default_cache_dir(),
+        "proxy_size": args.proxy_size,
+        "session_settings": load_settings(),
+    }
+    try:
+        watcher.run(args.workers, args.model, options, once=args.once)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="remove_background_new",
+        description="Headless commands for Advanced Background Remover Pro. "
+                    "Run without arguments to start the GUI."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    batch_parser = subparsers.add_parser("batch", help="Remove backgrounds from every image in a folder")
+    batch_parser.add_argument("in_dir", help="Folder of input images (searched recursively)")
+    batch_parser.add_argument("out_dir", help="Folder for the PNG cutouts")
+    batch_parser.add_argument("-w", "--workers", type=int, default=None,
+                              help="Number of worker processes (default: CPU count)")
+    batch_parser.add_argument("-m", "--model", default=DEFAULT_MODEL, choices=AVAILABLE_MODELS,
+                              help=f"Model to use (default: {DEFAULT_MODEL})")
+    batch_parser.add_argument("--overwrite", action="store_true",
+                              help="Reprocess images whose output already exists")
+    batch_parser.add_argument("--cache-dir", default=None,
+                              help="Mask cache folder (default: per-user cache folder)")
+    batch_parser.add_argument("--no-cache", action="store_true",
+                              help="Always run the model instead of reusing cached masks")
+    batch_parser.add_argument("--proxy-size", type=int, default=None,
+                              help="Run the model on a copy at most this many pixels on its longest side "
+                                   f"and upsample the mask (e.g. {DEFAULT_PROXY_SIZE})")
+    batch_parser.add_argument("--tiled", action="store_true",
+                              help="Composite and write each image strip by strip to bound memory "
+                                   "(for panoramas and print-resolution scans)")
+    batch_parser.add_argument("--tile-rows", type=int, default=None,
+                              help="Rows per strip in --tiled mode (default: 256)")
+    batch_parser.add_argument("--memory-limit", type=int, default=None,
+                              help="Per-image memory ceiling in MB for --tiled mode (default: 1024)")
+    batch_parser.set_defaults(func=cmd_batch)
+
+    remove_parser = subparsers.add_parser(
+        "remove",
+        help="Remove the background of one image; use - to read stdin or write stdout"
+    )
+    remove_parser.add_argument("input", help="Input image, or - for stdin")
+    remove_parser.add_argument("output", help="Output file, or - for stdout")
+    remove_parser.add_argument("-m", "--model", default=DEFAULT_MODEL, choices=AVAILABLE_MODELS,
+                               help=f"Model to use (default: {DEFAULT_MODEL})")
+    remove_parser.add_argument("--format", default=None, choices=["png", "webp", "mask"],
+                               help="Output format (default: the one chosen in the GUI, PNG unless changed)")
+    remove_parser.add_argument("--proxy-size", type=int, default=None,
+                               help="Run the model on a copy at most this many pixels on its longest side")
+    remove_parser.add_argument("--no-cache", action="store_true",
+                               help="Always run the model instead of reusing a cached mask")
+    refine_group = remove_parser.add_argument_group("mask refinement (sizes in pixels at 2000 px, scaled to the image)")
+    refine_group.add_argument("--matting", action="store_true", help="Refine hair and soft edges with alpha matting")
+    refine_group.add_argument("--matting-foreground-threshold", type=int, default=MATTING_FOREGROUND_THRESHOLD,
+                              metavar="LEVEL", help="Alpha above this (0-255) after eroding is known foreground "
+                                                    f"(default: {MATTING_FOREGROUND_THRESHOLD}, as rembg's -af)")
+    refine_group.add_argument("--matting-background-threshold", type=int, default=MATTING_BACKGROUND_THRESHOLD,
+                              metavar="LEVEL", help="Alpha below this (0-255) after dilating is known background "
+                                                    f"(default: {MATTING_BACKGROUND_THRESHOLD}, as rembg's -ab)")
+    refine_group.add_argument("--matting-erode-size", type=int, default=MATTING_ERODE, metavar="PIXELS",
+                              help=f"Erosion of the known regions (default: {MATTING_ERODE}, as rembg's -ae)")
+    refine_group.add_argument("--matting-radius", type=int, default=MATTING_RADIUS, metavar="PIXELS",
+                              help=f"Window radius of the matting solve (default: {MATTING_RADIUS})")
+    refine_group.add_argument("--matting-eps", type=float, default=MATTING_EPS, metavar="VALUE",
+                              help=f"Regularisation of the matting solve (default: {MATTING_EPS:g})")
+    refine_group.add_argument("--matting-iterations", type=int, default=MATTING_ITERATIONS, metavar="COUNT",
+                              help=f"Solver iterations; fewer is faster and rougher (default: {MATTING_ITERATIONS})")
+    refine_group.add_argument("--remove-islands", type=float, default=0, metavar="PERCENT",
+                              help="Remove specks and fill holes smaller than this percentage of the image")
+    refine_group.add_argument("--edge-shift", type=int, default=0, metavar="PIXELS",
+                              help="Grow (positive) or shrink (negative) the mask")
+    refine_group.add_argument("--threshold", type=int, default=None, metavar="PERCENT",
+                              help="Hard edges: alpha at or above this becomes opaque, the rest transparent")
+    refine_group.add_argument("--feather", type=int, default=0, metavar="PIXELS", help="Soften the edge")
+    remove_parser.set_defaults(func=cmd_remove)
+
+    animation_parser = subparsers.add_parser(
+        "remove-animation",
+        help="Remove the background of an animated GIF, WebP or PNG or a folder of frames, frame by frame"
+    )
+    animation_parser.add_argument("input", help="Animated image, or a folder of frames in name order")
+    animation_parser.add_argument("output", help="Animated PNG (.png), or a folder for numbered PNG frames")
+    animation_parser.add_argument("-m", "--model", default=DEFAULT_MODEL, choices=AVAILABLE_MODELS,
+                                  help=f"Model to use (default: {DEFAULT_MODEL})")
+    animation_parser.add_argument("--proxy-size", type=int, default=None,
+                                  help="Run the model on a copy at most this many pixels on its longest side")
+    animation_parser.add_argument("--mask", action="store_true", help="Write the masks instead of cutouts")
+    animation_parser.add_argument("--reuse-threshold", type=float, default=DEFAULT_REUSE_THRESHOLD * 100,
+                                  metavar="PERCENT",
+                                  help="Reuse the last mask when at most this percentage of the frame changed "
+                                       f"(default: {DEFAULT_REUSE_THRESHOLD * 100:g}; 0 runs the model on every "
+                                       "changed frame)")
+    animation_parser.add_argument("--no-warp", action="store_true",
+                                  help="Do not reuse masks moved to follow a pan or a sliding subject")
+    animation_parser.add_argument("--fps", type=float, default=DEFAULT_FPS,
+                                  help=f"Frame rate of a folder of frames (default: {DEFAULT_FPS})")
+    animation_parser.set_defaults(func=cmd_remove_animation)
+
+    compare_parser = subparsers.add_parser(
+        "compare-modes",
+        help="Compare wall time and peak memory of full-resolution and downscaled inference"
+    )
+    compare_parser.add_argument("image", help="Image to process")
+    compare_parser.add_argument("-m", "--model", default=DEFAULT_MODEL, choices=AVAILABLE_MODELS,
+                                help=f"Model to use (default: {DEFAULT_MODEL})")
+    compare_parser.add_argument("--proxy-size", type=int, default=DEFAULT_PROXY_SIZE,
+                                help=f"Longest side of the inference proxy (default: {DEFAULT_PROXY_SIZE})")
+    compare_parser.set_defaults(func=cmd_compare_modes)
+
+    matting_parser = subparsers.add_parser(
+        "compare-matting",
+        help="Compare time, memory and result of rembg's alpha matting and the band-limited matting"
+    )
+    matting_parser.add_argument("image", help="Image to matte")
+    matting_parser.add_argument("--mask", default=None, help="Mask to refine (default: run the model)")
+    matting_parser.add_argument("-m", "--model", default=DEFAULT_MODEL, choices=AVAILABLE_MODELS,
+                                help=f"Model to use (default: {DEFAULT_MODEL})")
+    matting_parser.add_argument("--proxy-size", type=int, default=None,
+                                help="Run the model on a copy at most this many pixels on its longest side")
+    matting_parser.add_argument("--no-reference", action="store_true",
+                                help="Skip rembg's matting, which needs several GB of memory on large images")
+    matting_parser.set_defaults(func=cmd_compare_matting)
+
+    memory_parser = subparsers.add_parser(
+        "model-memory",
+        help="Compare load time and memory of workers loading the original model and the optimized copy"
+    )
+    memory_parser.add_argument("-m", "--model", default=DEFAULT_MODEL, choices=AVAILABLE_MODELS,
+                               help=f"Model to use (default: {DEFAULT_MODEL})")
+    memory_parser.add_argument("-w", "--workers", type=int, default=2,
+                               help="Worker processes loading the model at the same time (default: 2)")
+    memory_parser.set_defaults(func=cmd_model_memory)
+
+    models_parser = subparsers.add_parser(
+        "benchmark-models",
+        help="Measure load time, latency and memory of each model on this machine"
+    )
+    models_parser.add_argument("samples", nargs="*", help="Sample images (default: the bundled icon)")
+    models_parser.add_argument("--models", nargs="+", default=AVAILABLE_MODELS, choices=AVAILABLE_MODELS,
+                               help="Models to compare (default: all)")
+    models_parser.add_argument("--runs", type=int, default=3, help="Timed runs per sample (default: 3)")
+    models_parser.add_argument("--reference", default=None, choices=AVAILABLE_MODELS,
+                               help="Model whose masks define quality (default: the first model)")
+    models_parser.add_argument("--min-agreement", type=float, default=0.9,
+                               help="Minimum mask IoU with the reference for a model to be acceptable")
+    models_parser.add_argument("--provider", default=None, help="onnxruntime execution provider")
+    models_parser.add_argument("--intra-op-num-threads", type=int, default=None)
+    models_parser.add_argument("--inter-op-num-threads", type=int, default=None)
+    models_parser.add_argument("--graph-optimization-level", default=None,
+                               choices=["disable", "basic", "extended", "all"])
+    models_parser.set_defaults(func=cmd_benchmark_models)
+
+    batch_bench_parser = subparsers.add_parser(
+        "benchmark-batch",
+        help="Compare inference throughput at several batch sizes"
+    )
+    batch_bench_parser.add_argument("samples", nargs="*",
+                                    help="Sample images, repeated as needed (default: synthetic 640x480 photos)")
+    batch_bench_parser.add_argument("-m", "--model", default=DEFAULT_MODEL, choices=AVAILABLE_MODELS,
+                                    help=f"Model to use (default: {DEFAULT_MODEL})")
+    batch_bench_parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4, 8, 16],
+                                    help="Images per model run (default: 1 4 8 16)")
+    batch_bench_parser.add_argument("--images", type=int, default=16,
+                                    help="Images processed per timed run (default: 16)")
+    batch_bench_parser.add_argument("--runs", type=int, default=3, help="Timed runs per batch size (default: 3)")
+    batch_bench_parser.set_defaults(func=cmd_benchmark_batch)
+
+    bench_parser = subparsers.add_parser(
+        "benchmark",
+        help="Time decode, inference, compositing, preview and PNG encode on fixed inputs"
+    )
+    bench_parser.add_argument("samples", nargs="*",
+                              help="Extra sample images (synthetic images and the bundled icon are always used)")
+    bench_parser.add_argument("--sizes", nargs="+", type=_parse_size, default=[(640, 480), (1920, 1080), (4032, 3024)],
+                              help="Synthetic image sizes as WIDTHxHEIGHT (default: 640x480 1920x1080 4032x3024)")
+    bench_parser.add_argument("--runs", type=int, default=5, help="Timed runs per image (default: 5)")
+    bench_parser.add_argument("-m", "--model", default=DEFAULT_MODEL, choices=AVAILABLE_MODELS,
+                              help=f"Model to use (default: {DEFAULT_MODEL})")
+    bench_parser.add_argument("--no-inference", action="store_true",
+                              help="Skip the model and time the rest of the pipeline only")
+    bench_parser.add_argument("--proxy-size", type=int, default=None,
+                              help="Time downscaled inference at this proxy size")
+    bench_parser.add_argument("-o", "--output", default=None,
+                              help="Where to write the JSON report (default: app data folder)")
+    bench_parser.add_argument("--baseline", default=None,
+                              help="Earlier JSON report to compare with; exits 1 on a regression")
+    bench_parser.add_argument("--threshold", type=float, default=10,
+                              help="Slowdown in percent that counts as a regression (default: 10)")
+    bench_parser.set_defaults(func=cmd_benchmark)
+
+    watch_parser = subparsers.add_parser("watch", help="Process images as they are dropped into a folder")
+    watch_parser.add_argument("in_dir", help="Folder to watch (including subfolders)")
+    watch_parser.add_argument("out_dir", help="Folder for the PNG cutouts")
+    watch_parser.add_argument("-w", "--workers", type=int, default=2,
+                              help="Number of worker processes (default: 2)")
+    watch_parser.add_argument("-m", "--model", default=DEFAULT_MODEL, choices=AVAILABLE_MODELS,
+                              help=f"Model to use (default: {DEFAULT_MODEL})")
+    watch_parser.add_argument("--interval", type=float, default=2.0,
+                              help="Seconds between folder scans (default: 2)")
+    watch_parser.add_argument("--settle", type=float, default=2.0,
+                              help="Seconds a file's size and mtime must stay unchanged before it is processed "
+                                   "(default: 2)")
+    watch_parser.add_argument("--state", default=None,
+                              help="State file recording processed images (default: inside OUT_DIR)")
+    watch_parser.add_argument("--proxy-size", type=int, default=None,
+                              help="Run the model on a copy at most this many pixels on its longest side")
+    watch_parser.add_argument("--no-cache", action="store_true",
+                              help="Always run the model instead of reusing cached masks")
+    watch_parser.add_argument("--once", action="store_true",
+                              help="Process what is in the folder now, then exit")
+    watch_parser.set_defaults(func=cmd_watch)
+
+    serve_parser = subparsers.add_parser("serve", help="Run a local HTTP service for other programs")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    serve_parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765)")
+    serve_parser.add_argument("-m", "--model", default=DEFAULT_MODEL, choices=AVAILABLE_MODELS,
+                              help=f"Model to use (default: {DEFAULT_MODEL})")
+    serve_parser.add_argument("--max-batch-size", type=int, default=8,
+                              help="Most requests run in one micro-batch (default: 8)")
+    serve_parser.add_argument("--max-wait-ms", type=float, default=10,
+                              help="How long a micro-batch waits to fill up (default: 10)")
+    serve_parser.add_argument("--max-queue", type=int, default=32,
+                              help="Requests handled at once before new ones get 503 (default: 32)")
+    serve_parser.add_argument("--max-upload-mb", type=int, default=50,
+                              help="Largest accepted upload in MB (default: 50)")
+    serve_parser.set_defaults(func=cmd_serve)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
@@ -0,0 +1,152 @@
+"""Images in and out of the system clipboard and drag-and-drop, kept in memory.
+
+Nothing here writes a temporary file: pasted and dropped image data becomes
+bytes or a PIL image for the processing pipeline, and copied results are
+handed to the clipboard as in-memory PNG (and DIB on Windows) data.
+"""
+import base64
+import io
+import os
+import re
+import shutil
+import subprocess
+import sys
+from urllib.parse import unquote, urlparse
+
+from batch import IMAGE_EXTENSIONS, find_images
+
+DATA_URI_PATTERN = re.compile(r"^data:image/[\w.+-]+;base64,(.*)$", re.DOTALL)
+# The GUI also opens GIFs; animated ones are saved frame by frame
+OPEN_EXTENSIONS = IMAGE_EXTENSIONS + (".gif",)
+
+
+class ClipboardError(Exception):
+    """The clipboard could not be read or written"""
+
+
+def image_sources(texts):
+    """Turn dropped or pasted strings into pipeline sources.
+
+    Paths and file:// URIs of images become paths (folders are expanded to
+    the images inside them) and data:image URIs become their decoded bytes.
+    Anything else is ignored.
+    """
+    sources = []
+    for text in texts:
+        text = text.strip()
+        match = DATA_URI_PATTERN.match(text)
+        if match:
+            try:
+                sources.append(base64.b64decode(match.group(1), validate=False))
+            except ValueError:
+                pass
+            continue
+        if text.startswith("file://"):
+            parsed = urlparse(text)
+            text = unquote(parsed.path)
+            # file:///C:/photo.jpg has a leading slash before the drive letter
+            if os.name == 'nt' and re.match(r"^/[A-Za-z]:", text):
+                text = text[1:]
+        if os.path.isdir(text):
+            sources.extend(find_images(text))
+        elif os.path.isfile(text) and text.lower().endswith(OPEN_EXTENSIONS):
+            sources.append(text)
+    return sources
+
+
+def paste_sources(tk_widget):
+    """Sources from the clipboard: a PIL image, image files, or image paths and URIs as text"""
+    from PIL import ImageGrab
+
+    error = None
+    try:
+        content = ImageGrab.grabclipboard()
+    except (NotImplementedError, ChildProcessError, OSError) as e:
+        # No image tool available (Linux without xclip / wl-paste); text may still work
+        content, error = None, e
+    if isinstance(content, list):
+        return image_sources(content)
+    if content is not None:
+        return [content]
+
+    try:
+        text = tk_widget.clipboard_get()
+    except Exception:
+        text = ""
+    sources = image_sources(text.splitlines())
+    if not sources and error is not None:
+        raise ClipboardError(f"Could not read an image from the clipboard: {error}")
+    return sources
+
+
+def copy_image(image):
+    """Put image on the clipboard as PNG (keeping transparency) and, on Windows, as a DIB"""
+    png = io.BytesIO()
+    # Speed matters more than size for data that never leaves this machine
+    image.save(png, "PNG", compress_level=1)
+    png_bytes = png.getvalue()
+
+    if os.name == 'nt':
+        _copy_windows(image, png_bytes)
+    elif sys.platform == "darwin":
+        script = f"set the clipboard to «data PNGf{png_bytes.hex()}»"
+        _run_clipboard_tool(["osascript", "-"], script.encode("utf-8"))
+    elif shutil.which("wl-copy") and os.getenv("WAYLAND_DISPLAY"):
+        _run_clipboard_tool(["wl-copy", "--type", "image/png"], png_bytes)
+    elif shutil.which("xclip"):
+        _run_clipboard_tool(["xclip", "-selection", "clipboard", "-t", "image/png", "-i"], png_bytes)
+    else:
+        raise ClipboardError("Copying images needs wl-copy (Wayland) or xclip (X11)")
+
+
+def _run_clipboard_tool(command, data):
+    try:
+        subprocess.run(command, input=data, check=True, timeout=30,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except (OSError, subprocess.SubprocessError) as e:
+        raise ClipboardError(f"{command[0]} failed: {e}")
+
+
+def _copy_windows(image, png_bytes):
+    import ctypes
+    from ctypes import wintypes
+
+    CF_DIB = 8
+    GMEM_MOVEABLE = 0x0002
+    user32 = ctypes.windll.user32
+    kernel32 = ctypes.windll.kernel32
+    kernel32.GlobalAlloc.argtypes = [wintypes.UINT, ctypes.c_size_t]
+    kernel32.GlobalAlloc.restype = wintypes.HGLOBAL
+    kernel32.GlobalLock.argtypes = [wintypes.HGLOBAL]
+    kernel32.GlobalLock.restype = wintypes.LPVOID
+    kernel32.GlobalUnlock.argtypes = [wintypes.HGLOBAL]
+    kernel32.GlobalFree.argtypes = [wintypes.HGLOBAL]
+    user32.OpenClipboard.argtypes = [wintypes.HWND]
+    user32.SetClipboardData.argtypes = [wintypes.UINT, wintypes.HANDLE]
+    user32.SetClipboardData.restype = wintypes.HANDLE
+    user32.RegisterClipboardFormatW.argtypes = [wintypes.LPCWSTR]
+    user32.RegisterClipboardFormatW.restype = wintypes.UINT
+
+    # A DIB is a BMP file without its 14-byte file header; it has no alpha,
+    # so programs that understand the registered "PNG" format prefer that
+    bmp = io.BytesIO()
+    image.convert("RGB").save(bmp, "BMP")
+    formats = [(CF_DIB, bmp.getvalue()[14:]), (user32.RegisterClipboardFormatW("PNG"), png_bytes)]
+
+    if not user32.OpenClipboard(None):
+        raise ClipboardError("The clipboard is in use by another program")
+    try:
+        user32.EmptyClipboard()
+        for clipboard_format, data in formats:
+            handle = kernel32.GlobalAlloc(GMEM_MOVEABLE, len(data))
+            if not handle:
+                raise ClipboardError("Out of memory copying to the clipboard")
+            pointer = kernel32.GlobalLock(handle)
+            ctypes.memmove(pointer, data, len(data))
+            kernel32.GlobalUnlock(handle)
+            # The clipboard owns the memory once SetClipboardData succeeds
+            if not user32.SetClipboardData(clipboard_format, handle):
+                kernel32.GlobalFree(handle)
+                raise ClipboardError("Could not put the image on the clipboard")
+    finally:
+        user32.CloseClipboard()
@@ -0,0 +1,126 @@
+"""Rendering of output variants from an original image and its raw model mask.
+
+The model runs once per image; changing the background or refining the mask
+(mask_refine) only recomposites. Sizes that depend on the image (blur radius,
+matting erosion, edge shift, feather) scale with its longest side, so a variant
+rendered on the reduced preview source looks like the full-size render.
+"""
+from PIL import Image, ImageColor, ImageFilter, ImageOps
+
+from pipeline import cutout, make_proxy
+from preview import MAX_PREVIEW_SIZE
+from refine_options import REFINE_DEFAULTS, matting_options
+from tracing import span
+
+BACKGROUNDS = ["transparent", "color", "blur", "image"]
+ALPHA_THRESHOLDS = [25, 50, 75]
+# Edge shifts and feather sizes offered in the GUI, in pixels at 2000 px
+EDGE_SHIFTS = [-8, -4, -2, 2, 4, 8]
+FEATHER_SIZES = [2, 4, 8]
+# Specks and holes smaller than this percentage of the image are removed
+ISLAND_AREA_PERCENT = 0.1
+DEFAULT_VARIANT = dict({
+    "background": "transparent",
+    "color": "#ffffff",
+    "background_path": None,
+}, **REFINE_DEFAULTS)
+# Blur radius as a fraction of the longest side
+BLUR_FRACTION = 0.015
+# The blurred background is computed on a copy this many times smaller
+BLUR_REDUCE = 4
+
+
+class CompositeSource:
+    """An original image and its raw mask, rendered into any variant without the model"""
+
+    def __init__(self, image, mask):
+        self.image = image if image.mode == "RGB" else image.convert("RGB")
+        self.mask = mask
+        self.size = self.image.size
+        self._matted = None
+        self._matted_options = None
+        self._blurred = None
+        self._backgrounds = {}
+        self._preview = None
+
+    def preview(self, max_size=MAX_PREVIEW_SIZE):
+        """A reduced copy for on-screen variants, built once"""
+        if self._preview is None:
+            if max(self.size) <= max_size:
+                self._preview = self
+            else:
+                image = make_proxy(self.image, max_size)
+                self._preview = CompositeSource(image, self.mask.resize(image.size, Image.Resampling.BILINEAR))
+        return self._preview
+
+    def images(self):
+        """The pixel buffers held for rendering, for memory accounting"""
+        images = [self.image, self.mask, self._blurred, *self._backgrounds.values(), *(self._matted or ())]
+        if self._preview is not None and self._preview is not self:
+            images.extend(self._preview.images())
+        return images
+
+    def close(self):
+        """Free the image and everything computed from it; the mask belongs to the caller"""
+        for image in self.images():
+            if image is not None and image is not self.mask:
+                image.close()
+        self._matted = self._blurred = self._preview = None
+        self._backgrounds = {}
+
+    def _matted_layers(self, variant):
+        """Alpha matting's foreground colours and mask; the slowest refinement, so computed once per parameters"""
+        from mask_refine import alpha_matte
+
+        options = matting_options(variant)
+        if self._matted is None or self._matted_options != options:
+            with span("matting", width=self.size[0], height=self.size[1]):
+                self._matted = alpha_matte(self.image, self.mask, options)
+            self._matted_options = options
+        return self._matted
+
+    def foreground_and_mask(self, variant):
+        """Foreground colours and the refined alpha mask a variant composites with"""
+        # Imported on first use: mask_refine needs NumPy, which the GUI does not load at startup
+        from mask_refine import refine_mask
+
+        if variant.get("matting"):
+            foreground, mask = self._matted_layers(variant)
+        else:
+            foreground, mask = self.image, self.mask
+        return foreground, refine_mask(mask, variant)
+
+    def effective_mask(self, variant):
+        return self.foreground_and_mask(variant)[1]
+
+    def render(self, variant):
+        """The output image for variant: RGBA when transparent, RGB otherwise"""
+        foreground, mask = self.foreground_and_mask(variant)
+        background = variant.get("background", "transparent")
+        with span("composite", background=background, width=self.size[0], height=self.size[1]):
+            if background == "transparent":
+                return cutout(foreground, mask)
+            return Image.composite(foreground, self._background(variant), mask)
+
+    def _background(self, variant):
+        background = variant["background"]
+        if background == "color":
+            return Image.new("RGB", self.size, ImageColor.getrgb(variant.get("color") or "#ffffff"))
+        if background == "blur":
+            if self._blurred is None:
+                # Blurring a reduced copy and scaling it back up is indistinguishable
+                # from a full-size blur at this radius and far cheaper
+                small = self.image.reduce(BLUR_REDUCE) if min(self.size) >= 8 * BLUR_REDUCE else self.image
+                radius = max(self.size) * BLUR_FRACTION * small.width / self.size[0]
+                self._blurred = small.filter(ImageFilter.GaussianBlur(radius)).resize(self.size, Image.Resampling.BILINEAR)
+            return self._blurred
+        if background == "image":
+            path = variant.get("background_path")
+            if not path:
+                raise ValueError("No background image chosen")
+            if path not in self._backgrounds:
+                with Image.open(path) as picture:
+                    picture = ImageOps.exif_transpose(picture).convert("RGB")
+                    self._backgrounds = {path: ImageOps.fit(picture, self.size, Image.Resampling.LANCZOS)}
+            return self._backgrounds[path]
+        raise ValueError(f"Unknown background: {background}")
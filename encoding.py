@@ -0,0 +1,77 @@
+import io
+import os
+import time
+
+from tracing import span
+
+# format key: (label, file extension, file dialog description)
+OUTPUT_FORMATS = {
+    "png": ("PNG", ".png", "PNG files"),
+    "webp": ("Lossless WebP", ".webp", "WebP files"),
+    "mask": ("Mask only (8-bit grayscale PNG)", ".png", "PNG files"),
+}
+PNG_COMPRESS_LEVELS = [1, 3, 6, 9]
+
+# Presets timed by compare_encoders, roughly from fastest to smallest
+ENCODER_PRESETS = [
+    {"output_format": "png", "png_compress_level": 1, "png_optimize": False},
+    {"output_format": "png", "png_compress_level": 6, "png_optimize": False},
+    {"output_format": "png", "png_compress_level": 9, "png_optimize": True},
+    {"output_format": "webp", "webp_method": 0},
+    {"output_format": "webp", "webp_method": 4},
+    {"output_format": "mask", "png_compress_level": 6, "png_optimize": False},
+]
+
+
+def describe(options):
+    """Short label for a set of encoder options"""
+    output_format = options.get("output_format", "png")
+    if output_format == "webp":
+        return f"WebP lossless, method {options.get('webp_method', 4)}"
+    label = "Mask PNG" if output_format == "mask" else "PNG"
+    if options.get("png_optimize"):
+        return f"{label}, optimized"
+    return f"{label}, level {options.get('png_compress_level', 6)}"
+
+
+def encode(image, fp, options, mask=None):
+    """Write a cutout to the file object fp in the format options choose.
+
+    The mask format writes mask, or the alpha channel of image when no mask
+    is given.
+
+    optimize makes Pillow search for the smallest PNG at level 9, which is
+    much slower than any compress level on its own.
+    """
+    output_format = options.get("output_format", "png")
+    if output_format == "webp":
+        # In lossless mode method trades encode time for size (0 fastest, 6 smallest)
+        image.save(fp, "WEBP", lossless=True, method=options.get("webp_method", 4))
+        return
+
+    if output_format == "mask":
+        image = mask if mask is not None else image.getchannel("A")
+    image.save(fp, "PNG", compress_level=options.get("png_compress_level", 6),
+               optimize=bool(options.get("png_optimize", False)))
+
+
+def save_output(image, path, options, mask=None):
+    """Encode image to path and return (seconds, bytes written)"""
+    start = time.perf_counter()
+    partial_path = path + ".partial"
+    with span("encode_save", format=describe(options)):
+        with open(partial_path, "wb") as f:
+            encode(image, f, options, mask)
+        os.replace(partial_path, path)
+    return time.perf_counter() - start, os.path.getsize(path)
+
+
+def compare_encoders(image, presets=ENCODER_PRESETS, mask=None):
+    """Encode image in memory with every preset; returns (label, seconds, size) tuples"""
+    results = []
+    for options in presets:
+        buffer = io.BytesIO()
+        start = time.perf_counter()
+        encode(image, buffer, options, mask)
+        results.append((describe(options), time.perf_counter() - start, buffer.tell()))
+    return results
@@ -0,0 +1,382 @@
+"""The images opened together in the GUI, and the pipelines that process them.
+
+Opened images go through a decode -> infer -> composite StagePipeline, so the
+next image decodes while the model runs on the current one. Save All sends the
+finished images through a second decode -> composite -> encode pipeline.
+
+An image can come from a file, from encoded bytes (a drop or paste) or as an
+already decoded PIL image (a clipboard bitmap); none of them is written to a
+temporary file, and a clipboard bitmap is kept as PNG bytes once its preview
+is decoded. Opening reads only the image header; the pixels are decoded
+at preview size (JPEGs at a reduced DCT scale), and the model and the preview
+both work on that decode. The full-resolution original is decoded only to
+render a saved or copied output, and the mask is brought up to its size then.
+Animated images are previewed by their first frame and saved as animated
+PNGs, every frame streamed through animation.remove_background_animation.
+
+Every item is tracked by an image_store.ImageStore, which drops the previews
+of images not viewed recently when the opened images outgrow its budget.
+"""
+import io
+import itertools
+import os
+from pathlib import Path
+
+from PIL import Image
+
+from compositing import CompositeSource
+from encoding import OUTPUT_FORMATS, save_output
+from image_store import ImageStore, pixel_bytes
+from pipeline import LazyImage, describe_decode, fit_mask, get_mask, mask_options, shrink_image
+from preview import MAX_PREVIEW_SIZE, PreviewPyramid
+from result_cache import ResultCache
+from stages import StagePipeline
+from tracing import tracer, span
+
+THUMBNAIL_SIZE = 96
+# Numbers the names of images that have no file name
+_unnamed_counter = itertools.count(1)
+
+
+def make_thumbnail(pyramid, size=THUMBNAIL_SIZE):
+    """A thumbnail from the smallest level of a PreviewPyramid"""
+    thumbnail = pyramid.levels[-1].copy()
+    thumbnail.thumbnail((size, size))
+    return thumbnail
+
+
+class SessionItem:
+    """One opened image and everything computed for it so far.
+
+    Only the preview-size mask, reduced copies and the encoded bytes of
+    in-memory images are kept; the full-resolution original is decoded when
+    the image is saved.
+    """
+
+    def __init__(self, path=None, data=None, image=None, name=None):
+        self.path = path
+        self.data = data
+        self.image = image
+        self.name = name or os.path.basename(path)
+        # queued, decode, infer, composite, done or failed
+        self.state = "queued"
+        self.error = None
+        self.thumbnail = None
+        self.original_preview = None
+        self.output_preview = None
+        self.preview_source = None
+        self.mask = None
+        self.proxy_size = None
+        self.variant = None
+        # Upright size of the original, and a record of each decode of it
+        self.full_size = None
+        self.decodes = []
+        self.animated = False
+        self.cache_hit = False
+        self.trace = None
+
+    @property
+    def done(self):
+        return self.state == "done"
+
+    @classmethod
+    def from_source(cls, source, label="Pasted image"):
+        """An item for a path, encoded image bytes or a PIL image"""
+        if isinstance(source, Image.Image):
+            return cls(image=source, name=f"{label} {next(_unnamed_counter)}")
+        if isinstance(source, (bytes, bytearray)):
+            return cls(data=bytes(source), name=f"{label} {next(_unnamed_counter)}")
+        return cls(path=source)
+
+    @property
+    def stem(self):
+        """Base name for saved outputs"""
+        return Path(self.path).stem if self.path else self.name
+
+    def read(self):
+        """Encoded bytes of the image, or None for a decoded clipboard image"""
+        if self.data is not None:
+            return self.data
+        if self.path is not None:
+            return Path(self.path).read_bytes()
+        return None
+
+    def decode(self, max_size=None, data=None):
+        """The upright original, reduced to at most max_size on its longest side if given"""
+        if self.image is not None:
+            self.full_size = self.image.size
+            self.image.load()
+            if max_size and max(self.image.size) > max_size:
+                with span("reduce", size=max_size):
+                    return shrink_image(self.image, max_size)
+            return self.image
+        lazy = LazyImage(data if data is not None else self.read())
+        self.full_size = lazy.size
+        self.animated = lazy.animated
+        image = lazy.decode(max_size)
+        self.decodes.extend(lazy.decodes)
+        return image
+
+    def full_source(self):
+        """The full-resolution original and mask, for rendering a saved output"""
+        original = self.decode()
+        # Fast Mode masks keep snapping to the image's edges as they are enlarged
+        guide = self.preview_original() if self.proxy_size else None
+        return CompositeSource(original, fit_mask(self.mask, original, guide))
+
+    def save_animation(self, path, session, variant, options):
+        """Process every frame of an animated item into the animated PNG path"""
+        from animation import remove_background_animation
+
+        source = self.path if self.path is not None else self.data
+        return remove_background_animation(source, path, session, self.proxy_size, variant,
+                                           mask_only=options["output_format"] == "mask",
+                                           compress_level=options.get("png_compress_level", 6))
+
+    def preview_original(self):
+        """The original at preview size, decoded again if its previews were dropped"""
+        preview = self.original_preview
+        if preview is not None:
+            return preview.levels[0]
+        return self.decode(MAX_PREVIEW_SIZE)
+
+    def keep_encoded(self):
+        """Swap a decoded clipboard image for lossless PNG bytes, a fraction of its size"""
+        if self.image is None:
+            return
+        buffer = io.BytesIO()
+        with span("encode", format="PNG"):
+            self.image.save(buffer, "PNG", compress_level=1)
+        self.data = buffer.getvalue()
+        # The preview decode may be this very image, so it is dropped, not closed
+        self.image = None
+
+    @property
+    def has_previews(self):
+        return None not in (self.original_preview, self.output_preview, self.preview_source)
+
+    def memory_bytes(self):
+        """Bytes held by this item's pixels and encoded data"""
+        images = [self.image, self.mask, self.thumbnail]
+        for holder in (self.original_preview, self.output_preview, self.preview_source):
+            if holder is not None:
+                images.extend(holder.images())
+        return pixel_bytes(images) + len(self.data or b"")
+
+    def release_previews(self):
+        """Drop the previews; restore_previews builds them again from the mask.
+
+        They are only dereferenced, since a job on another thread may still
+        be rendering from them.
+        """
+        self.original_preview = self.output_preview = self.preview_source = None
+
+    def restore_previews(self):
+        """Decode and composite the previews dropped by release_previews again"""
+        original = self.decode(MAX_PREVIEW_SIZE)
+        mask = self.mask if self.mask.size == original.size else self.mask.resize(original.size, Image.Resampling.BILINEAR)
+        preview_source = CompositeSource(original, mask).preview()
+        self.original_preview = PreviewPyramid(original, self.full_size)
+        self.output_preview = PreviewPyramid(preview_source.render(self.variant))
+        self.preview_source = preview_source
+
+    def release(self):
+        """Free the previews and thumbnail of an image that has been closed.
+
+        The path or encoded bytes and the mask stay until the item itself is
+        dropped, so a save already queued for it still completes.
+        """
+        for holder in (self.original_preview, self.output_preview, self.preview_source):
+            if holder is not None:
+                holder.close()
+        if self.thumbnail is not None:
+            self.thumbnail.close()
+        self.original_preview = self.output_preview = self.preview_source = self.thumbnail = None
+
+    def describe_decodes(self):
+        """Each decode so far as text, for the status bar"""
+        return "; ".join(describe_decode(record) for record in self.decodes)
+
+
+class ImageSession:
+    """Opened images and their processing and export pipelines.
+
+    The callbacks are called on pipeline threads: on_update(item) whenever an
+    item changes state, on_exported(item, path, seconds, size) after each save
+    and on_export_error(item, exception) when one fails.
+    """
+
+    def __init__(self, session_manager, result_cache, on_update=None, on_exported=None, on_export_error=None,
+                 memory_budget=None):
+        self.session_manager = session_manager
+        self.result_cache = result_cache
+        self.store = ImageStore(memory_budget) if memory_budget else ImageStore()
+        self.on_update = on_update
+        self.on_exported = on_exported
+        self.on_export_error = on_export_error
+        self.items = []
+        self.pipeline = StagePipeline(
+            [("decode", self._decode), ("infer", self._infer), ("composite", self._composite)],
+            on_stage=self._enter_stage, on_result=self._finished, on_error=self._failed
+        )
+        self._export_pipeline = None
+
+    @property
+    def pending(self):
+        return self.pipeline.pending
+
+    def add(self, sources, proxy_size=None, variant=None, label="Pasted image"):
+        """Queue paths, encoded image bytes or PIL images for processing and return their new items"""
+        added = []
+        for source in sources:
+            item = SessionItem.from_source(source, label)
+            item.trace = tracer.start("process_image", file=item.name,
+                                      model=self.session_manager.model_name, proxy_size=proxy_size)
+            self.items.append(item)
+            self.store.add(item)
+            added.append(item)
+            self.pipeline.submit(item, {"proxy_size": proxy_size, "variant": dict(variant or {})})
+        return added
+
+    def clear(self):
+        """Forget every item, dropping whatever is still being processed and freeing its previews"""
+        self.pipeline.cancel()
+        self.store.clear()
+        self.items = []
+
+    def _enter_stage(self, item, stage):
+        item.state = stage
+        if self.on_update:
+            self.on_update(item)
+
+    def _decode(self, item, payload):
+        with tracer.activate(item.trace):
+            with span("read"):
+                data = item.read()
+            # Only as many pixels as the largest preview needs; the model sees
+            # this decode too, since it works at a far lower resolution
+            original = item.decode(MAX_PREVIEW_SIZE, data)
+            with span("preview"):
+                item.original_preview = PreviewPyramid(original, item.full_size)
+                item.thumbnail = make_thumbnail(item.original_preview)
+            if data is None:
+                # Clipboard bitmaps are kept encoded, which also gives them a cache key
+                item.keep_encoded()
+                data = item.data
+        return dict(payload, data=data, original=original)
+
+    def _infer(self, item, payload):
+        # Reuses a cached mask when these exact bytes were processed with this
+        # model
+        model_name = self.session_manager.model_name
+        proxy_size = payload["proxy_size"]
+        with tracer.activate(item.trace):
+            cache_key = None
+            if payload["data"] is not None:
+                # Kept apart from the full-size masks of batch and CLI runs
+                reduced = payload["original"].size != item.full_size
+                options = mask_options(proxy_size, MAX_PREVIEW_SIZE if reduced else None)
+                cache_key = ResultCache.make_key(payload["data"], model_name, options)
+            mask, item.cache_hit = get_mask(payload["original"], self.session_manager, self.result_cache,
+                                            cache_key, proxy_size)
+        return dict(payload, data=None, mask=mask)
+
+    def _composite(self, item, payload):
+        # Only the on-screen copy is composited now; the full-size output is
+        # rendered from the stored mask when it is saved
+        with tracer.activate(item.trace):
+            source = CompositeSource(payload["original"], payload["mask"])
+            with span("preview"):
+                preview_source = source.preview()
+            composited = preview_source.render(payload["variant"])
+            with span("preview"):
+                item.output_preview = PreviewPyramid(composited)
+                item.thumbnail = make_thumbnail(item.output_preview)
+        item.preview_source = preview_source
+        item.mask = payload["mask"]
+        item.proxy_size = payload["proxy_size"]
+        item.variant = payload["variant"]
+
+    def _finished(self, item, result):
+        tracer.finish(item.trace)
+        item.state = "done"
+        if self.on_update:
+            self.on_update(item)
+
+    def _failed(self, item, error):
+        tracer.finish(item.trace)
+        item.state = "failed"
+        item.error = error
+        if self.on_update:
+            self.on_update(item)
+
+    def export(self, items, out_dir, options, variant):
+        """Save finished items to out_dir; returns the number queued"""
+        if self._export_pipeline is None:
+            self._export_pipeline = StagePipeline(
+                [("decode", self._export_decode), ("composite", self._export_composite),
+                 ("encode", self._export_encode)],
+                on_result=self._exported, on_error=self._export_failed
+            )
+
+        suffix = "_mask" if options["output_format"] == "mask" else ""
+        used = set()
+        queued = 0
+        for item in items:
+            if not item.done:
+                continue
+            # Animations are always written as animated PNGs
+            extension = ".png" if item.animated else OUTPUT_FORMATS[options["output_format"]][1]
+            stem = item.stem + suffix
+            name = stem + extension
+            # Images from different folders may share a name
+            counter = 2
+            while name in used:
+                name = f"{stem}_{counter}{extension}"
+                counter += 1
+            used.add(name)
+            self._export_pipeline.submit(item, {
+                "trace": tracer.start("save_image", file=name),
+                "path": os.path.join(out_dir, name),
+                "options": options,
+                "variant": dict(variant),
+            })
+            queued += 1
+        return queued
+
+    def _export_decode(self, item, payload):
+        if item.animated:
+            # Frames are decoded, composited and encoded one at a time in the encode stage
+            return payload
+        with tracer.activate(payload["trace"]):
+            return dict(payload, source=item.full_source())
+
+    def _export_composite(self, item, payload):
+        if item.animated:
+            return payload
+        source, variant = payload["source"], payload["variant"]
+        with tracer.activate(payload["trace"]):
+            if payload["options"]["output_format"] == "mask":
+                return dict(payload, source=None, image=None, mask=source.effective_mask(variant))
+            return dict(payload, source=None, image=source.render(variant), mask=None)
+
+    def _export_encode(self, item, payload):
+        with tracer.activate(payload["trace"]):
+            if item.animated:
+                seconds = item.save_animation(payload["path"], self.session_manager, payload["variant"],
+                                              payload["options"])["seconds"]
+                size = os.path.getsize(payload["path"])
+            else:
+                seconds, size = save_output(payload["image"], payload["path"], payload["options"],
+                                            payload["mask"])
+        tracer.finish(payload["trace"])
+        return payload["path"], seconds, size
+
+    def _exported(self, item, result):
+        if self.on_exported:
+            self.on_exported(item, *result)
+
+    def _export_failed(self, item, error):
+        # The trace of a failed save is dropped; only its error is reported
+        if self.on_export_error:
+            self.on_export_error(item, error)
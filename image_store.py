@@ -0,0 +1,79 @@
+"""Memory accounting for the images opened in the GUI.
+
+Each opened image keeps only what cannot be cheaply recomputed: its path (or,
+for a drop or paste, its encoded bytes), the preview-size mask as an 8-bit
+'L' image and a thumbnail. Its previews are display-size copies that can be
+decoded and composited again from those, so when the previews of all opened
+images together exceed the budget, the least recently viewed ones are dropped
+and rebuilt when their image is selected again.
+"""
+from collections import OrderedDict
+
+from app_log import log
+from perf import format_bytes
+from pipeline import image_bytes
+
+DEFAULT_BUDGET_MB = 512
+
+
+def pixel_bytes(images):
+    """Memory taken by the pixels of images, each image counted once however often it is listed"""
+    unique = {id(image): image for image in images if image is not None}
+    return sum(image_bytes(image) for image in unique.values())
+
+
+class ImageStore:
+    """The opened images' buffers, held under budget bytes by dropping previews.
+
+    Items are SessionItems; the most recently used is last. Only finished
+    items have previews that can be dropped, and never the ones passed in
+    keep, which are on screen.
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET_MB * 1024 * 1024):
+        self.budget = budget
+        self._items = OrderedDict()
+
+    def add(self, item):
+        self._items[item] = None
+
+    def touch(self, item):
+        """Mark item as the most recently used"""
+        if item in self._items:
+            self._items.move_to_end(item)
+
+    def usage(self):
+        """Bytes held by the pixels of every item"""
+        return sum(item.memory_bytes() for item in self._items)
+
+    def trim(self, keep=()):
+        """Drop the previews of the least recently used items until usage is within the budget.
+
+        Returns the items whose previews were dropped.
+        """
+        usage = self.usage()
+        evicted = []
+        for item in list(self._items):
+            if usage <= self.budget:
+                break
+            if item in keep or not item.done:
+                continue
+            before = item.memory_bytes()
+            item.release_previews()
+            freed = before - item.memory_bytes()
+            if freed:
+                usage -= freed
+                evicted.append(item)
+        if evicted:
+            log(f"Dropped the previews of {len(evicted)} image(s) to stay within "
+                f"{format_bytes(self.budget)}, {format_bytes(usage)} in use")
+        return evicted
+
+    def clear(self):
+        """Release every item's buffers and forget them"""
+        for item in self._items:
+            item.release()
+        self._items.clear()
+
+    def describe(self):
+        return f"{format_bytes(self.usage())} of {format_bytes(self.budget)}"
@@ -0,0 +1,141 @@
+import queue
+import threading
+
+from app_log import log
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when a newer job has replaced it"""
+
+
+class Job:
+    """Handle passed to a running job so it can check for cancellation and post UI updates"""
+
+    def __init__(self, scheduler, job_id):
+        self.id = job_id
+        self._scheduler = scheduler
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check(self):
+        """Stop the job here if it has been cancelled"""
+        if self.cancelled:
+            raise JobCancelled()
+
+    def post(self, callback):
+        """Run callback on the Tk thread, unless the job is stale by then"""
+        self._scheduler.post(self, callback)
+
+
+class JobScheduler:
+    """Bounded job queue feeding a small pool of worker threads.
+
+    Results are handed back to the Tk thread with after(). By default
+    submitting a job cancels every older one, and anything a cancelled job
+    tries to deliver is dropped, so only the latest job's output ever reaches
+    the UI.
+    """
+
+    def __init__(self, master, workers=2, max_pending=4, on_depth_change=None):
+        self.master = master
+        self.on_depth_change = on_depth_change
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._jobs = []
+        for index in range(workers):
+            threading.Thread(target=self._worker_loop, name=f"job-worker-{index}", daemon=True).start()
+
+    @property
+    def depth(self):
+        """Jobs queued or running"""
+        with self._lock:
+            return len(self._jobs)
+
+    def submit(self, func, on_done=None, on_error=None, replace=True):
+        """Queue func(job), cancelling older jobs unless replace is False.
+
+        on_done(result) and on_error(exception) run on the Tk thread, and only
+        if the job is still the latest one. Raises queue.Full when replace is
+        False and max_pending jobs are already waiting.
+        """
+        with self._lock:
+            if replace:
+                for old_job in self._jobs:
+                    old_job.cancel()
+            self._next_id += 1
+            job = Job(self, self._next_id)
+            self._jobs.append(job)
+        if replace:
+            self._drain_cancelled()
+        try:
+            self._queue.put_nowait((job, func, on_done, on_error))
+        except queue.Full:
+            self._finish(job)
+            raise
+        self._notify_depth()
+        return job
+
+    def cancel_all(self):
+        with self._lock:
+            for job in self._jobs:
+                job.cancel()
+        self._drain_cancelled()
+
+    def _drain_cancelled(self):
+        """Drop queued jobs that were cancelled before a worker picked them up"""
+        kept = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[0].cancelled:
+                self._finish(item[0])
+            else:
+                kept.append(item)
+        for item in kept:
+            self._queue.put_nowait(item)
+
+    def _worker_loop(self):
+        while True:
+            job, func, on_done, on_error = self._queue.get()
+            try:
+                job.check()
+                result = func(job)
+                job.check()
+            except JobCancelled:
+                log(f"Job {job.id} cancelled")
+            except Exception as e:
+                if on_error:
+                    job.post(lambda error=e: on_error(error))
+            else:
+                if on_done:
+                    job.post(lambda: on_done(result))
+            finally:
+                self._finish(job)
+
+    def _finish(self, job):
+        with self._lock:
+            if job in self._jobs:
+                self._jobs.remove(job)
+        self._notify_depth()
+
+    def post(self, job, callback):
+        # Cancellation is checked again on the Tk thread, because a newer job
+        # may have been submitted while this callback was waiting
+        def deliver():
+            if not job.cancelled:
+                callback()
+        self.master.after(0, deliver)
+
+    def _notify_depth(self):
+        if self.on_depth_change:
+            depth = self.depth
+            self.master.after(0, lambda: self.on_depth_change(depth))
@@ -0,0 +1,105 @@
+import numpy as np
+from PIL import Image
+
+DEFAULT_GUIDED_RADIUS = 8
+DEFAULT_GUIDED_EPS = 1e-4
+STRIP_ROWS = 512
+
+
+def box_filter(array, radius):
+    """Mean over a (2r+1)x(2r+1) window using summed-area tables, edges clamped"""
+    height, width = array.shape
+    padded = np.pad(array, radius, mode="edge")
+    integral = np.zeros((padded.shape[0] + 1, padded.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(padded, axis=0), axis=1, out=integral[1:, 1:])
+    size = 2 * radius + 1
+    total = (integral[size:size + height, size:size + width]
+             - integral[:height, size:size + width]
+             - integral[size:size + height, :width]
+             + integral[:height, :width])
+    return (total / (size * size)).astype(np.float32)
+
+
+def guided_upsample(image, low_mask, low_guide=None, radius=DEFAULT_GUIDED_RADIUS, eps=DEFAULT_GUIDED_EPS):
+    """Upscale a low-resolution mask to image's size, snapping edges to the image.
+
+    This is the fast guided filter: the linear coefficients are fitted at the
+    mask's resolution, upsampled bilinearly and applied to the full-resolution
+    grayscale guide in horizontal strips, so only a strip of float data is
+    alive at full size at any time. low_guide may pass the already downscaled
+    image the mask was predicted from.
+    """
+    guide = image.convert("L")
+    if low_guide is None or low_guide.size != low_mask.size:
+        low_guide = guide.resize(low_mask.size, Image.Resampling.BILINEAR)
+
+    def read_guide_rows(top, bottom):
+        return np.asarray(guide.crop((0, top, guide.width, bottom)))
+
+    return guided_upsample_rows(image.size, read_guide_rows, low_mask, low_guide, radius, eps)
+
+
+def guided_upsample_rows(size, read_guide_rows, low_mask, low_guide, radius=DEFAULT_GUIDED_RADIUS,
+                         eps=DEFAULT_GUIDED_EPS):
+    """guided_upsample with the full-resolution guide supplied strip by strip.
+
+    read_guide_rows(top, bottom) returns those rows of the grayscale guide as
+    a uint8 array, so the guide never has to exist at full size.
+    """
+    a, b = _guided_coefficients(low_guide, low_mask, radius, eps)
+
+    # Working in 0-255 units lets the guide strips stay uint8 until the multiply
+    width, height = size
+    low_height = low_mask.height
+    a_rows = _resize_width(box_filter(a, radius) / 255.0, width)
+    b_rows = _resize_width(box_filter(b, radius) * 255.0 + 0.5, width)
+    del a, b
+    row0, row1, weight = _row_weights(low_height, height)
+
+    # Strips are pasted straight into the result so the full-size mask exists once
+    out = Image.new("L", size)
+    for top in range(0, height, STRIP_ROWS):
+        rows = slice(top, min(top + STRIP_ROWS, height))
+        strip = _lerp_rows(a_rows, row0[rows], row1[rows], weight[rows])
+        strip *= read_guide_rows(rows.start, rows.stop)
+        strip += _lerp_rows(b_rows, row0[rows], row1[rows], weight[rows])
+        np.clip(strip, 0, 255, out=strip)
+        out.paste(Image.fromarray(strip.astype(np.uint8), mode="L"), (0, top))
+    return out
+
+
+def _guided_coefficients(low_guide, low_mask, radius, eps):
+    """The guided filter's a and b at the mask's resolution; the window means are freed on return"""
+    low_guide = np.asarray(low_guide.convert("L"), dtype=np.float32) / 255.0
+    low_alpha = np.asarray(low_mask.convert("L"), dtype=np.float32) / 255.0
+
+    mean_i = box_filter(low_guide, radius)
+    mean_p = box_filter(low_alpha, radius)
+    cov_ip = box_filter(low_guide * low_alpha, radius) - mean_i * mean_p
+    var_i = box_filter(low_guide * low_guide, radius) - mean_i * mean_i
+    a = cov_ip / (var_i + eps)
+    return a, mean_p - a * mean_i
+
+
+def _resize_width(array, width):
+    """Bilinear horizontal resize of a float32 array to width columns"""
+    image = Image.fromarray(array.astype(np.float32), mode="F")
+    return np.asarray(image.resize((width, array.shape[0]), Image.Resampling.BILINEAR))
+
+
+def _row_weights(low_height, height):
+    """Source rows and weights for bilinear vertical upsampling (pixel centers aligned)"""
+    positions = (np.arange(height, dtype=np.float32) + 0.5) * (low_height / height) - 0.5
+    positions = np.clip(positions, 0, low_height - 1)
+    row0 = positions.astype(np.int32)
+    row1 = np.minimum(row0 + 1, low_height - 1)
+    return row0, row1, (positions - row0).astype(np.float32)[:, None]
+
+
+def _lerp_rows(array, row0, row1, weight):
+    strip = array[row0]
+    delta = array[row1]
+    delta -= strip
+    delta *= weight
+    strip += delta
+    return strip
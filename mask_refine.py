@@ -0,0 +1,407 @@
+"""Mask refinement: alpha matting, speck removal, edge shift, hard edges and feathering.
+
+Every operation works on whole NumPy arrays and runs in its own span, so a
+trace shows what each one costs. Most of a mask is flat 0 or 255, and none of
+these operations changes a flat area that is far from an edge, so the mask is
+cut into tiles and only the tiles near an edge (for matting, the band around
+the trimap's unknown region) are processed, in a few horizontal runs per
+strip. On a portrait that is a small part of the frame. A large image is
+matted at half size first, so the full-size solve starts close to its answer.
+
+Sizes are given in pixels on a REFERENCE_SIZE image and scaled with the
+image's longest side, so a refinement rendered on the reduced preview looks
+like the full-size render.
+"""
+import numpy as np
+from PIL import Image
+
+from refine_options import (MATTING_BACKGROUND_THRESHOLD, MATTING_FOREGROUND_THRESHOLD, MATTING_ITERATIONS,
+                            matting_options)
+from tracing import span
+
+# Sizes in the options and below are pixels at this longest side
+REFERENCE_SIZE = 2000
+TILE_SIZE = 64
+# Tile rows processed together; more rows mean fewer, taller runs
+STRIP_TILES = 4
+# Edge tiles this close together in a strip are processed as one run
+RUN_GAP_TILES = 2
+
+# Images larger than this are matted at half size first, repeatedly; each
+# larger solve then starts from the smaller one's alpha and needs fewer iterations
+MATTING_WORK_SIZE = 1600
+MATTING_DETAIL_ITERATIONS = 15
+# Blur-fusion foreground estimation: a wide pass, then a narrow one
+FOREGROUND_RADII = (90, 6)
+
+
+def scale_for(size):
+    """Factor turning REFERENCE_SIZE pixels into pixels of an image of this size"""
+    return max(size) / REFERENCE_SIZE
+
+
+def _scaled(pixels, scale):
+    return max(1, round(pixels * scale)) if pixels else 0
+
+
+def alpha_matte(image, mask, options=None):
+    """Refine mask's edges from image's colours; returns (foreground, mask).
+
+    options holds the matting_* refinement options; missing ones take
+    their REFINE_DEFAULTS value.
+
+    The trimap is built as rembg builds it, and alpha in its unknown band
+    minimises the same kind of matting Laplacian rembg's closed-form matting
+    does. rembg builds it as a sparse matrix over the whole frame; here it is
+    the large-kernel form of He, Sun and Tang (2010), whose product with an
+    alpha estimate is that estimate minus its colour guided filter, so the
+    conjugate gradient solve is box filters over the band. The foreground
+    colours in the band are estimated by blur fusion, so hair composited over
+    a new background does not carry the old one's colour.
+    """
+    alpha, foreground, _ = _matte_level(image.convert("RGB"), mask.convert("L"), scale_for(image.size),
+                                        matting_options(options or {}))
+    return Image.fromarray(foreground, mode="RGB"), Image.fromarray(alpha, mode="L")
+
+
+def _matte_level(image, mask, scale, options, keep_background=False):
+    """Matte image, first on a half-size copy if it is larger than MATTING_WORK_SIZE"""
+    if max(image.size) <= MATTING_WORK_SIZE:
+        return _matte(np.asarray(image), np.array(mask), scale, options, options["matting_iterations"],
+                      FOREGROUND_RADII, keep_background=keep_background)
+
+    # Carrying alpha and colours in from the known regions needs many
+    # iterations and wide windows but not full resolution
+    with span("matting_reduce"):
+        half = image.reduce(2), mask.reduce(2)
+    coarse = _matte_level(*half, scale / 2, options, keep_background=True)
+    # The detail pass keeps its share of the iterations when they are changed
+    iterations = max(1, round(options["matting_iterations"] * MATTING_DETAIL_ITERATIONS / MATTING_ITERATIONS))
+    return _matte(np.asarray(image), np.array(mask), scale, options, iterations, FOREGROUND_RADII[1:],
+                  coarse, keep_background)
+
+
+def _matte(rgb, alpha, scale, options, iterations, foreground_radii, coarse=None, keep_background=False):
+    """(alpha, foreground, background) arrays; coarse is the same from a reduced copy"""
+    with span("matting_trimap"):
+        trimap = trimap_from_mask(alpha, max(1, _scaled(options["matting_erode_size"], scale)),
+                                  options["matting_foreground_threshold"], options["matting_background_threshold"])
+    unknown = trimap == 128
+    alpha[trimap == 255] = 255
+    alpha[trimap == 0] = 0
+
+    if coarse is not None:
+        with span("matting_upsample"):
+            for outer, _ in _runs(_tiles_any(unknown), alpha.shape, 0):
+                estimate = _bilinear_block(coarse[0], alpha.shape, outer)
+                block_unknown = unknown[outer]
+                alpha[outer][block_unknown] = (estimate[block_unknown] + 0.5).astype(np.uint8)
+
+    radius = _scaled(options["matting_radius"], scale)
+    with span("matting_alpha", radius=radius, iterations=iterations):
+        _solve_alpha(rgb, alpha, unknown, radius, options["matting_eps"], iterations)
+
+    radii = [_scaled(pixels, scale) for pixels in foreground_radii]
+    soft = (alpha > 0) & (alpha < 255)
+    runs = _runs(_tiles_any(soft), alpha.shape, sum(radii))
+    foreground = rgb.copy()
+    background = rgb.copy() if keep_background else None
+    with span("matting_foreground", band=_band_fraction(runs, alpha.shape)):
+        for outer, inner in runs:
+            start = None
+            if coarse is not None:
+                start = [_bilinear_block(level, alpha.shape, outer) / 255 for level in coarse[1:]]
+            colours, behind = _estimate_foreground(rgb[outer], alpha[outer], radii, start)
+            band_soft = soft[outer][inner]
+            foreground[outer][inner][band_soft] = colours[inner][band_soft]
+            if background is not None:
+                background[outer][inner][band_soft] = behind[inner][band_soft]
+    return alpha, foreground, background
+
+
+def _solve_alpha(rgb, alpha, unknown, radius, eps, iterations):
+    """Conjugate gradient solve of the matting Laplacian for alpha's unknown pixels, in place.
+
+    The current values of the unknown pixels are the starting point and the
+    rest stay fixed. Every product with the Laplacian is one guided filter
+    per run of the band, each run reading the same full-frame field.
+    """
+    runs = _runs(_tiles_any(unknown), alpha.shape, 2 * radius)
+    filters = [(outer, inner, unknown[outer][inner], GuidedFilter(rgb[outer], radius, eps))
+               for outer, inner in runs]
+    index = np.flatnonzero(unknown)
+    field = np.zeros(alpha.shape, dtype=np.float32)
+    product = np.zeros(alpha.shape, dtype=np.float32)
+
+    def laplacian():
+        for outer, inner, block_unknown, guided_filter in filters:
+            block = field[outer]
+            product[outer][inner][block_unknown] = (block - guided_filter.filter(block))[inner][block_unknown]
+        return product.ravel()[index]
+
+    # The known pixels' pull on the unknown ones is the right-hand side
+    np.divide(alpha, 255, out=field)
+    field.ravel()[index] = 0
+    target = -laplacian()
+    field.fill(0)
+
+    x = alpha.ravel()[index].astype(np.float32) / 255
+    field.ravel()[index] = x
+    residual = target - laplacian()
+    direction = residual.copy()
+    residual_norm = residual @ residual
+    for _ in range(iterations):
+        if residual_norm < 1e-12:
+            break
+        field.ravel()[index] = direction
+        product_direction = laplacian()
+        step = residual_norm / (direction @ product_direction)
+        x += step * direction
+        residual -= step * product_direction
+        new_norm = residual @ residual
+        direction = residual + (new_norm / residual_norm) * direction
+        residual_norm = new_norm
+    alpha.ravel()[index] = np.clip(x * 255 + 0.5, 0, 255).astype(np.uint8)
+
+
+def trimap_from_mask(alpha, erode_size, foreground_threshold=MATTING_FOREGROUND_THRESHOLD,
+                     background_threshold=MATTING_BACKGROUND_THRESHOLD):
+    """0 (background), 255 (foreground) or 128 (unknown) for each pixel of a uint8 mask"""
+    from scipy.ndimage import maximum_filter, minimum_filter
+
+    # Eroding the confident regions is a min (foreground) or max (background)
+    # filter of the mask, followed by the threshold
+    low = _filter_near_edges(alpha, erode_size, lambda block: minimum_filter(block, erode_size))
+    high = _filter_near_edges(alpha, erode_size, lambda block: maximum_filter(block, erode_size))
+    trimap = np.full(alpha.shape, 128, dtype=np.uint8)
+    trimap[low > foreground_threshold] = 255
+    trimap[high < background_threshold] = 0
+    return trimap
+
+
+def refine_mask(mask, options, scale=None):
+    """Apply the enabled speck removal, edge shift, threshold and feather to an 'L' mask"""
+    islands = options.get("remove_islands") or 0
+    shift = options.get("edge_shift") or 0
+    threshold = options.get("threshold")
+    feather = options.get("feather") or 0
+    if not (islands or shift or threshold is not None or feather):
+        return mask
+
+    if scale is None:
+        scale = scale_for(mask.size)
+    alpha = np.array(mask.convert("L"))
+    if islands:
+        with span("remove_islands"):
+            alpha = remove_islands(alpha, round(alpha.size * islands / 100))
+    if shift:
+        with span("edge_shift", pixels=shift):
+            alpha = shift_edges(alpha, _scaled(abs(shift), scale) * (1 if shift > 0 else -1))
+    if threshold is not None:
+        with span("threshold", percent=threshold):
+            level = round(threshold * 255 / 100)
+            lut = np.where(np.arange(256) >= level, 255, 0).astype(np.uint8)
+            alpha = lut[alpha]
+    if feather:
+        with span("feather", pixels=feather):
+            alpha = feather_edges(alpha, _scaled(feather, scale))
+    return Image.fromarray(alpha, mode="L")
+
+
+def remove_islands(alpha, min_area):
+    """Clear visible specks and fill holes of fewer than min_area pixels"""
+    from scipy.ndimage import label
+
+    alpha = alpha.copy()
+    for region, value in ((alpha > MATTING_BACKGROUND_THRESHOLD, 0), (alpha < MATTING_FOREGROUND_THRESHOLD, 255)):
+        labels, count = label(region)
+        if count < 2 and value == 255:
+            # A mask without holes is one background region; nothing to fill
+            continue
+        sizes = np.bincount(labels.ravel(), minlength=count + 1)
+        small = sizes < min_area
+        small[0] = False
+        alpha[small[labels]] = value
+    return alpha
+
+
+def shift_edges(alpha, pixels):
+    """Grow (pixels > 0) or shrink (pixels < 0) the mask by a square max or min filter"""
+    from scipy.ndimage import maximum_filter, minimum_filter
+
+    size = 2 * abs(pixels) + 1
+    operation = maximum_filter if pixels > 0 else minimum_filter
+    return _filter_near_edges(alpha, abs(pixels), lambda block: operation(block, size))
+
+
+def feather_edges(alpha, radius):
+    """Two box blurs of the given radius, close to a Gaussian, near edges only"""
+    from scipy.ndimage import uniform_filter
+
+    size = 2 * radius + 1
+
+    def blur(block):
+        block = uniform_filter(block.astype(np.float32), size, mode="nearest")
+        block = uniform_filter(block, size, mode="nearest")
+        return np.clip(block + 0.5, 0, 255).astype(np.uint8)
+
+    return _filter_near_edges(alpha, 2 * radius, blur)
+
+
+class GuidedFilter:
+    """He et al.'s guided filter with a colour guide, for filtering several inputs.
+
+    Everything that depends only on the guide, including each pixel's
+    inverted 3x3 colour covariance, is computed once up front; each filter()
+    then costs eight box filters.
+    """
+
+    def __init__(self, rgb, radius, eps):
+        guide = rgb.astype(np.float32) / 255
+        self.size = 2 * radius + 1
+        self.r, self.g, self.b = guide[..., 0], guide[..., 1], guide[..., 2]
+        r, g, b, mean = self.r, self.g, self.b, self._mean
+        self.mean_r, self.mean_g, self.mean_b = mean(r), mean(g), mean(b)
+        var_rr = mean(r * r) - self.mean_r * self.mean_r + eps
+        var_rg = mean(r * g) - self.mean_r * self.mean_g
+        var_rb = mean(r * b) - self.mean_r * self.mean_b
+        var_gg = mean(g * g) - self.mean_g * self.mean_g + eps
+        var_gb = mean(g * b) - self.mean_g * self.mean_b
+        var_bb = mean(b * b) - self.mean_b * self.mean_b + eps
+
+        # The inverse of the symmetric covariance, in closed form for all pixels at once
+        inv_rr = var_gg * var_bb - var_gb * var_gb
+        inv_rg = var_gb * var_rb - var_rg * var_bb
+        inv_rb = var_rg * var_gb - var_gg * var_rb
+        inv_gg = var_rr * var_bb - var_rb * var_rb
+        inv_gb = var_rb * var_rg - var_rr * var_gb
+        inv_bb = var_rr * var_gg - var_rg * var_rg
+        det = var_rr * inv_rr + var_rg * inv_rg + var_rb * inv_rb
+        self.inverse = [element / det for element in (inv_rr, inv_rg, inv_rb, inv_gg, inv_gb, inv_bb)]
+
+    def _mean(self, array):
+        from scipy.ndimage import uniform_filter
+
+        return uniform_filter(array, self.size, mode="nearest")
+
+    def filter(self, p):
+        """p (float32) filtered to follow the guide's edges"""
+        r, g, b, mean = self.r, self.g, self.b, self._mean
+        mean_p = mean(p)
+        cov_rp = mean(r * p) - self.mean_r * mean_p
+        cov_gp = mean(g * p) - self.mean_g * mean_p
+        cov_bp = mean(b * p) - self.mean_b * mean_p
+        inv_rr, inv_rg, inv_rb, inv_gg, inv_gb, inv_bb = self.inverse
+        a_r = inv_rr * cov_rp + inv_rg * cov_gp + inv_rb * cov_bp
+        a_g = inv_rg * cov_rp + inv_gg * cov_gp + inv_gb * cov_bp
+        a_b = inv_rb * cov_rp + inv_gb * cov_gp + inv_bb * cov_bp
+        b_p = mean_p - a_r * self.mean_r - a_g * self.mean_g - a_b * self.mean_b
+
+        return mean(a_r) * r + mean(a_g) * g + mean(a_b) * b + mean(b_p)
+
+
+def _estimate_foreground(rgb, alpha, radii, start=None):
+    """Foreground and background colours by blur fusion (Forte and Pitie, 2021), as uint8.
+
+    start is a (foreground, background) estimate in 0-1 from a reduced copy;
+    without one both start as the image.
+    """
+    from scipy.ndimage import uniform_filter
+
+    image = rgb.astype(np.float32) / 255
+    a = (alpha.astype(np.float32) / 255)[..., None]
+    foreground, background = start or (image, image)
+    for radius in radii:
+        size = (2 * radius + 1, 2 * radius + 1, 1)
+        blurred_a = uniform_filter(a, size, mode="nearest")
+        blurred_f = uniform_filter(foreground * a, size, mode="nearest") / (blurred_a + 1e-5)
+        blurred_b = uniform_filter(background * (1 - a), size, mode="nearest") / (1 - blurred_a + 1e-5)
+        foreground = blurred_f + a * (image - a * blurred_f - (1 - a) * blurred_b)
+        foreground = np.clip(foreground, 0, 1)
+        background = blurred_b
+    return (foreground * 255 + 0.5).astype(np.uint8), (np.clip(background, 0, 1) * 255 + 0.5).astype(np.uint8)
+
+
+def _bilinear_block(low, shape, block):
+    """The block (a pair of slices) of low bilinearly resized to shape, as float32"""
+    (row0, row1, row_weight), (col0, col1, col_weight) = (
+        _sample_positions(part, size, low_size) for part, size, low_size in zip(block, shape, low.shape)
+    )
+    row_weight = row_weight.reshape((-1,) + (1,) * (low.ndim - 1))
+    col_weight = col_weight.reshape((-1,) + (1,) * (low.ndim - 2))
+    low = low.astype(np.float32)
+    top = low[row0][:, col0] * (1 - col_weight) + low[row0][:, col1] * col_weight
+    bottom = low[row1][:, col0] * (1 - col_weight) + low[row1][:, col1] * col_weight
+    return top * (1 - row_weight) + bottom * row_weight
+
+
+def _sample_positions(part, size, low_size):
+    """Source indices and weights for output pixels part of size, pixel centers aligned"""
+    positions = (np.arange(part.start, part.stop, dtype=np.float32) + 0.5) * (low_size / size) - 0.5
+    positions = np.clip(positions, 0, low_size - 1)
+    first = positions.astype(np.intp)
+    return first, np.minimum(first + 1, low_size - 1), positions - first
+
+
+def _filter_near_edges(array, margin, func):
+    """func(block) applied to array, computed only near edges.
+
+    func must leave a block of one value unchanged and only look margin
+    pixels away, so flat tiles further than that from any edge are copied.
+    """
+    out = array.copy()
+    for outer, inner in _runs(_tiles_changing(array, margin), array.shape, margin):
+        out[outer][inner] = func(array[outer])[inner]
+    return out
+
+
+def _tile_view(array, reduce):
+    """reduce(axis=(1, 3)) of array over TILE_SIZE tiles, the last ones partial"""
+    height, width = array.shape
+    rows, cols = -(-height // TILE_SIZE), -(-width // TILE_SIZE)
+    padded = np.pad(array, ((0, rows * TILE_SIZE - height), (0, cols * TILE_SIZE - width)), mode="edge")
+    return reduce(padded.reshape(rows, TILE_SIZE, cols, TILE_SIZE), axis=(1, 3))
+
+
+def _tiles_any(flags):
+    return _tile_view(flags, np.any)
+
+
+def _tiles_changing(array, margin):
+    """Tiles whose value may change under a filter that looks margin pixels away"""
+    from scipy.ndimage import maximum_filter, minimum_filter
+
+    reach = 2 * -(-margin // TILE_SIZE) + 1
+    tile_min = minimum_filter(_tile_view(array, np.min), reach, mode="nearest")
+    tile_max = maximum_filter(_tile_view(array, np.max), reach, mode="nearest")
+    return tile_min != tile_max
+
+
+def _runs(tiles, shape, margin):
+    """(outer, inner) slices covering the marked tiles.
+
+    outer is a block of the array grown by margin on each side and inner
+    the part of that block, in its own coordinates, that the run covers.
+    """
+    height, width = shape
+    runs = []
+    for top_tile in range(0, tiles.shape[0], STRIP_TILES):
+        columns = np.flatnonzero(tiles[top_tile:top_tile + STRIP_TILES].any(axis=0))
+        if not len(columns):
+            continue
+        breaks = np.flatnonzero(np.diff(columns) > RUN_GAP_TILES + 1)
+        top = top_tile * TILE_SIZE
+        bottom = min(height, (top_tile + STRIP_TILES) * TILE_SIZE)
+        for first, last in zip(np.r_[columns[0], columns[breaks + 1]], np.r_[columns[breaks], columns[-1]]):
+            left, right = first * TILE_SIZE, min(width, (last + 1) * TILE_SIZE)
+            outer_top, outer_left = max(0, top - margin), max(0, left - margin)
+            outer = (slice(outer_top, min(height, bottom + margin)), slice(outer_left, min(width, right + margin)))
+            inner = (slice(top - outer_top, bottom - outer_top), slice(left - outer_left, right - outer_left))
+            runs.append((outer, inner))
+    return runs
+
+
+def _band_fraction(runs, shape):
+    """Share of the frame the runs cover, recorded on the spans"""
+    area = sum((inner[0].stop - inner[0].start) * (inner[1].stop - inner[1].start) for _, inner in runs)
+    return round(float(area) / (shape[0] * shape[1]), 3)
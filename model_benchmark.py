@@ -0,0 +1,216 @@
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app_log import log
+from app_paths import app_data_dir
+from perf import peak_rss_bytes, percentile, format_bytes
+
+BENCHMARK_PATH = os.path.join(app_data_dir(), "model_benchmark.json")
+BATCH_BENCHMARK_PATH = os.path.join(app_data_dir(), "batch_benchmark.json")
+DEFAULT_SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "bg_icon.png")
+# Masks are compared against the reference model at this size
+AGREEMENT_SIZE = 256
+DEFAULT_MIN_AGREEMENT = 0.9
+
+
+def _benchmark_model(model_name, samples, runs, session_settings):
+    """Time one model on every sample; runs in a fresh process per model"""
+    import rembg  # noqa: F401 - imported up front so load_seconds is only the session
+    from model_session import create_session
+    from pipeline import load_image, predict_mask
+
+    start = time.perf_counter()
+    session = create_session(model_name, session_settings)
+    load_seconds = time.perf_counter() - start
+
+    latencies = []
+    masks = {}
+    for index, path in enumerate(samples):
+        with open(path, "rb") as f:
+            image = load_image(f.read())
+        image.load()
+        if index == 0:
+            # The first run pays for onnxruntime's lazy allocations
+            predict_mask(image, session)
+        for _ in range(runs):
+            start = time.perf_counter()
+            mask = predict_mask(image, session)
+            latencies.append(time.perf_counter() - start)
+        masks[path] = mask.resize((AGREEMENT_SIZE, AGREEMENT_SIZE)).tobytes()
+
+    return {
+        "model": model_name,
+        "load_seconds": load_seconds,
+        "latency_mean": sum(latencies) / len(latencies),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "peak_rss": peak_rss_bytes(),
+        "masks": masks,
+    }
+
+
+def mask_agreement(mask_a, mask_b):
+    """Intersection over union of two masks thresholded at 50%"""
+    import numpy as np
+
+    a = np.frombuffer(mask_a, dtype=np.uint8) >= 128
+    b = np.frombuffer(mask_b, dtype=np.uint8) >= 128
+    union = np.count_nonzero(a | b)
+    return 1.0 if union == 0 else np.count_nonzero(a & b) / union
+
+
+def benchmark_models(models, samples, runs=3, session_settings=None, reference_model=None, path=BENCHMARK_PATH):
+    """Measure load time, latency and peak memory of each model on this machine.
+
+    Each model runs in its own process so memory figures do not mix.
+    Quality is reported as mask agreement (IoU) with reference_model, which
+    defaults to the first model. Results are saved as JSON to path.
+    """
+    samples = list(samples) or [DEFAULT_SAMPLE]
+    reference_model = reference_model or models[0]
+    context = multiprocessing.get_context("spawn")
+
+    results = []
+    for model_name in models:
+        log(f"Benchmarking '{model_name}' on {len(samples)} sample(s)...")
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results.append(executor.submit(_benchmark_model, model_name, samples, runs,
+                                               session_settings).result())
+        except Exception as e:
+            log(f"Benchmark of '{model_name}' failed: {e}")
+            results.append({"model": model_name, "error": str(e)})
+
+    masks = {result["model"]: result.pop("masks") for result in results if "masks" in result}
+    reference_masks = masks.get(reference_model)
+    for result in results:
+        if reference_masks is not None and result["model"] in masks:
+            scores = [mask_agreement(masks[result["model"]][sample], reference_masks[sample]) for sample in samples]
+            result["agreement"] = sum(scores) / len(scores)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "samples": samples,
+        "runs": runs,
+        "reference_model": reference_model,
+        "session_settings": session_settings,
+        "results": results,
+    }
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    except OSError as e:
+        log(f"Could not save benchmark results: {e}")
+    return results
+
+
+def pick_fastest(results, min_agreement=DEFAULT_MIN_AGREEMENT):
+    """Name of the fastest model whose masks agree well enough with the reference"""
+    acceptable = [r for r in results if "error" not in r and r.get("agreement", 1.0) >= min_agreement]
+    if not acceptable:
+        return None
+    return min(acceptable, key=lambda r: r["latency_p50"])["model"]
+
+
+def _benchmark_batch_size(model_name, samples, image_count, batch_size, runs, session_settings):
+    """Time image_count images through the model batch_size at a time; runs in a fresh process"""
+    import rembg  # noqa: F401 - imported up front so only inference is timed
+    from benchmark import synthetic_image, SYNTHETIC_SEED
+    from model_session import create_session
+    from pipeline import load_image, predict_masks
+
+    session = create_session(model_name, session_settings)
+    if samples:
+        images = []
+        for path in samples:
+            with open(path, "rb") as f:
+                images.append(load_image(f.read()))
+        images = [images[index % len(images)] for index in range(image_count)]
+    else:
+        images = [load_image(synthetic_image(640, 480, SYNTHETIC_SEED + index)) for index in range(image_count)]
+
+    # The first pass pays for onnxruntime's allocations at this batch size
+    predict_masks(images[:batch_size], session, max_batch_size=batch_size)
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        predict_masks(images, session, max_batch_size=batch_size)
+        seconds.append(time.perf_counter() - start)
+
+    p50 = percentile(seconds, 50)
+    return {
+        "batch_size": batch_size,
+        "seconds_p50": p50,
+        "images_per_second": image_count / p50,
+        "peak_rss": peak_rss_bytes(),
+    }
+
+
+def benchmark_batch_sizes(model_name, samples=(), batch_sizes=None, image_count=16, runs=3, session_settings=None,
+                          path=BATCH_BENCHMARK_PATH):
+    """Throughput of batched inference at each batch size, each in its own process.
+
+    The same image_count images (the samples repeated, or synthetic photos)
+    go through the model in batches of each size. Results are saved as JSON
+    to path.
+    """
+    from batch_inference import BATCH_SIZES
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for batch_size in batch_sizes or BATCH_SIZES:
+        log(f"Benchmarking '{model_name}' at batch size {batch_size}...")
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results.append(executor.submit(_benchmark_batch_size, model_name, list(samples), image_count,
+                                               batch_size, runs, session_settings).result())
+        except Exception as e:
+            log(f"Benchmark at batch size {batch_size} failed: {e}")
+            results.append({"batch_size": batch_size, "error": str(e)})
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "model": model_name,
+        "samples": list(samples),
+        "images": image_count,
+        "runs": runs,
+        "session_settings": session_settings,
+        "results": results,
+    }
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    except OSError as e:
+        log(f"Could not save benchmark results: {e}")
+    return results
+
+
+def format_batch_results(results):
+    """Batch size results as a fixed-width table, with the speedup over the first size"""
+    lines = [f"{'Batch':>6}{'Time':>10}{'Images/s':>10}{'Speedup':>9}{'Peak RSS':>12}"]
+    base = next((r["images_per_second"] for r in results if "error" not in r), None)
+    for r in results:
+        if "error" in r:
+            lines.append(f"{r['batch_size']:>6}  failed: {r['error']}")
+            continue
+        lines.append(f"{r['batch_size']:>6}{r['seconds_p50']:>9.2f}s{r['images_per_second']:>10.1f}"
+                     f"{r['images_per_second'] / base:>8.2f}x{format_bytes(r['peak_rss']):>12}")
+    return "\n".join(lines)
+
+
+def format_results(results):
+    """Results as a fixed-width table"""
+    lines = [f"{'Model':<20}{'Load':>8}{'p50':>9}{'p95':>9}{'Peak RSS':>12}{'IoU':>7}"]
+    for r in results:
+        if "error" in r:
+            lines.append(f"{r['model']:<20}  failed: {r['error']}")
+            continue
+        agreement = f"{r['agreement']:.3f}" if "agreement" in r else "-"
+        lines.append(f"{r['model']:<20}{r['load_seconds']:>7.2f}s{r['latency_p50'] * 1000:>7.0f}ms"
+                     f"{r['latency_p95'] * 1000:>7.0f}ms{format_bytes(r['peak_rss']):>12}{agreement:>7}")
+    return "\n".join(lines)
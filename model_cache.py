@@ -0,0 +1,104 @@
+"""Optimized copies of the models, written once and memory-mapped afterwards.
+
+onnxruntime reads a .onnx file into private memory and optimizes its graph
+on every cold start. The first time a model is loaded with a given set of
+session settings, an optimized copy is saved under MODEL_CACHE_DIR with its
+weights in a separate data file. onnxruntime writes that file with page
+aligned tensors and memory-maps it when loading, so sessions created from the
+copy skip graph optimization and keep their weights in the OS file cache,
+shared between every process that uses the same model.
+"""
+import hashlib
+import os
+import platform
+import shutil
+import sys
+
+from app_log import log
+from app_paths import app_data_dir
+
+MODEL_CACHE_DIR = os.path.join(app_data_dir(), "models")
+MODEL_FILE_NAME = "model.onnx"
+DATA_FILE_NAME = "model.onnx.data"
+# Tensors smaller than this stay inside the model file
+EXTERNAL_DATA_MIN_BYTES = 1024
+# Execution providers rembg prefers over the CPU when they are available. An
+# optimized graph is specific to the provider it was optimized for, so only
+# CPU sessions use the cache.
+ACCELERATED_PROVIDERS = ("CUDAExecutionProvider", "ROCMExecutionProvider", "OpenVINOExecutionProvider")
+
+
+def runs_on_cpu(session_settings):
+    """True if a session with these settings runs on the CPU execution provider"""
+    import onnxruntime as ort
+
+    provider = session_settings.get("provider", "auto")
+    if provider == "auto":
+        return not any(name in ort.get_available_providers() for name in ACCELERATED_PROVIDERS)
+    return provider == "CPUExecutionProvider"
+
+
+def cache_entry_dir(source_path, session_settings, cache_dir=MODEL_CACHE_DIR):
+    """Folder for the optimized copy of source_path under these settings.
+
+    The name changes with the source file, the onnxruntime version, the
+    optimization level and the machine, so a stale copy is never loaded.
+    """
+    import onnxruntime as ort
+
+    stat = os.stat(source_path)
+    key = "|".join(str(part) for part in (
+        os.path.abspath(source_path), stat.st_size, stat.st_mtime_ns, ort.__version__,
+        session_settings.get("graph_optimization_level", "all"), platform.machine(), sys.platform,
+    ))
+    model_name = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(cache_dir, f"{model_name}-{hashlib.sha256(key.encode()).hexdigest()[:16]}")
+
+
+def ensure_optimized_model(source_path, session_settings, cache_dir=MODEL_CACHE_DIR):
+    """Path of the optimized copy of source_path, creating it if needed; None if that fails"""
+    entry_dir = cache_entry_dir(source_path, session_settings, cache_dir)
+    model_path = os.path.join(entry_dir, MODEL_FILE_NAME)
+    # The folder only appears once both files are complete
+    if os.path.exists(model_path):
+        return model_path
+
+    import onnxruntime as ort
+    from settings import build_session_options
+
+    # Written to a private folder and renamed into place, so a worker starting
+    # at the same time never loads a half-written copy
+    partial_dir = f"{entry_dir}.partial-{os.getpid()}"
+    try:
+        os.makedirs(partial_dir, exist_ok=True)
+        options = build_session_options(session_settings)
+        options.optimized_model_filepath = os.path.join(partial_dir, MODEL_FILE_NAME)
+        options.add_session_config_entry("session.optimized_model_external_initializers_file_name", DATA_FILE_NAME)
+        options.add_session_config_entry("session.optimized_model_external_initializers_min_size_in_bytes",
+                                         str(EXTERNAL_DATA_MIN_BYTES))
+        log(f"Saving an optimized copy of {source_path}")
+        ort.InferenceSession(source_path, options, providers=["CPUExecutionProvider"])
+        os.replace(partial_dir, entry_dir)
+    except OSError as e:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        # Another process may have finished first
+        if os.path.exists(model_path):
+            return model_path
+        log(f"Could not save optimized model: {e}")
+        return None
+    except Exception as e:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        log(f"Could not optimize {source_path}: {e}")
+        return None
+
+    _remove_stale_entries(entry_dir)
+    return model_path
+
+
+def _remove_stale_entries(entry_dir):
+    """Delete older copies of the same model; ones still mapped by a running process stay"""
+    cache_dir, entry_name = os.path.split(entry_dir)
+    prefix = entry_name.rsplit("-", 1)[0] + "-"
+    for name in os.listdir(cache_dir):
+        if name != entry_name and name.startswith(prefix) and ".partial-" not in name:
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
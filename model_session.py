@@ -0,0 +1,181 @@
+import gc
+import os
+import sys
+import threading
+import time
+
+from app_log import log
+from settings import DEFAULT_SETTINGS, build_session_options, session_providers
+
+DEFAULT_MODEL = DEFAULT_SETTINGS["model"]
+AVAILABLE_MODELS = ["u2net", "u2netp", "silueta", "isnet-general-use"]
+
+
+def _session_class(model_name):
+    from rembg.sessions import sessions_class
+
+    for session_class in sessions_class:
+        if session_class.name() == model_name:
+            return session_class
+    raise ValueError(f"Unknown model: {model_name}")
+
+
+def model_path(model_name):
+    """The model's .onnx file if it is already on disk, else None.
+
+    Looks where rembg keeps its downloads, then in the u2net folder bundled
+    into the PyInstaller build.
+    """
+    session_class = _session_class(model_name)
+    fname = f"{model_name}.onnx"
+    if hasattr(session_class, "resolve_existing"):
+        path = session_class.resolve_existing(fname)
+        if path is not None:
+            return str(path)
+    else:
+        # rembg before the per-model folders kept every model in U2NET_HOME
+        home = os.path.expanduser(os.getenv("U2NET_HOME", os.path.join(os.getenv("XDG_DATA_HOME", "~"), ".u2net")))
+        if os.path.exists(os.path.join(home, fname)):
+            return os.path.join(home, fname)
+    if getattr(sys, "frozen", False):
+        bundled = os.path.join(getattr(sys, "_MEIPASS", os.path.dirname(sys.executable)), "u2net", fname)
+        if os.path.exists(bundled):
+            return bundled
+    return None
+
+
+def model_is_downloaded(model_name):
+    """True if the model file is already on disk, so loading it needs no network"""
+    return model_path(model_name) is not None
+
+
+def _loading_from(session_class, path):
+    """session_class, but loading its model from path instead of rembg's download folder"""
+    return type(session_class.__name__, (session_class,), {
+        "download_models": classmethod(lambda cls, *args, **kwargs: path),
+    })
+
+
+def create_session(model_name, session_settings=None):
+    """Create a rembg session with the onnxruntime options from session_settings.
+
+    With the optimized_model_cache setting, CPU sessions load the optimized,
+    memory-mapped copy from model_cache instead of the original file.
+    """
+    import onnxruntime as ort
+    from model_cache import ensure_optimized_model, runs_on_cpu
+
+    session_class = _session_class(model_name)
+
+    # Built directly rather than through new_session so our SessionOptions
+    # are used on every rembg version
+    session_settings = session_settings or DEFAULT_SETTINGS
+    options = build_session_options(session_settings)
+    kwargs = {}
+    providers = session_providers(session_settings)
+    if providers:
+        kwargs["providers"] = providers
+
+    # Not downloaded yet: rembg fetches it, and the next load can use the cache
+    source_path = model_path(model_name)
+    if source_path is not None:
+        load_path = source_path
+        if session_settings.get("optimized_model_cache", True) and runs_on_cpu(session_settings):
+            optimized_path = ensure_optimized_model(source_path, session_settings)
+            if optimized_path is not None:
+                load_path = optimized_path
+                # Already optimized; doing it again would only cost time
+                options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        session_class = _loading_from(session_class, load_path)
+    return session_class(model_name, options, **kwargs)
+
+
+class ModelSessionManager:
+    """Owns the single rembg/ONNX session shared by every processing job"""
+
+    def __init__(self, model_name=DEFAULT_MODEL, session_settings=None):
+        self.model_name = model_name
+        self.session_settings = dict(session_settings or DEFAULT_SETTINGS)
+        self.load_seconds = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_loaded(self):
+        return self._session is not None
+
+    def get(self):
+        """Return the shared session, creating it on first use"""
+        return self._get_timed()[0]
+
+    def _get_timed(self):
+        """(session, load_seconds) read together, so a concurrent switch cannot pair them wrongly"""
+        with self._lock:
+            if self._session is None:
+                self._session = self._load(self.model_name)
+            return self._session, self.load_seconds
+
+    def predict(self, image):
+        """Run the shared session, so the manager can stand in for a session"""
+        return self.get().predict(image)
+
+    def predict_batch(self, images, max_batch_size=None):
+        """Masks for several images from batched runs of the shared session"""
+        from batch_inference import predict_batch
+
+        return predict_batch(self.get(), images, max_batch_size)
+
+    def _load(self, model_name):
+        log(f"Loading model '{model_name}'...")
+        start = time.perf_counter()
+        session = create_session(model_name, self.session_settings)
+        self.load_seconds = time.perf_counter() - start
+        log(f"Model '{model_name}' loaded in {self.load_seconds:.2f}s")
+        return session
+
+    def warm_up(self, callback=None):
+        """Load the model and run one tiny inference on a background thread.
+
+        callback(load_seconds, error) is called from that thread when done.
+        load_seconds is that of the session this warm-up loaded or found, and
+        None if it failed before one existed.
+        """
+        def run():
+            error = None
+            load_seconds = None
+            try:
+                from PIL import Image
+
+                session, load_seconds = self._get_timed()
+                session.predict(Image.new("RGB", (32, 32)))
+            except Exception as e:
+                error = e
+                log(f"Model warm-up failed: {e}")
+            if callback:
+                callback(load_seconds, error)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def switch_model(self, model_name):
+        """Drop the current session so the next get() loads model_name"""
+        if model_name == self.model_name and self._session is not None:
+            return False
+        self._replace(model_name, self.session_settings)
+        log(f"Switched model to '{model_name}'")
+        return True
+
+    def configure(self, session_settings):
+        """Apply new onnxruntime options; the session is rebuilt on next use"""
+        self._replace(self.model_name, dict(session_settings))
+        log("Session settings changed")
+
+    def _replace(self, model_name, session_settings):
+        with self._lock:
+            old_session = self._session
+            self._session = None
+            self.model_name = model_name
+            self.session_settings = session_settings
+            self.load_seconds = None
+        # Release the old ONNX session before the new one is allocated
+        del old_session
+        gc.collect()
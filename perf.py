@@ -0,0 +1,296 @@
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _windows_memory_counters():
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    handle = ctypes.windll.kernel32.GetCurrentProcess()
+    ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb)
+    return counters
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process, or 0 if it cannot be read"""
+    try:
+        if os.name == 'nt':
+            return _windows_memory_counters().PeakWorkingSetSize
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+        return peak if sys.platform == "darwin" else peak * 1024
+    except Exception:
+        return 0
+
+
+def current_rss_bytes():
+    """Current resident set size of this process, or 0 if it cannot be read"""
+    try:
+        if os.name == 'nt':
+            return _windows_memory_counters().WorkingSetSize
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return 0
+
+
+def process_memory():
+    """{"rss", "pss", "private"} bytes of this process.
+
+    pss (proportional set size) splits shared pages between the processes
+    mapping them, and private counts anonymous memory only; both come from
+    /proc/self/smaps_rollup and are 0 where it does not exist.
+    """
+    memory = {"rss": current_rss_bytes(), "pss": 0, "private": 0}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key == "Pss":
+                    memory["pss"] = int(value.split()[0]) * 1024
+                elif key == "Anonymous":
+                    memory["private"] = int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        pass
+    return memory
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of a non-empty list"""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * pct / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def format_bytes(size):
+    """Human readable byte count"""
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def _measure_removal(path, model_name, proxy_size, session_settings):
+    """Remove the background of path once and report time and memory.
+
+    Runs in a fresh process so the peak RSS belongs to this mode alone.
+    """
+    from model_session import create_session
+    from pipeline import load_image, predict_mask, cutout
+
+    session = create_session(model_name, session_settings)
+    baseline_rss = current_rss_bytes()
+
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        original = load_image(f.read())
+    mask = predict_mask(original, session, proxy_size)
+    cutout(original, mask)
+    seconds = time.perf_counter() - start
+
+    return {
+        "mode": f"proxy {proxy_size}px" if proxy_size else "full resolution",
+        "seconds": seconds,
+        "baseline_rss": baseline_rss,
+        "peak_rss": peak_rss_bytes(),
+    }
+
+
+def compare_modes(path, model_name, proxy_size, session_settings=None):
+    """Measure full-resolution and downscaled inference in separate processes"""
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for mode_proxy_size in (None, proxy_size):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results.append(executor.submit(_measure_removal, path, model_name, mode_proxy_size, session_settings).result())
+    return results
+
+
+def print_mode_comparison(results):
+    print(f"{'Mode':<20}{'Wall time':>12}{'Peak RSS':>14}{'Peak - model':>16}")
+    for result in results:
+        print(f"{result['mode']:<20}{result['seconds']:>11.2f}s"
+              f"{format_bytes(result['peak_rss']):>14}"
+              f"{format_bytes(result['peak_rss'] - result['baseline_rss']):>16}")
+
+
+def _load_model_worker(model_name, session_settings, barrier, results):
+    """Create a session, run it once and report load time and memory"""
+    try:
+        from PIL import Image
+        from model_session import create_session
+        import rembg  # noqa: F401 - imported before timing so load_seconds is only the session
+
+        start = time.perf_counter()
+        session = create_session(model_name, session_settings)
+        load_seconds = time.perf_counter() - start
+        session.predict(Image.new("RGB", (64, 64)))
+        # Measured while every worker holds its session, so pages they share
+        # are split between them in pss
+        barrier.wait()
+        results.put(dict(process_memory(), load_seconds=load_seconds))
+        barrier.wait()
+    except Exception as e:
+        barrier.abort()
+        results.put({"error": str(e)})
+
+
+def compare_model_loading(model_name, workers=2, session_settings=None, timeout=300):
+    """Load model_name in several processes at once, from the original file and from the optimized copy"""
+    from model_cache import ensure_optimized_model
+    from model_session import model_path
+    from settings import DEFAULT_SETTINGS
+
+    source_path = model_path(model_name)
+    if source_path is None:
+        raise FileNotFoundError(f"Model '{model_name}' is not downloaded")
+    session_settings = dict(session_settings or DEFAULT_SETTINGS)
+    # Created up front so the cached run shows a later cold start, not the first one
+    ensure_optimized_model(source_path, session_settings)
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for cached in (False, True):
+        settings = dict(session_settings, optimized_model_cache=cached)
+        barrier = context.Barrier(workers, timeout=timeout)
+        queue = context.Queue()
+        processes = [context.Process(target=_load_model_worker, args=(model_name, settings, barrier, queue))
+                     for _ in range(workers)]
+        for process in processes:
+            process.start()
+        measurements = [queue.get(timeout=timeout) for _ in processes]
+        for process in processes:
+            process.join()
+        errors = [m["error"] for m in measurements if "error" in m]
+        if errors:
+            raise RuntimeError(errors[0])
+        results.append({
+            "mode": "optimized copy (mmap)" if cached else "original .onnx",
+            "workers": measurements,
+        })
+    return results
+
+
+def print_model_loading(results):
+    print(f"{'Mode':<24}{'Load':>8}{'RSS':>12}{'PSS':>12}{'Private':>12}")
+    for result in results:
+        workers = result["workers"]
+        count = len(workers)
+        print(f"{result['mode']:<24}"
+              f"{sum(w['load_seconds'] for w in workers) / count:>7.2f}s"
+              f"{format_bytes(sum(w['rss'] for w in workers) / count):>12}"
+              f"{format_bytes(sum(w['pss'] for w in workers) / count):>12}"
+              f"{format_bytes(sum(w['private'] for w in workers) / count):>12}")
+    print(f"Per-worker averages over {len(results[0]['workers'])} workers loaded at the same time")
+
+
+def _measure_matting(path, mask_path, model_name, proxy_size, session_settings, method):
+    """Matte path once with method ("rembg" or "band") and report time, memory and stage times.
+
+    Runs in a fresh process so the peak RSS belongs to this method alone; the
+    mask comes from mask_path or, without one, from the model.
+    """
+    from PIL import Image
+    from pipeline import load_image, predict_mask
+    from tracing import tracer
+
+    with open(path, "rb") as f:
+        original = load_image(f.read()).convert("RGB")
+    if mask_path:
+        mask = Image.open(mask_path).convert("L").resize(original.size, Image.Resampling.BILINEAR)
+    else:
+        from model_session import create_session
+
+        mask = predict_mask(original, create_session(model_name, session_settings), proxy_size)
+    baseline_rss = current_rss_bytes()
+
+    trace = tracer.start("compare_matting", method=method)
+    start = time.perf_counter()
+    with tracer.activate(trace):
+        if method == "rembg":
+            from rembg.bg import alpha_matting_cutout
+            from mask_refine import scale_for
+            from refine_options import MATTING_BACKGROUND_THRESHOLD, MATTING_ERODE, MATTING_FOREGROUND_THRESHOLD
+
+            erode_size = max(1, round(MATTING_ERODE * scale_for(original.size)))
+            alpha = alpha_matting_cutout(original, mask, MATTING_FOREGROUND_THRESHOLD, MATTING_BACKGROUND_THRESHOLD,
+                                         erode_size).getchannel("A")
+        else:
+            from mask_refine import alpha_matte
+
+            alpha = alpha_matte(original, mask)[1]
+    seconds = time.perf_counter() - start
+
+    return {
+        "mode": "rembg closed-form" if method == "rembg" else "band-limited",
+        "seconds": seconds,
+        "baseline_rss": baseline_rss,
+        "peak_rss": peak_rss_bytes(),
+        "stages": trace.summary(),
+        "alpha": alpha.tobytes(),
+        "mask": mask.tobytes(),
+    }
+
+
+def compare_matting(path, model_name, proxy_size=None, session_settings=None, mask_path=None, reference=True):
+    """Matte one image with rembg's closed-form matting and with mask_refine, in separate processes"""
+    import numpy as np
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for method in ("rembg", "band") if reference else ("band",):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results.append(executor.submit(_measure_matting, path, mask_path, model_name, proxy_size,
+                                           session_settings, method).result())
+
+    # How far each method moved the mask, and how far apart the two ended up
+    mask = np.frombuffer(results[0]["mask"], dtype=np.uint8).astype(np.int16)
+    for result in results:
+        alpha = np.frombuffer(result.pop("alpha"), dtype=np.uint8).astype(np.int16)
+        result.pop("mask")
+        result["changed"] = float(np.mean(np.abs(alpha - mask) > 25))
+        result["alpha"] = alpha
+    if reference:
+        difference = np.abs(results[0]["alpha"] - results[1]["alpha"])
+        results[1]["mean_difference"] = float(difference.mean())
+        results[1]["disagreement"] = float(np.mean(difference > 25))
+    for result in results:
+        del result["alpha"]
+    return results
+
+
+def print_matting_comparison(results):
+    print(f"{'Method':<20}{'Wall time':>12}{'Peak RSS':>14}{'Peak - input':>16}{'Mask changed':>15}")
+    for result in results:
+        print(f"{result['mode']:<20}{result['seconds']:>11.2f}s"
+              f"{format_bytes(result['peak_rss']):>14}"
+              f"{format_bytes(result['peak_rss'] - result['baseline_rss']):>16}"
+              f"{result['changed']:>14.2%}")
+    band = results[-1]
+    if "mean_difference" in band:
+        print(f"Band-limited vs rembg: mean alpha difference {band['mean_difference']:.2f}/255, "
+              f"{band['disagreement']:.2%} of pixels differ by more than 10%")
+    print(f"Band-limited stages: {band['stages']}")
@@ -0,0 +1,204 @@
+import io
+import time
+
+from PIL import Image, ImageOps
+
+from perf import format_bytes
+from tracing import span
+
+# Longest side of the proxy used by downscaled inference. u2net works at
+# 320x320 internally; the extra headroom gives the guided filter edges to follow.
+DEFAULT_PROXY_SIZE = 1024
+EXIF_ORIENTATION = 0x0112
+# Orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+# A reduced JPEG decode may fall this far short of max_size: half of a 12 MP
+# photo is 2000 pixels wide, which no preview can tell from 2048
+DRAFT_MIN_FRACTION = 0.75
+
+
+class LazyImage:
+    """Encoded image bytes whose header has been read but not their pixels.
+
+    size is the upright size, after the EXIF orientation. Each decode() call
+    decodes the pixels again, so a reduced decode for the preview and a full
+    one for the saved output never keep each other alive; every decode is
+    recorded in decodes with its scale, time and size in memory.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        with span("open", bytes=len(data)):
+            header = Image.open(io.BytesIO(data))
+        self.format = header.format
+        self.animated = getattr(header, "is_animated", False)
+        self.stored_size = header.size
+        self.orientation = header.getexif().get(EXIF_ORIENTATION, 1)
+        self.size = self.stored_size[::-1] if self.orientation in TRANSPOSED_ORIENTATIONS else self.stored_size
+        self.decodes = []
+
+    def decode(self, max_size=None):
+        """The upright image, reduced to at most max_size on its longest side if given.
+
+        JPEGs are decoded at the smallest DCT scale (1/2, 1/4 or 1/8) that
+        still about covers max_size, so the full-size pixels are never produced.
+        """
+        start = time.perf_counter()
+        image = Image.open(io.BytesIO(self.data))
+        reduced = max_size is not None and max(self.stored_size) > max_size
+        if reduced:
+            # draft picks the largest scale whose result still covers both sides
+            scale = max_size * DRAFT_MIN_FRACTION / max(self.stored_size)
+            image.draft(image.mode, (max(1, round(image.width * scale)), max(1, round(image.height * scale))))
+        scale = image.size[0] / self.stored_size[0]
+        with span("decode", width=image.width, height=image.height, scale=scale):
+            image.load()
+        with span("exif_transpose"):
+            image = ImageOps.exif_transpose(image)
+        if reduced and max(image.size) > max_size:
+            with span("reduce", size=max_size):
+                image = shrink_image(image, max_size)
+        self.decodes.append({
+            "max_size": max_size,
+            "scale": scale,
+            "width": image.width,
+            "height": image.height,
+            "seconds": time.perf_counter() - start,
+            "bytes": image_bytes(image),
+        })
+        return image
+
+
+def describe_decode(record):
+    """A LazyImage decode record as text, e.g. "1512x2016 at 1/2 scale in 41 ms, 8.7 MB" """
+    scale = "full scale" if record["scale"] >= 1 else f"1/{round(1 / record['scale'])} scale"
+    return (f"{record['width']}x{record['height']} at {scale} in {record['seconds'] * 1000:.0f} ms, "
+            f"{format_bytes(record['bytes'])}")
+
+
+def load_image(data):
+    """Decode image bytes at full size and apply the EXIF orientation"""
+    return LazyImage(data).decode()
+
+
+def image_bytes(image):
+    """Memory taken by the pixels of a decoded image"""
+    return image.width * image.height * len(image.getbands())
+
+
+def shrink_image(image, max_size):
+    """A copy of image reduced to at most max_size on its longest side, keeping its mode"""
+    # reducing by an integer factor first is much cheaper than a full resample
+    factor = max(image.size) // max_size
+    reduced = image.reduce(factor) if factor > 1 else image.copy()
+    if max(reduced.size) > max_size:
+        reduced.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    return reduced
+
+
+def make_proxy(image, max_size):
+    """Return a copy of image whose longest side is at most max_size"""
+    proxy = image.convert("RGB") if image.mode not in ("RGB", "L") else image.copy()
+    # reducing by an integer factor first is much cheaper than a full resample
+    factor = max(proxy.width, proxy.height) // (2 * max_size)
+    if factor > 1:
+        proxy = proxy.reduce(factor)
+    proxy.thumbnail((max_size, max_size), Image.Resampling.BILINEAR)
+    return proxy
+
+
+def predict_mask(image, session, proxy_size=None):
+    """Run the model and return its alpha mask as an 'L' image the size of image.
+
+    With proxy_size the model sees a downscaled copy and the mask is brought
+    back to full resolution with an edge-aware guided upsample.
+    """
+    if proxy_size and max(image.size) > proxy_size:
+        from mask_ops import guided_upsample
+
+        with span("proxy_resize", size=proxy_size):
+            proxy = make_proxy(image, proxy_size)
+        with span("inference"):
+            low_mask = session.predict(proxy)[0]
+        with span("post_process", method="guided_upsample"):
+            return guided_upsample(image, low_mask.convert("L"), low_guide=proxy)
+
+    with span("inference"):
+        masks = session.predict(image)
+    with span("post_process"):
+        return masks[0].convert("L")
+
+
+def predict_masks(images, session, proxy_size=None, max_batch_size=None):
+    """predict_mask for several images, running the model on them as one batch"""
+    from batch_inference import predict_batch
+
+    images = list(images)
+    proxies = images
+    if proxy_size:
+        with span("proxy_resize", size=proxy_size):
+            proxies = [make_proxy(image, proxy_size) if max(image.size) > proxy_size else image for image in images]
+    # A ModelSessionManager stands in for its session here too
+    batch_predict = getattr(session, "predict_batch", None)
+    if batch_predict is not None:
+        masks = batch_predict(proxies, max_batch_size)
+    else:
+        masks = predict_batch(session, proxies, max_batch_size)
+    if not proxy_size:
+        return masks
+
+    from mask_ops import guided_upsample
+
+    with span("post_process", method="guided_upsample"):
+        return [mask if proxy is image else guided_upsample(image, mask, low_guide=proxy)
+                for image, proxy, mask in zip(images, proxies, masks)]
+
+
+def cutout(image, mask):
+    """Apply mask as alpha, leaving fully transparent pixels black like rembg does"""
+    empty = Image.new("RGBA", image.size, 0)
+    return Image.composite(image.convert("RGBA"), empty, mask)
+
+
+def fit_mask(mask, image, low_guide=None):
+    """Bring a mask predicted on a reduced copy of image up to image's size.
+
+    With low_guide, the reduced copy, the edges are snapped to image with a
+    guided upsample like proxy inference does; otherwise the mask is resized
+    the way rembg resizes the model output.
+    """
+    if mask.size == image.size:
+        return mask
+    if low_guide is not None:
+        from mask_ops import guided_upsample
+
+        with span("mask_upscale", method="guided_upsample"):
+            return guided_upsample(image, mask, low_guide=low_guide)
+    with span("mask_upscale", method="lanczos"):
+        return mask.resize(image.size, Image.Resampling.LANCZOS)
+
+
+def mask_options(proxy_size=None, max_size=None):
+    """Options that change the mask, used as part of the result cache key.
+
+    max_size is set when the mask was predicted on a reduced decode.
+    """
+    options = {"proxy_size": proxy_size} if proxy_size else {}
+    if max_size:
+        options["max_size"] = max_size
+    return options
+
+
+def get_mask(image, session, cache=None, cache_key=None, proxy_size=None):
+    """Return (mask, cache_hit), running the model only on a cache miss"""
+    if cache is not None and cache_key is not None:
+        with span("cache_lookup"):
+            mask = cache.get(cache_key)
+        if mask is not None and mask.size == image.size:
+            return mask, True
+
+    mask = predict_mask(image, session, proxy_size)
+    if cache is not None and cache_key is not None:
+        with span("cache_store"):
+            cache.put(cache_key, mask)
+    return mask, False
@@ -0,0 +1,33 @@
+"""Low-level pieces shared by the PNG writers that stream rows and frames to disk.
+
+tiled.PNGStreamWriter writes a still image a block of rows at a time and
+animation.APNGStreamWriter an animated PNG a frame at a time; both build the
+file from these chunks and filter their RGBA rows the same way.
+"""
+import struct
+import zlib
+
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def write_png_chunk(file, chunk_type, data):
+    """Write one PNG chunk: length, type, data and CRC"""
+    file.write(struct.pack(">I", len(data)))
+    file.write(chunk_type)
+    file.write(data)
+    file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type))))
+
+
+def sub_filter_rows(rows, channels=4):
+    """Rows as a (rows, width * channels) uint8 array, PNG "Sub" filtered with their filter-type byte.
+
+    Each byte becomes itself minus the same channel of the pixel to its left.
+    channels is 4 for RGBA rows and 1 for grayscale ones.
+    """
+    filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+    filtered[:, 0] = 1
+    filtered[:, 1:channels + 1] = rows[:, :channels]
+    np.subtract(rows[:, channels:], rows[:, :-channels], out=filtered[:, channels + 1:])
+    return filtered
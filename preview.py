@@ -0,0 +1,88 @@
+from collections import OrderedDict
+
+from PIL import Image
+
+# Largest level kept; no canvas needs more than this
+MAX_PREVIEW_SIZE = 2048
+MIN_LEVEL_SIZE = 128
+CACHED_SIZES = 4
+
+
+class PreviewPyramid:
+    """An image reduced once into halving levels, with per-canvas-size previews cached.
+
+    Showing a preview resamples the smallest level that still covers the
+    requested size instead of the full-resolution image.
+    """
+
+    def __init__(self, image, full_size=None):
+        # full_size is the size of the real image when image is already a
+        # reduced decode (JPEG draft mode)
+        self.full_size = full_size or image.size
+        self.levels = self._build_levels(image)
+        self._cache = OrderedDict()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Decode only as much of the image as the largest preview needs.
+
+        JPEGs are decoded at a reduced DCT scale via draft mode, which is much
+        faster than a full decode followed by a resize.
+        """
+        from pipeline import LazyImage
+
+        lazy = LazyImage(data)
+        return cls(lazy.decode(MAX_PREVIEW_SIZE), lazy.size)
+
+    @staticmethod
+    def _build_levels(image):
+        if image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+        factor = max(image.size) // MAX_PREVIEW_SIZE
+        # A small enough image is used as is; nothing here modifies its pixels
+        top = image.reduce(factor) if factor > 1 else image
+        if max(top.size) > MAX_PREVIEW_SIZE:
+            top.thumbnail((MAX_PREVIEW_SIZE, MAX_PREVIEW_SIZE), Image.Resampling.LANCZOS)
+
+        levels = [top]
+        while min(levels[-1].size) >= 2 * MIN_LEVEL_SIZE:
+            levels.append(levels[-1].reduce(2))
+        return levels
+
+    def fit_size(self, width, height, maintain_aspect=True):
+        """Size of the preview for a width x height area"""
+        if not maintain_aspect:
+            return max(1, width), max(1, height)
+        full_width, full_height = self.full_size
+        scale = min(width / full_width, height / full_height)
+        return max(1, int(full_width * scale)), max(1, int(full_height * scale))
+
+    def get(self, width, height, maintain_aspect=True):
+        """Return a preview image fitting a width x height canvas"""
+        size = self.fit_size(width, height, maintain_aspect)
+        if size in self._cache:
+            self._cache.move_to_end(size)
+            return self._cache[size]
+
+        # The smallest level that is still at least as large as the target
+        level = self.levels[0]
+        for candidate in self.levels:
+            if candidate.width >= size[0] and candidate.height >= size[1]:
+                level = candidate
+        preview = level if level.size == size else level.resize(size, Image.Resampling.LANCZOS)
+
+        self._cache[size] = preview
+        if len(self._cache) > CACHED_SIZES:
+            self._cache.popitem(last=False)
+        return preview
+
+    def images(self):
+        """Every level and cached preview, for memory accounting"""
+        return self.levels + list(self._cache.values())
+
+    def close(self):
+        """Free the pixels of every level and cached preview"""
+        for image in self.images():
+            image.close()
+        self.levels = []
+        self._cache.clear()
@@ -0,0 +1,45 @@
+"""Refinement options and their defaults, kept apart from mask_refine.
+
+compositing builds its default variant from REFINE_DEFAULTS when the GUI
+starts; mask_refine needs NumPy, which is only imported once a mask is
+actually refined.
+"""
+
+# Trimap thresholds and erosion as rembg's alpha matting defaults
+MATTING_FOREGROUND_THRESHOLD = 240
+MATTING_BACKGROUND_THRESHOLD = 10
+MATTING_ERODE = 10
+# Window radius and regularisation of the matting Laplacian, and the
+# conjugate gradient iterations spent solving it
+MATTING_RADIUS = 6
+MATTING_EPS = 1e-5
+MATTING_ITERATIONS = 40
+
+REFINE_DEFAULTS = {
+    "matting": False,
+    # Alpha matting's trimap: alpha above the foreground threshold after
+    # eroding by the erode size is known foreground, below the background
+    # threshold known background, as rembg's alpha_matting_* options
+    "matting_foreground_threshold": MATTING_FOREGROUND_THRESHOLD,
+    "matting_background_threshold": MATTING_BACKGROUND_THRESHOLD,
+    "matting_erode_size": MATTING_ERODE,
+    # The matting Laplacian's window radius in pixels and regularisation,
+    # and the solver's iterations
+    "matting_radius": MATTING_RADIUS,
+    "matting_eps": MATTING_EPS,
+    "matting_iterations": MATTING_ITERATIONS,
+    # Drop specks and fill holes smaller than this percentage of the image
+    "remove_islands": 0,
+    # Grow (positive) or shrink (negative) the mask by this many pixels
+    "edge_shift": 0,
+    # Hard edges: alpha at or above this percentage becomes opaque, the rest transparent
+    "threshold": None,
+    # Soften the edge over about this many pixels
+    "feather": 0,
+}
+MATTING_OPTIONS = tuple(key for key in REFINE_DEFAULTS if key.startswith("matting_"))
+
+
+def matting_options(options):
+    """The alpha matting parameters of a refinement options dict, defaults filled in"""
+    return {key: options.get(key, REFINE_DEFAULTS[key]) for key in MATTING_OPTIONS}
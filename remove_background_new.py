@@ -1,27 +1,52 @@
+from startup import StartupReport
+
+# Created before any other import so the report covers the whole cold start
+startup_report = StartupReport()
+
 import os
 import threading
-from tkinter import Tk, Label, Button, filedialog, Canvas, NW, ttk, StringVar, Frame, TclError, messagebox, Menu
+from tkinter import Tk, Toplevel, Label, Button, filedialog, Canvas, NW, ttk, StringVar, BooleanVar, IntVar, Frame, TclError, messagebox, Menu
 from tkinter.messagebox import showinfo, showerror
+from tkinter import colorchooser
 from PIL import Image, ImageTk
-from rembg import remove
-import customtkinter as ctk
-import requests
-import tempfile
 import sys
 import subprocess
 from pathlib import Path
 import time
 import traceback
+from app_log import log
+from model_session import ModelSessionManager, AVAILABLE_MODELS
+from pipeline import DEFAULT_PROXY_SIZE
+from result_cache import ResultCache
+from preview import PreviewPyramid
+from jobs import JobScheduler
+from image_session import ImageSession, make_thumbnail, THUMBNAIL_SIZE
+from batch import find_images
+from clipboard import ClipboardError, image_sources, paste_sources, copy_image
+from app_paths import app_data_dir
+from settings import load_settings, save_settings, available_providers, GRAPH_OPTIMIZATION_LEVELS
+from compositing import DEFAULT_VARIANT, ALPHA_THRESHOLDS, EDGE_SHIFTS, FEATHER_SIZES, ISLAND_AREA_PERCENT
+from encoding import OUTPUT_FORMATS, PNG_COMPRESS_LEVELS, describe, save_output, compare_encoders
+from perf import format_bytes, current_rss_bytes
+from tracing import tracer
+
+startup_report.mark("core_imports")
 
 # Constants for version checking
 CURRENT_VERSION = "1.0.0"  # Update this with your current version
 GITHUB_API_URL = "https://api.github.com/repos/needyamin/img-background-remover/releases/latest"
 REPO_OWNER = "needyamin"
 REPO_NAME = "img-background-remover"
-
-def log(message):
-    """Simple logging function"""
-    print(f"[LOG] {message}")
+STARTUP_REPORT_PATH = os.path.join(app_data_dir(), "startup_report.json")
+# Width of one image's slot in the thumbnail strip
+THUMBNAIL_SLOT = THUMBNAIL_SIZE + 16
+ITEM_STATE_LABELS = {
+    "queued": "Queued",
+    "decode": "Decoding...",
+    "infer": "Removing...",
+    "composite": "Compositing...",
+    "failed": "Failed",
+}
 
 def compare_versions(version1, version2):
     """Compare two version strings. Returns True if version1 > version2"""
@@ -34,11 +59,33 @@ def compare_versions(version1, version2):
 
 class BackgroundRemoverApp:
     def __init__(self, master):
+        # customtkinter is only needed once the real UI is built, after the
+        # splash has been painted
+        ctk = startup_report.timed_import("customtkinter")
+
         self.master = master
         self.master.title("Advanced Background Remover Pro")
         self.master.geometry("1200x800")
         self.master.configure(bg='#2B2B2B')
 
+        # Model and session state, needed by the menu bar
+        self.settings = load_settings()
+        self.session_manager = ModelSessionManager(self.settings["model"], self.settings)
+        self.model_var = StringVar(value=self.session_manager.model_name)
+        self.fast_mode_var = BooleanVar(value=False)
+        self.output_format_var = StringVar(value=self.settings["output_format"])
+        self.png_level_var = IntVar(value=self.settings["png_compress_level"])
+        self.png_optimize_var = BooleanVar(value=self.settings["png_optimize"])
+        self.variant = dict(DEFAULT_VARIANT)
+        self.background_var = StringVar(value=self.variant["background"])
+        self.threshold_var = IntVar(value=0)
+        self.matting_var = BooleanVar(value=False)
+        self.edge_shift_var = IntVar(value=0)
+        self.feather_var = IntVar(value=0)
+        self.islands_var = BooleanVar(value=False)
+        self.profile_var = BooleanVar(value=False)
+        self.startup_check_var = BooleanVar(value=self.settings["check_updates_on_startup"])
+
         # Create Menu Bar
         self.create_menu_bar()
 
@@ -115,6 +162,10 @@ class BackgroundRemoverApp:
         # Add keyboard shortcuts
         self.master.bind('<Control-o>', lambda e: self.upload_image())
         self.master.bind('<Control-s>', lambda e: self.save_processed_image())
+        self.master.bind('<Control-v>', lambda e: self.paste_images())
+        self.master.bind('<Control-c>', lambda e: self.copy_result())
+        self.master.bind('<Left>', lambda e: self.select_relative(-1))
+        self.master.bind('<Right>', lambda e: self.select_relative(1))
 
         # Configure style
         self.style = ttk.Style()
@@ -122,11 +173,28 @@ class BackgroundRemoverApp:
         self.style.configure('Custom.TLabel', background='#2B2B2B', foreground='white')
         
         # Initialize variables
-        self.current_image = None
-        self.processed_image = None
-        self.original_path = None
+        self.current_item = None
+        self.previews = {}
+        self.thumbnail_photos = {}
+        self._strip_redraw_scheduled = False
+        self.result_cache = ResultCache()
         self.status_var = StringVar()
         self.status_var.set("Ready to process images...")
+        self.queue_var = StringVar(value="Queue: 0")
+        self.memory_var = StringVar()
+        self.scheduler = JobScheduler(self.master, on_depth_change=self.update_queue_depth)
+        # Opened images, processed by a decode -> infer -> composite pipeline
+        # whose callbacks are handed to the Tk thread
+        self.image_session = ImageSession(
+            self.session_manager,
+            self.result_cache,
+            on_update=lambda item: self.master.after(0, lambda: self.on_item_update(item)),
+            on_exported=lambda *result: self.master.after(0, lambda: self.on_item_exported(*result)),
+            on_export_error=lambda item, e: self.master.after(0, lambda: self.on_export_error(item, e)),
+            memory_budget=self.settings["memory_budget_mb"] * 1024 * 1024
+        )
+        self.export_total = 0
+        self.export_done = 0
         
         # Create main frame
         self.main_frame = ttk.Frame(master, style='Custom.TFrame')
@@ -139,7 +207,7 @@ class BackgroundRemoverApp:
         # Modern styled buttons
         self.upload_button = ctk.CTkButton(
             self.control_panel,
-            text="Upload Image",
+            text="Upload Images",
             command=self.upload_image,
             width=150,
             height=35,
@@ -148,6 +216,18 @@ class BackgroundRemoverApp:
         )
         self.upload_button.pack(side='left', padx=5)
 
+        # Open folder button
+        self.folder_button = ctk.CTkButton(
+            self.control_panel,
+            text="Open Folder",
+            command=self.open_folder,
+            width=120,
+            height=35,
+            fg_color="#2185d0",
+            hover_color="#1678c2"
+        )
+        self.folder_button.pack(side='left', padx=5)
+
         # Save button
         self.save_button = ctk.CTkButton(
             self.control_panel,
@@ -160,6 +240,19 @@ class BackgroundRemoverApp:
             state='disabled'        )
         self.save_button.pack(side='left', padx=5)
 
+        # Save all button
+        self.save_all_button = ctk.CTkButton(
+            self.control_panel,
+            text="Save All",
+            command=self.save_all_images,
+            width=120,
+            height=35,
+            fg_color="#21ba45",
+            hover_color="#16ab39",
+            state='disabled'
+        )
+        self.save_all_button.pack(side='left', padx=5)
+
         # Progress bar
         self.progress_bar = ttk.Progressbar(
             self.control_panel,
@@ -176,6 +269,23 @@ class BackgroundRemoverApp:
         )
         self.status_label.pack(side='left', padx=5)
 
+        # Queue depth label
+        self.queue_label = ttk.Label(
+            self.control_panel,
+            textvariable=self.queue_var,
+            style='Custom.TLabel'
+        )
+        self.queue_label.pack(side='right', padx=5)
+
+        # Memory use label
+        self.memory_label = ttk.Label(
+            self.control_panel,
+            textvariable=self.memory_var,
+            style='Custom.TLabel'
+        )
+        self.memory_label.pack(side='right', padx=5)
+        self.update_memory_use()
+
         # Create image display area
         self.image_frame = ttk.Frame(self.main_frame, style='Custom.TFrame')
         self.image_frame.pack(fill='both', expand=True)
@@ -200,7 +310,8 @@ class BackgroundRemoverApp:
             highlightthickness=1,
             highlightbackground="#333333"
         )
-        self.original_canvas.pack(pady=5)
+        self.original_canvas.pack(pady=5, fill='both', expand=True)
+        self.original_canvas.bind('<Configure>', lambda e: self.redraw_preview(self.original_canvas))
 
         # Processed image section
         self.processed_frame = ttk.Frame(self.image_frame, style='Custom.TFrame')
@@ -222,7 +333,29 @@ class BackgroundRemoverApp:
             highlightthickness=1,
             highlightbackground="#333333"
         )
-        self.removed_canvas.pack(pady=5)        # Add footer frame
+        self.removed_canvas.pack(pady=5, fill='both', expand=True)
+        self.removed_canvas.bind('<Configure>', lambda e: self.redraw_preview(self.removed_canvas))
+
+        # Thumbnail strip of every opened image; click one to show it
+        self.strip_frame = ttk.Frame(self.main_frame, style='Custom.TFrame')
+        self.strip_frame.pack(fill='x', pady=(10, 0))
+
+        self.thumbnail_canvas = Canvas(
+            self.strip_frame,
+            height=THUMBNAIL_SIZE + 30,
+            bg='#1e1e1e',
+            highlightthickness=1,
+            highlightbackground="#333333"
+        )
+        self.thumbnail_canvas.pack(fill='x')
+        self.thumbnail_canvas.bind('<Button-1>', self.select_thumbnail)
+
+        self.strip_scrollbar = ttk.Scrollbar(self.strip_frame, orient='horizontal',
+                                             command=self.thumbnail_canvas.xview)
+        self.strip_scrollbar.pack(fill='x')
+        self.thumbnail_canvas.configure(xscrollcommand=self.strip_scrollbar.set)
+        self.enable_drag_and_drop()
+        # Add footer frame
         self.footer_frame = ttk.Frame(self.main_frame, style='Custom.TFrame')
         self.footer_frame.pack(fill='x', pady=(10, 0))
 
@@ -302,31 +435,140 @@ class BackgroundRemoverApp:
         # File Menu
         file_menu = Menu(menubar, tearoff=0)
         menubar.add_cascade(label="File", menu=file_menu)
-        file_menu.add_command(label="Open Image", command=self.upload_image, accelerator="Ctrl+O")
+        file_menu.add_command(label="Open Images...", command=self.upload_image, accelerator="Ctrl+O")
+        file_menu.add_command(label="Open Folder...", command=self.open_folder)
+        file_menu.add_command(label="Add Images...", command=self.add_images)
+        file_menu.add_separator()
         file_menu.add_command(label="Save Image", command=self.save_processed_image, accelerator="Ctrl+S")
+        file_menu.add_command(label="Save All...", command=self.save_all_images)
+
+        format_menu = Menu(file_menu, tearoff=0)
+        file_menu.add_cascade(label="Output Format", menu=format_menu)
+        for output_format, (label, _, _) in OUTPUT_FORMATS.items():
+            format_menu.add_radiobutton(label=label, value=output_format, variable=self.output_format_var,
+                                        command=self.save_encoder_settings)
+        format_menu.add_separator()
+        for level in PNG_COMPRESS_LEVELS:
+            format_menu.add_radiobutton(label=f"PNG compression {level}", value=level,
+                                        variable=self.png_level_var, command=self.save_encoder_settings)
+        format_menu.add_checkbutton(label="Optimize PNG (smallest, slowest)", variable=self.png_optimize_var,
+                                    command=self.save_encoder_settings)
+        file_menu.add_command(label="Compare Output Formats", command=self.compare_output_formats)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self.master.quit)
 
+        # Model Menu
+        model_menu = Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="Model", menu=model_menu)
+        for model_name in AVAILABLE_MODELS:
+            model_menu.add_radiobutton(
+                label=model_name,
+                value=model_name,
+                variable=self.model_var,
+                command=lambda name=model_name: self.switch_model(name)
+            )
+
+        model_menu.add_separator()
+        model_menu.add_checkbutton(
+            label=f"Fast Mode (infer at {DEFAULT_PROXY_SIZE}px, upsample mask)",
+            variable=self.fast_mode_var
+        )
+        model_menu.add_separator()
+        model_menu.add_command(label="Session Settings...", command=self.show_session_settings)
+        model_menu.add_command(label="Benchmark Models", command=self.benchmark_models)
+
+        # Background Menu: every entry recomposites the stored mask, never reruns the model
+        background_menu = Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="Background", menu=background_menu)
+        for label, background in (("Transparent", "transparent"), ("Solid Colour...", "color"),
+                                  ("Blurred Original", "blur"), ("Custom Image...", "image")):
+            background_menu.add_radiobutton(
+                label=label,
+                value=background,
+                variable=self.background_var,
+                command=lambda kind=background: self.set_background(kind)
+            )
+        background_menu.add_separator()
+        threshold_menu = Menu(background_menu, tearoff=0)
+        background_menu.add_cascade(label="Hard Edges", menu=threshold_menu)
+        threshold_menu.add_radiobutton(label="Off (soft alpha)", value=0, variable=self.threshold_var,
+                                       command=self.update_variant)
+        for threshold in ALPHA_THRESHOLDS:
+            threshold_menu.add_radiobutton(label=f"Alpha threshold {threshold}%", value=threshold,
+                                           variable=self.threshold_var, command=self.update_variant)
+        edge_menu = Menu(background_menu, tearoff=0)
+        background_menu.add_cascade(label="Grow / Shrink Edge", menu=edge_menu)
+        edge_menu.add_radiobutton(label="Off", value=0, variable=self.edge_shift_var, command=self.update_variant)
+        for pixels in EDGE_SHIFTS:
+            edge_menu.add_radiobutton(label=f"{'Grow' if pixels > 0 else 'Shrink'} {abs(pixels)} px", value=pixels,
+                                      variable=self.edge_shift_var, command=self.update_variant)
+        feather_menu = Menu(background_menu, tearoff=0)
+        background_menu.add_cascade(label="Feather Edge", menu=feather_menu)
+        feather_menu.add_radiobutton(label="Off", value=0, variable=self.feather_var, command=self.update_variant)
+        for pixels in FEATHER_SIZES:
+            feather_menu.add_radiobutton(label=f"{pixels} px", value=pixels, variable=self.feather_var,
+                                         command=self.update_variant)
+        background_menu.add_checkbutton(label="Remove Specks and Holes", variable=self.islands_var,
+                                        command=self.update_variant)
+        background_menu.add_checkbutton(label="Alpha Matting (slower, finer hair)", variable=self.matting_var,
+                                        command=self.update_variant)
+
         # Edit Menu
         edit_menu = Menu(menubar, tearoff=0)
         menubar.add_cascade(label="Edit", menu=edit_menu)
+        edit_menu.add_command(label="Paste Image", command=self.paste_images, accelerator="Ctrl+V")
+        edit_menu.add_command(label="Copy Result", command=self.copy_result, accelerator="Ctrl+C")
+        edit_menu.add_separator()
         edit_menu.add_command(label="Clear Images", command=self.clear_images)
+        edit_menu.add_command(label="Clear Result Cache", command=self.clear_result_cache)
 
         # Help Menu
         help_menu = Menu(menubar, tearoff=0)
         menubar.add_cascade(label="Help", menu=help_menu)
         help_menu.add_command(label="Check for Updates", command=self.check_for_updates)
+        help_menu.add_checkbutton(label="Check for Updates at Startup", variable=self.startup_check_var,
+                                  command=self.save_startup_check_setting)
+        help_menu.add_command(label="Startup Report", command=self.show_startup_report)
+        help_menu.add_checkbutton(
+            label="Profile Processing (cProfile + tracemalloc)",
+            variable=self.profile_var,
+            command=lambda: setattr(tracer, "profile", self.profile_var.get())
+        )
         help_menu.add_separator()
         help_menu.add_command(label="About", command=self.show_about)
 
     def clear_images(self):
-        """Clear both canvases"""
-        self.original_canvas.delete("all")
-        self.removed_canvas.delete("all")
-        self.current_image = None
-        self.processed_image = None
+        """Close every image, freeing its previews, and clear the canvases"""
+        self.clear_preview(self.original_canvas)
+        self.clear_preview(self.removed_canvas)
+        self.thumbnail_canvas.delete("all")
+        self.thumbnail_photos.clear()
+        # Cancelled jobs deliver nothing, so none of them shows a freed preview
+        self.scheduler.cancel_all()
+        self.current_item = None
+        self.image_session.clear()
         self.save_button.configure(state='disabled')
+        self.save_all_button.configure(state='disabled')
         self.status_var.set("Ready to process images...")
+        self.update_queue_depth()
+        self.update_memory_use()
+
+    def clear_result_cache(self):
+        """Delete every cached mask"""
+        self.result_cache.clear()
+        self.status_var.set("Result cache cleared")
+
+    def show_startup_report(self):
+        """Show the cold-start timings of this run"""
+        report = startup_report.as_dict()
+        lines = [f"{name.replace('_', ' ').capitalize()}: {seconds * 1000:.0f} ms"
+                 for name, seconds in report["marks"].items()]
+        lines.append("")
+        lines.append("Imports:")
+        lines.extend(f"  {name}: {seconds * 1000:.0f} ms" for name, seconds in report["imports"].items())
+        lines.append("")
+        lines.append(f"Saved to {STARTUP_REPORT_PATH}")
+        messagebox.showinfo("Startup Report", "\n".join(lines))
 
     def show_about(self):
         """Show about dialog"""
@@ -341,85 +583,600 @@ using advanced AI technology.
         messagebox.showinfo("About", about_text)
 
     def upload_image(self, event=None):
-        file_path = filedialog.askopenfilename(
-            filetypes=[("Image Files", "*.png *.jpg *.jpeg *.bmp *.webp")]
+        """Open one or more images, replacing the current ones"""
+        file_paths = filedialog.askopenfilenames(
+            filetypes=[("Image Files", "*.png *.jpg *.jpeg *.bmp *.webp *.gif")]
         )
-        if file_path:
-            self.process_image(file_path)
+        if file_paths:
+            self.open_images(file_paths)
 
-    def process_image(self, file_path):
-        self.original_path = file_path
-        self.status_var.set("Processing image... Please wait...")
-        self.progress_bar.start()
-        
-        def process():
+    def open_folder(self):
+        """Open every image in a folder and its subfolders"""
+        folder = filedialog.askdirectory(title="Open a folder of images")
+        if not folder:
+            return
+        file_paths = list(find_images(folder))
+        if not file_paths:
+            showerror("Error", f"No images found in {folder}")
+            return
+        self.open_images(file_paths)
+
+    def add_images(self):
+        """Add images to the ones already open"""
+        file_paths = filedialog.askopenfilenames(
+            filetypes=[("Image Files", "*.png *.jpg *.jpeg *.bmp *.webp *.gif")]
+        )
+        if file_paths:
+            self.open_images(file_paths, replace=False)
+
+    def enable_drag_and_drop(self):
+        """Accept files, folders and image data dropped on the canvases (needs tkinterdnd2)"""
+        try:
+            from tkinterdnd2 import DND_FILES, DND_TEXT, TkinterDnD
+            TkinterDnD._require(self.master)
+        except (ImportError, RuntimeError, TclError) as e:
+            log(f"Drag and drop unavailable: {e}")
+            return
+        for widget in (self.original_canvas, self.removed_canvas, self.thumbnail_canvas):
+            widget.drop_target_register(DND_FILES, DND_TEXT)
+            widget.dnd_bind('<<Drop>>', self.on_drop)
+
+    def on_drop(self, event):
+        """Open dropped files, folders or data:image URIs without copying them to disk"""
+        try:
+            sources = image_sources(self.master.tk.splitlist(event.data))
+        except TclError:
+            sources = []
+        if not sources:
+            # Dropped text is not a Tcl list; try it line by line
+            sources = image_sources(str(event.data).splitlines())
+        if sources:
+            self.open_images(sources, replace=False, label="Dropped image")
+        else:
+            self.status_var.set("No image found in the dropped data")
+        return event.action
+
+    def paste_images(self, event=None):
+        """Open the image, image files or image paths on the clipboard"""
+        try:
+            sources = paste_sources(self.master)
+        except ClipboardError as e:
+            showerror("Paste Image", str(e))
+            return
+        if not sources:
+            self.status_var.set("No image on the clipboard")
+            return
+        self.open_images(sources, replace=False, label="Pasted image")
+
+    def copy_result(self, event=None):
+        """Copy the selected image's full-size output to the clipboard"""
+        item = self.current_item
+        if item is None or not item.done:
+            showerror("Error", "No processed image to copy!")
+            return
+
+        variant = dict(self.variant)
+        self.status_var.set(f"Copying {item.name}...")
+
+        def run():
             try:
-                # Load and display original image
-                original = Image.open(file_path)
-                self.current_image = original
-                self.display_image(original, self.original_canvas, maintain_aspect=True)
+                copy_image(item.full_source().render(variant))
+            except Exception as e:
+                error = str(e)
+                self.master.after(0, lambda: showerror("Error", f"Failed to copy image: {error}"))
+                return
+            self.master.after(0, lambda: self.status_var.set(f"Copied {item.name} to the clipboard"))
 
-                # Remove background while preserving quality
-                output = remove(original)
-                self.processed_image = output
+        threading.Thread(target=run, daemon=True).start()
 
-                # Display processed image
-                self.display_image(output, self.removed_canvas, maintain_aspect=True)
-                
-                self.master.after(0, lambda: self.status_var.set("Image processed successfully!"))
-                self.master.after(0, lambda: self.save_button.configure(state='normal'))
-                
+    def open_images(self, sources, replace=True, label="Pasted image"):
+        """Queue paths, image bytes or PIL images for background removal.
+
+        The open images are closed first unless replace is False; label names
+        images that have no file name.
+        """
+        if replace:
+            self.clear_images()
+        proxy_size = DEFAULT_PROXY_SIZE if self.fast_mode_var.get() else None
+        items = self.image_session.add(sources, proxy_size, self.variant, label)
+        if self.current_item is None:
+            self.select_item(items[0])
+        self.status_var.set(f"Processing {len(self.image_session.items)} image(s)... Please wait...")
+        self.update_queue_depth()
+        self.schedule_strip_redraw()
+
+    def on_item_update(self, item):
+        """An image moved to another pipeline stage, finished or failed (Tk thread)"""
+        if item not in self.image_session.items:
+            return
+        if item is self.current_item:
+            self.show_item(item)
+        if item.state == "failed":
+            log(f"Failed to process {item.path or item.name}: {item.error}")
+            self.status_var.set(f"Error: {item.name}: {item.error}")
+        elif item.done and item is self.current_item:
+            self.show_item_status(item)
+        if item.done:
+            self.trim_memory()
+        self.update_queue_depth()
+        self.schedule_strip_redraw()
+
+        if item.done or item.state == "failed":
+            items = self.image_session.items
+            done = sum(1 for other in items if other.done)
+            failed = sum(1 for other in items if other.state == "failed")
+            if done + failed == len(items) and len(items) > 1:
+                self.status_var.set(f"Processed {done} of {len(items)} images"
+                                    + (f", {failed} failed" if failed else ""))
+            if done:
+                self.save_all_button.configure(state='normal')
+
+    def select_item(self, item):
+        self.current_item = item
+        self.image_session.store.touch(item)
+        self.show_item(item)
+        if item.done:
+            self.show_item_status(item)
+        elif item.state == "failed":
+            self.status_var.set(f"Error: {item.name}: {item.error}")
+        if item.done and not item.has_previews:
+            self.restore_previews(item)
+        self.schedule_strip_redraw()
+
+    def select_relative(self, offset):
+        """Select the previous or next image in the strip"""
+        items = self.image_session.items
+        if self.current_item not in items:
+            return
+        index = items.index(self.current_item) + offset
+        if 0 <= index < len(items):
+            self.select_item(items[index])
+
+    def select_thumbnail(self, event):
+        index = int(self.thumbnail_canvas.canvasx(event.x)) // THUMBNAIL_SLOT
+        items = self.image_session.items
+        if 0 <= index < len(items):
+            self.select_item(items[index])
+
+    def show_item(self, item):
+        """Show item's original and, once processed, its output"""
+        if item.original_preview is not None:
+            if self.previews.get(self.original_canvas, (None,))[0] is not item.original_preview:
+                self.display_image(item.original_preview, self.original_canvas)
+        else:
+            self.clear_preview(self.original_canvas)
+
+        if item.done and item.has_previews:
+            if self.previews.get(self.removed_canvas, (None,))[0] is not item.output_preview:
+                self.display_image(item.output_preview, self.removed_canvas)
+            # The background may have been changed since this image was composited
+            if item.variant != self.variant:
+                self.update_variant()
+        else:
+            self.clear_preview(self.removed_canvas)
+        self.save_button.configure(state='normal' if item.done else 'disabled')
+
+    def restore_previews(self, item):
+        """Rebuild the previews the memory budget dropped, then show them"""
+        self.status_var.set(f"Loading {item.name}...")
+
+        def done(result):
+            if item is self.current_item:
+                self.show_item(item)
+                self.show_item_status(item)
+            self.trim_memory()
+
+        self.scheduler.submit(lambda job: item.restore_previews(), on_done=done,
+                              on_error=self.show_processing_error)
+
+    def trim_memory(self):
+        """Keep the opened images within the memory budget and show the memory in use"""
+        self.image_session.store.trim(keep={self.current_item})
+        self.update_memory_use()
+
+    def update_memory_use(self):
+        self.memory_var.set(f"Images: {self.image_session.store.describe()} | "
+                            f"Process: {format_bytes(current_rss_bytes())}")
+
+    def show_item_status(self, item):
+        source = "from cache" if item.cache_hit else "with model"
+        status = f"{item.name} processed {source} ({item.trace.summary()}), decoded {item.describe_decodes()}"
+        if item.animated:
+            status += " | animated: showing the first frame, saved as an animated PNG"
+        if item.trace.profile_path:
+            status += f" | profile: {item.trace.profile_path}"
+        self.status_var.set(status)
+
+    def schedule_strip_redraw(self):
+        """Redraw the thumbnail strip once for a burst of updates"""
+        if not self._strip_redraw_scheduled:
+            self._strip_redraw_scheduled = True
+            self.master.after(50, self.redraw_thumbnails)
+
+    def redraw_thumbnails(self):
+        """Draw one slot per image, outlining the selected one"""
+        self._strip_redraw_scheduled = False
+        canvas = self.thumbnail_canvas
+        canvas.delete("all")
+        items = self.image_session.items
+        for index, item in enumerate(items):
+            x = index * THUMBNAIL_SLOT + 8
+            outline = '#2185d0' if item is self.current_item else '#333333'
+            canvas.create_rectangle(x - 4, 4, x + THUMBNAIL_SIZE + 4, THUMBNAIL_SIZE + 12, outline=outline, width=2)
+            photo = self.thumbnail_photo(item)
+            if photo is not None:
+                canvas.create_image(x + THUMBNAIL_SIZE // 2, 8 + THUMBNAIL_SIZE // 2, image=photo)
+            label = item.name if item.done else ITEM_STATE_LABELS.get(item.state, item.state)
+            if len(label) > 16:
+                label = label[:15] + "…"
+            canvas.create_text(x + THUMBNAIL_SIZE // 2, THUMBNAIL_SIZE + 22, text=label,
+                               fill='#ff6b6b' if item.state == "failed" else 'white', font=('Helvetica', 8))
+        canvas.configure(scrollregion=(0, 0, len(items) * THUMBNAIL_SLOT + 8, THUMBNAIL_SIZE + 30))
+
+    def thumbnail_photo(self, item):
+        """PhotoImage of item's thumbnail, rebuilt only when the thumbnail changes"""
+        if item.thumbnail is None:
+            return None
+        cached = self.thumbnail_photos.get(item)
+        if cached is None or cached[0] is not item.thumbnail:
+            cached = (item.thumbnail, ImageTk.PhotoImage(item.thumbnail))
+            self.thumbnail_photos[item] = cached
+        return cached[1]
+
+    def set_background(self, background):
+        """Ask for the colour or picture a background needs, then recomposite"""
+        if background == "color":
+            color = colorchooser.askcolor(color=self.variant["color"], title="Background Colour")[1]
+            if not color:
+                self.background_var.set(self.variant["background"])
+                return
+            self.variant["color"] = color
+        elif background == "image":
+            path = filedialog.askopenfilename(
+                title="Choose a background image",
+                filetypes=[("Image files", "*.png *.jpg *.jpeg *.bmp *.gif *.tiff *.webp")]
+            )
+            if not path:
+                self.background_var.set(self.variant["background"])
+                return
+            self.variant["background_path"] = path
+        self.update_variant()
+
+    def update_variant(self):
+        """Recomposite the selected image for the chosen background and mask refinements.
+
+        Other images are recomposited when they are selected or saved.
+        """
+        self.variant.update(
+            background=self.background_var.get(),
+            threshold=self.threshold_var.get() or None,
+            matting=self.matting_var.get(),
+            edge_shift=self.edge_shift_var.get(),
+            feather=self.feather_var.get(),
+            remove_islands=ISLAND_AREA_PERCENT if self.islands_var.get() else 0
+        )
+        # An image still in the pipeline is checked again when it finishes
+        item = self.current_item
+        if item is None or not item.done or item.variant == self.variant:
+            return
+        # Previews being rebuilt are checked again once they are shown
+        if not item.has_previews:
+            return
+
+        source = item.preview_source
+        variant = dict(self.variant)
+        if variant["matting"]:
+            self.status_var.set("Applying alpha matting...")
+        self.scheduler.submit(
+            lambda job: PreviewPyramid(source.render(variant)),
+            on_done=lambda preview: self.show_variant(item, preview, variant),
+            on_error=self.show_processing_error
+        )
+
+    def show_variant(self, item, preview, variant):
+        replaced = item.output_preview
+        item.output_preview = preview
+        item.thumbnail = make_thumbnail(preview)
+        item.variant = variant
+        if item is self.current_item:
+            self.display_image(preview, self.removed_canvas)
+        # The old output is no longer on screen once the new one is
+        if replaced is not None and self.previews.get(self.removed_canvas, (None,))[0] is not replaced:
+            replaced.close()
+        self.update_memory_use()
+        self.status_var.set(f"Background: {variant['background']}")
+        self.schedule_strip_redraw()
+
+    def show_processing_error(self, error):
+        self.status_var.set(f"Error: {str(error)}")
+        showerror("Error", f"Failed to process image: {str(error)}")
+
+    def update_queue_depth(self, depth=None):
+        """Show how many images are still processing and drive the progress bar"""
+        pending = self.image_session.pending
+        items = self.image_session.items
+        done = sum(1 for item in items if item.done)
+        self.queue_var.set(f"Queue: {pending} | {done}/{len(items)} done" if items else f"Queue: {pending}")
+        exporting = self.export_done < self.export_total
+        if pending or exporting or self.scheduler.depth:
+            self.progress_bar.start()
+        else:
+            self.progress_bar.stop()
+
+    def warm_up_model(self):
+        """Load the model in the background once the window is visible"""
+        model_name = self.session_manager.model_name
+        self.status_var.set(f"Loading model '{model_name}'...")
+        # rembg is imported here on the Tk thread: numba (pulled in through
+        # pymatting) starts its thread pool on the importing thread, and doing
+        # that from a worker thread can hang interpreter shutdown
+        self.master.update_idletasks()
+        startup_report.timed_import("rembg")
+
+        def done(load_seconds, error):
+            if error:
+                message = f"Model failed to load: {error}"
+            else:
+                loaded = f" (loaded in {load_seconds:.2f}s)" if load_seconds is not None else ""
+                message = f"Model '{model_name}' ready{loaded}"
+                if "model_ready" not in startup_report.marks:
+                    startup_report.mark("model_ready")
+                    startup_report.save(STARTUP_REPORT_PATH)
+                    log(startup_report.summary())
+            self.master.after(0, lambda: self.status_var.set(message))
+
+        self.session_manager.warm_up(callback=done)
+
+    def switch_model(self, model_name):
+        """Replace the shared session with one for model_name"""
+        self.model_var.set(model_name)
+        self.settings["model"] = model_name
+        save_settings(self.settings)
+        if self.session_manager.switch_model(model_name):
+            self.warm_up_model()
+
+    def show_session_settings(self):
+        """Dialog for the onnxruntime execution provider and session options"""
+        dialog = Toplevel(self.master)
+        dialog.title("Session Settings")
+        dialog.configure(bg='#2B2B2B')
+        dialog.transient(self.master)
+
+        provider_var = StringVar(value=self.settings["provider"])
+        intra_var = StringVar(value=str(self.settings["intra_op_num_threads"]))
+        inter_var = StringVar(value=str(self.settings["inter_op_num_threads"]))
+        level_var = StringVar(value=self.settings["graph_optimization_level"])
+        arena_var = BooleanVar(value=self.settings["enable_cpu_mem_arena"])
+        model_cache_var = BooleanVar(value=self.settings["optimized_model_cache"])
+
+        fields = [
+            ("Execution provider", ttk.Combobox(dialog, textvariable=provider_var,
+                                                values=available_providers(), state='readonly')),
+            ("Intra-op threads (0 = auto)", ttk.Spinbox(dialog, textvariable=intra_var, from_=0, to=256, width=8)),
+            ("Inter-op threads (0 = auto)", ttk.Spinbox(dialog, textvariable=inter_var, from_=0, to=256, width=8)),
+            ("Graph optimization", ttk.Combobox(dialog, textvariable=level_var,
+                                                values=GRAPH_OPTIMIZATION_LEVELS, state='readonly')),
+            ("CPU memory arena", ttk.Checkbutton(dialog, variable=arena_var)),
+            ("Cache optimized model (CPU)", ttk.Checkbutton(dialog, variable=model_cache_var)),
+        ]
+        for row, (label, widget) in enumerate(fields):
+            ttk.Label(dialog, text=label, style='Custom.TLabel').grid(row=row, column=0, sticky='w', padx=10, pady=5)
+            widget.grid(row=row, column=1, sticky='w', padx=10, pady=5)
+
+        def apply():
+            try:
+                intra_threads = int(intra_var.get())
+                inter_threads = int(inter_var.get())
+            except ValueError:
+                showerror("Error", "Thread counts must be whole numbers", parent=dialog)
+                return
+            self.settings.update({
+                "provider": provider_var.get(),
+                "intra_op_num_threads": intra_threads,
+                "inter_op_num_threads": inter_threads,
+                "graph_optimization_level": level_var.get(),
+                "enable_cpu_mem_arena": arena_var.get(),
+                "optimized_model_cache": model_cache_var.get(),
+            })
+            save_settings(self.settings)
+            self.session_manager.configure(self.settings)
+            dialog.destroy()
+            self.warm_up_model()
+
+        ttk.Button(dialog, text="Apply", command=apply).grid(row=len(fields), column=1, sticky='e', padx=10, pady=10)
+
+    def benchmark_models(self):
+        """Time every model on the current image (or a bundled sample) in the background"""
+        from model_benchmark import benchmark_models, format_results, pick_fastest
+
+        samples = [self.current_item.path] if self.current_item and self.current_item.path else []
+        self.status_var.set("Benchmarking models... this can take a few minutes")
+        self.progress_bar.start()
+
+        def run():
+            try:
+                results = benchmark_models(AVAILABLE_MODELS, samples, runs=3, session_settings=self.settings)
             except Exception as e:
-                self.master.after(0, lambda: self.status_var.set(f"Error: {str(e)}"))
-                showerror("Error", f"Failed to process image: {str(e)}")
-            finally:
-                self.master.after(0, self.progress_bar.stop)
+                error = str(e)
+                self.master.after(0, lambda: self.finish_benchmark(None, error))
+                return
+            table = format_results(results)
+            self.master.after(0, lambda: self.finish_benchmark(table, pick_fastest(results)))
+
+        threading.Thread(target=run, daemon=True).start()
 
-        threading.Thread(target=process, daemon=True).start()
+    def finish_benchmark(self, table, fastest_or_error):
+        if self.scheduler.depth == 0:
+            self.progress_bar.stop()
+        if table is None:
+            self.status_var.set("Model benchmark failed")
+            showerror("Benchmark Models", f"Benchmark failed: {fastest_or_error}")
+            return
+        log("Model benchmark results:\n" + table)
+        self.status_var.set("Model benchmark finished")
+        message = table
+        if fastest_or_error and fastest_or_error != self.session_manager.model_name:
+            message += f"\n\nSwitch to the fastest acceptable model, {fastest_or_error}?"
+            if messagebox.askyesno("Benchmark Models", message):
+                self.switch_model(fastest_or_error)
+            return
+        messagebox.showinfo("Benchmark Models", message)
 
     def save_processed_image(self, event=None):
-        if self.processed_image is None:
+        item = self.current_item
+        if item is None or not item.done:
             showerror("Error", "No processed image to save!")
             return
 
+        options = self.encoder_options()
+        _, extension, description = OUTPUT_FORMATS[options["output_format"]]
+        if item.animated:
+            extension, description = ".png", "Animated PNG"
+        suffix = "_mask" if options["output_format"] == "mask" else ""
         save_path = filedialog.asksaveasfilename(
-            defaultextension=".png",
-            filetypes=[("PNG files", "*.png")],
-            initialfile="background_removed.png"
+            defaultextension=extension,
+            filetypes=[(description, f"*{extension}")],
+            initialfile=f"{item.stem}{suffix}{extension}"
         )
-        
-        if save_path:
+        if not save_path:
+            return
+
+        # Decoding and encoding a large image takes seconds, so it runs off the Tk thread
+        variant = dict(self.variant)
+        if item.animated:
+            self.save_animation(item, save_path, variant, options)
+            return
+        self.status_var.set(f"Saving {describe(options)}...")
+
+        def run():
             try:
-                # Save with original quality
-                self.processed_image.save(save_path, "PNG", quality=100)
-                showinfo("Success", "Image saved successfully!")
-                self.status_var.set(f"Image saved to: {save_path}")
+                with tracer.trace("save_image", file=os.path.basename(save_path)) as trace:
+                    source = item.full_source()
+                    if options["output_format"] == "mask":
+                        seconds, size = save_output(None, save_path, options, source.effective_mask(variant))
+                    else:
+                        seconds, size = save_output(source.render(variant), save_path, options)
             except Exception as e:
-                showerror("Error", f"Failed to save image: {str(e)}")
+                error = str(e)
+                self.master.after(0, lambda: showerror("Error", f"Failed to save image: {error}"))
+                return
+            log(f"Saved {save_path} as {describe(options)} in {seconds:.2f}s, {format_bytes(size)}")
+            self.master.after(0, lambda: self.status_var.set(
+                f"Saved {describe(options)}, {format_bytes(size)} ({trace.summary()}): {save_path}"))
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def save_animation(self, item, save_path, variant, options):
+        """Process and save every frame of an animated item on a background thread"""
+        self.status_var.set(f"Saving the frames of {item.name}...")
+
+        def run():
+            try:
+                stats = item.save_animation(save_path, self.session_manager, variant, options)
+            except Exception as e:
+                error = str(e)
+                self.master.after(0, lambda: showerror("Error", f"Failed to save animation: {error}"))
+                return
+            self.master.after(0, lambda: self.status_var.set(
+                f"Saved {stats['frames']} frames in {stats['seconds']:.1f}s (model run on {stats['inferred']}, "
+                f"mask reused on {stats['reused'] + stats['warped']}): {save_path}"))
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def save_all_images(self):
+        """Save every processed image to a folder through the decode -> composite -> encode pipeline"""
+        items = [item for item in self.image_session.items if item.done]
+        if not items:
+            showerror("Error", "No processed images to save!")
+            return
+        out_dir = filedialog.askdirectory(title="Save all images to")
+        if not out_dir:
+            return
+
+        options = self.encoder_options()
+        self.export_total = self.image_session.export(items, out_dir, options, self.variant)
+        self.export_done = 0
+        self.progress_bar.start()
+        self.status_var.set(f"Saving {self.export_total} images as {describe(options)}...")
+
+    def on_item_exported(self, item, path, seconds, size):
+        log(f"Saved {path} in {seconds:.2f}s, {format_bytes(size)}")
+        self.export_done += 1
+        self.status_var.set(f"Saved {self.export_done} of {self.export_total} images to {os.path.dirname(path)}")
+        if self.export_done == self.export_total:
+            self.update_queue_depth()
+
+    def on_export_error(self, item, error):
+        log(f"Failed to save {item.name}: {error}")
+        self.export_done += 1
+        self.status_var.set(f"Error saving {item.name}: {error}")
+        if self.export_done == self.export_total:
+            self.update_queue_depth()
+
+    def encoder_options(self):
+        return {
+            "output_format": self.output_format_var.get(),
+            "png_compress_level": self.png_level_var.get(),
+            "png_optimize": self.png_optimize_var.get(),
+            "webp_method": self.settings["webp_method"],
+        }
+
+    def save_encoder_settings(self):
+        self.settings.update(self.encoder_options())
+        save_settings(self.settings)
+
+    def compare_output_formats(self):
+        """Encode the current cutout with every preset in the background and report time and size"""
+        item = self.current_item
+        if item is None or not item.done:
+            showerror("Error", "No processed image to compare!")
+            return
+
+        variant = dict(self.variant)
+        self.status_var.set("Comparing output formats...")
+
+        def run():
+            source = item.full_source()
+            results = compare_encoders(source.render(variant), mask=source.effective_mask(variant))
+            lines = [f"{label}: {seconds * 1000:.0f} ms, {format_bytes(size)}" for label, seconds, size in results]
+            log("Output formats:\n" + "\n".join(lines))
+            self.master.after(0, lambda: self.show_format_comparison(lines))
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def show_format_comparison(self, lines):
+        self.status_var.set(" | ".join(lines))
+        showinfo("Output Formats", "\n".join(lines))
 
     def display_image(self, image, canvas, maintain_aspect=True):
+        """Show an image or PreviewPyramid on canvas (call from the Tk thread)"""
+        if not isinstance(image, PreviewPyramid):
+            image = PreviewPyramid(image)
+        self.previews[canvas] = (image, maintain_aspect)
+        self.redraw_preview(canvas)
+
+    def clear_preview(self, canvas):
+        self.previews.pop(canvas, None)
+        canvas.delete("all")
+        # Drop the PhotoImage too, or its pixels stay in Tk until the next image
+        canvas.image = None
+
+    def redraw_preview(self, canvas):
+        """Redraw canvas from its preview pyramid at the current canvas size"""
+        if canvas not in self.previews:
+            return
+        pyramid, maintain_aspect = self.previews[canvas]
+
         # Get canvas dimensions
         canvas_width = canvas.winfo_width()
         canvas_height = canvas.winfo_height()
+        if canvas_width < 2 or canvas_height < 2:
+            return
 
-        # Calculate scaling factor while maintaining aspect ratio
-        if maintain_aspect:
-            # Calculate scaling factors for both dimensions
-            width_ratio = canvas_width / image.width
-            height_ratio = canvas_height / image.height
-            
-            # Use the smaller ratio to ensure image fits in canvas
-            scale_factor = min(width_ratio, height_ratio)
-            
-            new_width = int(image.width * scale_factor)
-            new_height = int(image.height * scale_factor)
-        else:
-            new_width = canvas_width
-            new_height = canvas_height
+        # Closest pre-reduced level, resized once per canvas size
+        resized_image = pyramid.get(canvas_width, canvas_height, maintain_aspect)
+        new_width, new_height = resized_image.size
 
-        # Resize image while maintaining quality
-        resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        
         # Convert to PhotoImage and display
         tk_image = ImageTk.PhotoImage(resized_image)
         canvas.delete("all")  # Clear previous image
@@ -448,115 +1205,127 @@ using advanced AI technology.
                 print(f"Could not create ICO file: {e}")
         return ico_path
 
-    def check_for_updates(self):
-        """Check for updates on GitHub and return the latest version if available."""
-        try:
-            log("=== Starting Update Check ===")
+    def save_startup_check_setting(self):
+        self.settings["check_updates_on_startup"] = self.startup_check_var.get()
+        save_settings(self.settings)
+
+    def check_for_updates(self, quiet=False):
+        """Check GitHub for a newer release in the background.
+
+        A menu check always asks GitHub, conditionally on the cached ETag; a
+        quiet check (at startup, when enabled in the Help menu) reuses a recent cached answer and only
+        speaks up when an update is available.
+        """
+        from updater import fetch_latest_release
+
+        log("=== Starting Update Check ===")
+        if not quiet:
             self.status_var.set("Checking for updates...")
-            
-            # Make the request with headers to avoid rate limiting
-            headers = {
-                'Accept': 'application/vnd.github.v3+json',
-                'User-Agent': f'background-remover/{CURRENT_VERSION}'
-            }
-            
-            response = requests.get(GITHUB_API_URL, headers=headers, timeout=10)
-            log(f"GitHub API Response Status: {response.status_code}")
-            
-            if response.status_code != 200:
-                log(f"GitHub API Error: {response.text}")
-                self.status_var.set("Failed to check for updates")
-                return None
-                
-            latest_release = response.json()
-            
-            # Check if there's a valid release
-            if 'tag_name' not in latest_release:
-                log("No tag_name found in release")
+
+        # Make the request with headers to avoid rate limiting
+        headers = {
+            'Accept': 'application/vnd.github.v3+json',
+            'User-Agent': f'background-remover/{CURRENT_VERSION}'
+        }
+
+        def run():
+            try:
+                release, source = fetch_latest_release(GITHUB_API_URL, headers, force=not quiet)
+            except Exception as e:
+                error = e
+                self.master.after(0, lambda: self.show_update_check_error(error, quiet))
+                return
+            log(f"Latest release from {source}")
+            self.master.after(0, lambda: self.show_update_check_result(release, quiet))
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def show_update_check_result(self, latest_release, quiet=False):
+        """Tell the user what the update check found (Tk thread)"""
+        # Check if there's a valid release
+        if 'tag_name' not in latest_release:
+            log("No tag_name found in release")
+            if not quiet:
                 self.status_var.set("No updates found")
-                return None
-                
-            # Get the latest version number (strip v prefix if present)
-            latest_version = latest_release.get('tag_name', '').lstrip('v')
-            log(f"Latest version on GitHub: {latest_version}")
-            
-            if not latest_version:
-                log("Empty version tag found in release")
+            return
+
+        # Get the latest version number (strip v prefix if present)
+        latest_version = latest_release.get('tag_name', '').lstrip('v')
+        log(f"Latest version on GitHub: {latest_version}")
+
+        if not latest_version:
+            log("Empty version tag found in release")
+            if not quiet:
                 self.status_var.set("No valid update found")
-                return None
-            
-            if compare_versions(latest_version, CURRENT_VERSION):
-                log(f"New version {latest_version} is available!")
-                self.status_var.set(f"New version {latest_version} available!")
-                if messagebox.askyesno("Update Available", 
-                                     f"Version {latest_version} is available. Would you like to update now?"):
-                    self.download_and_install_update(latest_release)
-            else:
-                log("You have the latest version")
+            return
+
+        if compare_versions(latest_version, CURRENT_VERSION):
+            log(f"New version {latest_version} is available!")
+            self.status_var.set(f"New version {latest_version} available!")
+            if messagebox.askyesno("Update Available",
+                                   f"Version {latest_version} is available. Would you like to update now?"):
+                self.download_and_install_update(latest_release)
+        else:
+            log("You have the latest version")
+            if not quiet:
                 self.status_var.set("You have the latest version")
                 messagebox.showinfo("No Updates", "You have the latest version installed!")
-                return None
-                
-        except requests.exceptions.RequestException as e:
-            log(f"Network error checking for updates: {e}")
-            self.status_var.set("Network error checking for updates")
-            messagebox.showerror("Update Error", f"Network error checking for updates: {e}")
-            return None
-        except Exception as e:
-            log(f"Unexpected error checking for updates: {e}")
-            self.status_var.set("Error checking for updates")
-            messagebox.showerror("Update Error", f"Error checking for updates: {e}")
-            return None
+
+    def show_update_check_error(self, error, quiet=False):
+        import requests
+
+        if isinstance(error, requests.exceptions.RequestException):
+            log(f"Network error checking for updates: {error}")
+            message = f"Network error checking for updates: {error}"
+        else:
+            log(f"Error checking for updates: {error}")
+            message = f"Error checking for updates: {error}"
+        if not quiet:
+            self.status_var.set("Failed to check for updates")
+            messagebox.showerror("Update Error", message)
 
     def download_and_install_update(self, release):
-        """Download and install the latest release."""
+        """Download and verify the latest release in the background, then install it"""
+        from updater import download_update
+
+        latest_version = release.get('tag_name', '').lstrip('v')
+        self.status_var.set(f"Downloading version {latest_version}...")
+
+        def progress(downloaded, total, speed):
+            if total:
+                text = (f"Downloading version {latest_version}: {format_bytes(downloaded)} of "
+                        f"{format_bytes(total)} ({downloaded * 100 // total}%) at {format_bytes(speed)}/s")
+            else:
+                text = f"Downloading version {latest_version}: {format_bytes(downloaded)} at {format_bytes(speed)}/s"
+            self.master.after(0, lambda: self.status_var.set(text))
+
+        def run():
+            try:
+                exe_path = download_update(release, progress)
+            except Exception as e:
+                error_msg = str(e)
+                log(f"Error downloading update: {error_msg}")
+                self.master.after(0, lambda: self.show_update_error(error_msg))
+                return
+            self.master.after(0, lambda: self.install_update(exe_path))
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def show_update_error(self, error_msg):
+        self.status_var.set("Update failed")
+        messagebox.showerror("Update Error", f"Failed to install update: {error_msg}")
+
+    def install_update(self, exe_path):
+        """Swap the verified executable in with a helper script and exit"""
         try:
-            self.status_var.set("Downloading update...")
-            latest_version = release.get('tag_name', '').lstrip('v')
-            
-            # Find the asset with .exe extension
-            assets = release.get('assets', [])
-            exe_asset = None
-            for asset in assets:
-                if asset.get('name', '').lower().endswith('.exe'):
-                    exe_asset = asset
-                    break
-                    
-            if not exe_asset:
-                raise Exception("No executable found in release assets")
-            
-            # Create temporary directory for download
-            with tempfile.TemporaryDirectory() as temp_dir:
-                temp_path = Path(temp_dir)
-                exe_path = temp_path / exe_asset['name']
-                
-                # Download the new version
-                download_url = exe_asset['browser_download_url']
-                log(f"Downloading from: {download_url}")
-                
-                # Show a message to inform the user that download is in progress
-                self.status_var.set(f"Downloading version {latest_version}...")
-                
-                # Download with progress tracking
-                response = requests.get(download_url, stream=True)
-                response.raise_for_status()
-                
-                total_size = int(response.headers.get('content-length', 0))
-                downloaded = 0
-                
-                with open(exe_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        downloaded += len(chunk)
-                        f.write(chunk)
-                
-                self.status_var.set("Installing update...")
-                
-                # Create update script
-                update_script = temp_path / "update.bat"
-                current_exe = sys.executable
-                
-                with open(update_script, 'w') as f:
-                    f.write(f"""@echo off
+            self.status_var.set("Installing update...")
+
+            # The script lives next to the download, which outlives this process
+            update_script = Path(exe_path).parent / "update.bat"
+            current_exe = sys.executable
+
+            with open(update_script, 'w') as f:
+                f.write(f"""@echo off
 echo Waiting for application to close...
 timeout /t 2 /nobreak
 echo Updating Background Remover...
@@ -577,20 +1346,52 @@ if exist "{current_exe}" (
     pause
 )
 """)
-                
-                # Run update script and exit
-                subprocess.Popen([str(update_script)], shell=True)
-                time.sleep(1)
-                sys.exit(0)
-                
-        except Exception as e:
-            error_msg = str(e)
-            log(f"Error installing update: {error_msg}")
-            self.status_var.set("Update failed")
-            messagebox.showerror("Update Error", f"Failed to install update: {error_msg}")
+
+            # Run update script and exit
+            subprocess.Popen([str(update_script)], shell=True)
+            time.sleep(1)
+            sys.exit(0)
+
+        except OSError as e:
+            log(f"Error installing update: {e}")
+            self.show_update_error(str(e))
             return False
 
 if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.freeze_support()
+
+    # Any arguments select a headless command, e.g. "batch IN_DIR OUT_DIR"
+    if len(sys.argv) > 1:
+        from cli import main
+        sys.exit(main(sys.argv[1:]))
+
+    # Paint a lightweight splash first; the real UI and the heavy modules
+    # follow once the window is already on screen
     root = Tk()
-    app = BackgroundRemoverApp(root)
+    root.title("Advanced Background Remover Pro")
+    root.geometry("1200x800")
+    root.configure(bg='#2B2B2B')
+    splash = Label(root, text="Loading Background Remover...", bg='#2B2B2B', fg='white', font=('Helvetica', 14))
+    splash.pack(expand=True)
+    root.update()
+    startup_report.mark("first_paint")
+
+    # Close the PyInstaller splash screen, if the build has one
+    try:
+        import pyi_splash
+        pyi_splash.close()
+    except ImportError:
+        pass
+
+    def start_app():
+        app = BackgroundRemoverApp(root)
+        splash.destroy()
+        root.update_idletasks()
+        startup_report.mark("ui_ready")
+        root.after(100, app.warm_up_model)
+        if app.settings["check_updates_on_startup"]:
+            root.after(5000, lambda: app.check_for_updates(quiet=True))
+
+    root.after(0, start_app)
     root.mainloop()
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import threading
+
+from PIL import Image
+
+from app_log import log
+from app_paths import app_data_dir
+
+# Bump when the stored mask format changes so stale entries are never reused
+CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def default_cache_dir():
+    return os.path.join(app_data_dir(), "masks")
+
+
+class ResultCache:
+    """On-disk cache of alpha masks keyed by input bytes, model and options.
+
+    Masks are stored as compressed 8-bit PNGs. File modification times double
+    as the LRU clock: a hit touches the file, and eviction removes the oldest
+    files until the cache is back under max_bytes.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Counted on the first put rather than here: the GUI creates the cache
+        # on the Tk thread, and a large cache takes a while to walk
+        self._total_bytes = None
+
+    @staticmethod
+    def make_key(data, model_name, options=None):
+        """Hash the input bytes together with everything that affects the mask"""
+        digest = hashlib.sha256()
+        digest.update(data)
+        settings = {"version": CACHE_VERSION, "model": model_name, "options": options or {}}
+        digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".png")
+
+    def _entries(self):
+        """Yield (path, mtime, size) for every cached mask"""
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".png"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def get(self, key):
+        """Return the cached mask for key, or None on a miss"""
+        path = self._path(key)
+        try:
+            with Image.open(path) as cached:
+                mask = cached.convert("L")
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return mask
+
+    def put(self, key, mask):
+        """Store mask under key and evict old entries if over the size cap"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_path = f"{path}.{os.getpid()}.{threading.get_ident()}.partial"
+        try:
+            mask.convert("L").save(partial_path, "PNG", compress_level=9)
+            size = os.path.getsize(partial_path)
+            # Overwriting an entry only adds the difference in size
+            try:
+                size -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(partial_path, path)
+        except OSError as e:
+            log(f"Could not write cache entry: {e}")
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            return
+
+        with self._lock:
+            if self._total_bytes is None:
+                # Includes the entry just written
+                self._total_bytes = sum(entry_size for _, _, entry_size in self._entries())
+            else:
+                self._total_bytes += size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                # Another process may have evicted it already
+                continue
+        self._total_bytes = total
+
+    def clear(self):
+        """Remove every cached mask"""
+        with self._lock:
+            for path, _, _ in list(self._entries()):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._total_bytes = 0
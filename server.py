@@ -0,0 +1,332 @@
+"""Local HTTP service for background removal, built on the standard library.
+
+POST /remove with the image as the request body (or as a multipart/form-data
+file field) returns the PNG cutout; ?output=mask returns the mask instead and
+?proxy_size=N enables downscaled inference. GET /metrics returns queue depth,
+counters and latency histograms as JSON; GET /health reports readiness.
+
+Requests are decoded and encoded on their own handler threads. Only inference
+is funnelled through one thread that owns the ONNX session and drains a
+bounded queue in micro-batches: it waits at most max_wait for up to
+max_batch_size requests, then stacks them into one batched model run.
+At most max_queue requests are handled at once, from reading the upload to
+encoding the answer; further requests are turned away with 503 and a
+Retry-After header before their body is read, instead of piling up.
+"""
+import bisect
+import io
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from app_log import log
+from pipeline import load_image, predict_mask, predict_masks, cutout
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BATCH_SIZE = 8
+DEFAULT_MAX_WAIT = 0.01
+DEFAULT_MAX_QUEUE = 32
+DEFAULT_MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+REQUEST_TIMEOUT = 120
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class Histogram:
+    """Fixed-bucket histogram reported with cumulative counts, like Prometheus"""
+
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self):
+        cumulative = []
+        running = 0
+        for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+            running += count
+            cumulative.append({"le": bound, "count": running})
+        return {"buckets": cumulative, "count": self.count, "sum": round(self.sum, 3)}
+
+
+class ServerMetrics:
+    """Counters and histograms shared by the handler threads and the batch thread"""
+
+    def __init__(self, max_batch_size):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.batches = 0
+        self.histograms = {
+            "queue_wait_ms": Histogram(LATENCY_BUCKETS_MS),
+            "inference_ms": Histogram(LATENCY_BUCKETS_MS),
+            "request_ms": Histogram(LATENCY_BUCKETS_MS),
+            "batch_size": Histogram(range(1, max_batch_size + 1)),
+        }
+
+    def increment(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def observe(self, name, value):
+        with self._lock:
+            self.histograms[name].observe(value)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "rejected": self.rejected,
+                "batches": self.batches,
+                "histograms": {name: histogram.as_dict() for name, histogram in self.histograms.items()},
+            }
+
+
+class MicroBatcher:
+    """Feeds queued images to one session from a single thread, a micro-batch at a time"""
+
+    def __init__(self, session, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait=DEFAULT_MAX_WAIT,
+                 max_queue=DEFAULT_MAX_QUEUE):
+        self.session = session
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.metrics = ServerMetrics(max_batch_size)
+        self._slots = threading.BoundedSemaphore(max_queue)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="inference", daemon=True)
+        self._thread.start()
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def reserve(self):
+        """Take one of the max_queue request slots without waiting; False when all are taken.
+
+        A request holds its slot from before its body is read until it is
+        answered, so a busy server spends no memory on uploads it will turn away.
+        """
+        return self._slots.acquire(blocking=False)
+
+    def release(self):
+        """Give back a slot taken by reserve()"""
+        self._slots.release()
+
+    def submit(self, image, proxy_size=None):
+        """Queue image for inference and return a Future of its mask.
+
+        The queue itself is unbounded; callers keep it within max_queue by
+        holding a slot from reserve() for each request they submit.
+        """
+        future = Future()
+        self._queue.put_nowait((image, proxy_size, future, time.perf_counter()))
+        return future
+
+    def _collect(self):
+        """Block for one request, then take more until the batch is full or max_wait passes"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self.metrics.increment("batches")
+            self.metrics.observe("batch_size", len(batch))
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        start = time.perf_counter()
+        by_proxy_size = {}
+        for image, proxy_size, future, queued_at in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            self.metrics.observe("queue_wait_ms", (start - queued_at) * 1000)
+            by_proxy_size.setdefault(proxy_size, []).append((image, future))
+
+        # One model run per proxy size; every request in it waits for the whole run
+        for proxy_size, requests in by_proxy_size.items():
+            run_start = time.perf_counter()
+            try:
+                masks = predict_masks([image for image, _ in requests], self.session, proxy_size)
+            except Exception:
+                # Find the request that broke the batch and still answer the others
+                self._run_one_by_one(requests, proxy_size)
+                continue
+            milliseconds = (time.perf_counter() - run_start) * 1000
+            for (_, future), mask in zip(requests, masks):
+                future.set_result(mask)
+                self.metrics.observe("inference_ms", milliseconds)
+
+    def _run_one_by_one(self, requests, proxy_size):
+        for image, future in requests:
+            start = time.perf_counter()
+            try:
+                mask = predict_mask(image, self.session, proxy_size)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(mask)
+            self.metrics.observe("inference_ms", (time.perf_counter() - start) * 1000)
+
+
+class RemovalRequestHandler(BaseHTTPRequestHandler):
+    server_version = "BGRemoverPro"
+
+    def log_message(self, format, *args):
+        log(f"{self.address_string()} {format % args}")
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, indent=2).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        batcher = self.server.batcher
+        path = urlparse(self.path).path
+        if path == "/health":
+            self.send_json(200, {"status": "ok", "model": self.server.model_name})
+        elif path == "/metrics":
+            metrics = batcher.metrics.as_dict()
+            metrics.update(queue_depth=batcher.depth, max_queue=batcher.max_queue,
+                           max_batch_size=batcher.max_batch_size)
+            self.send_json(200, metrics)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/remove":
+            self.send_json(404, {"error": "not found"})
+            return
+
+        batcher = self.server.batcher
+        batcher.metrics.increment("requests")
+        start = time.perf_counter()
+        if not batcher.reserve():
+            # The body is left unread, so the connection cannot be reused
+            self.close_connection = True
+            status, payload = 503, {"error": "server busy, retry later", "queue_depth": batcher.depth}
+        else:
+            try:
+                status, payload = self._remove(batcher, parse_qs(url.query))
+            except Exception as e:
+                status, payload = 500, {"error": str(e)}
+            finally:
+                batcher.release()
+        if status != 200:
+            batcher.metrics.increment("rejected" if status == 503 else "errors")
+            headers = {"Retry-After": "1"} if status == 503 else None
+            self.send_json(status, payload, headers)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        batcher.metrics.observe("request_ms", (time.perf_counter() - start) * 1000)
+
+    def _remove(self, batcher, params):
+        """Return (status, PNG bytes or error dict)"""
+        output = params.get("output", ["cutout"])[0]
+        if output not in ("cutout", "mask"):
+            return 400, {"error": "output must be 'cutout' or 'mask'"}
+        try:
+            proxy_size = int(params["proxy_size"][0]) if "proxy_size" in params else None
+        except ValueError:
+            return 400, {"error": "proxy_size must be an integer"}
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            return 411, {"error": "an image body with Content-Length is required"}
+        if length > self.server.max_upload_bytes:
+            return 413, {"error": f"upload is larger than {self.server.max_upload_bytes} bytes"}
+        data = read_upload(self.headers.get("Content-Type", ""), self.rfile.read(length))
+        if data is None:
+            return 400, {"error": "no file found in the multipart body"}
+
+        try:
+            image = load_image(data)
+            image.load()
+        except Exception as e:
+            return 400, {"error": f"could not decode image: {e}"}
+
+        future = batcher.submit(image, proxy_size)
+        try:
+            mask = future.result(timeout=REQUEST_TIMEOUT)
+        except FutureTimeout:
+            future.cancel()
+            return 504, {"error": "inference timed out"}
+
+        result = mask if output == "mask" else cutout(image, mask)
+        buffer = io.BytesIO()
+        result.save(buffer, "PNG")
+        return 200, buffer.getvalue()
+
+
+def read_upload(content_type, body):
+    """Image bytes from a raw body or the first file part of a multipart/form-data body"""
+    if not content_type.startswith("multipart/form-data"):
+        return body
+    message = BytesParser(policy=policy.default).parsebytes(b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+    for part in message.iter_parts():
+        if part.get_filename() or part.get_param("name", header="content-disposition") in ("image", "file"):
+            return part.get_payload(decode=True)
+    return None
+
+
+def create_server(session, model_name, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                  max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait=DEFAULT_MAX_WAIT,
+                  max_queue=DEFAULT_MAX_QUEUE, max_upload_bytes=DEFAULT_MAX_UPLOAD_BYTES):
+    server = ThreadingHTTPServer((host, port), RemovalRequestHandler)
+    server.daemon_threads = True
+    server.batcher = MicroBatcher(session, max_batch_size, max_wait, max_queue)
+    server.model_name = model_name
+    server.max_upload_bytes = max_upload_bytes
+    return server
+
+
+def serve(model_name, session_settings=None, **options):
+    """Load the model and serve until interrupted"""
+    from model_session import create_session
+
+    log(f"Loading model '{model_name}'...")
+    session = create_session(model_name, session_settings)
+    server = create_server(session, model_name, **options)
+    host, port = server.server_address[:2]
+    log(f"Serving on http://{host}:{port} (POST /remove, GET /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
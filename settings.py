@@ -0,0 +1,87 @@
+import json
+import os
+
+from app_log import log
+from app_paths import app_data_dir
+
+SETTINGS_PATH = os.path.join(app_data_dir(), "settings.json")
+
+GRAPH_OPTIMIZATION_LEVELS = ["disable", "basic", "extended", "all"]
+
+# Session options default to onnxruntime's own defaults; 0 threads lets it decide
+DEFAULT_SETTINGS = {
+    "model": "u2net",
+    "provider": "auto",
+    "intra_op_num_threads": 0,
+    "inter_op_num_threads": 0,
+    "graph_optimization_level": "all",
+    "enable_cpu_mem_arena": True,
+    # Load CPU sessions from an optimized, memory-mapped copy (see model_cache)
+    "optimized_model_cache": True,
+    "output_format": "png",
+    "png_compress_level": 6,
+    "png_optimize": False,
+    "webp_method": 4,
+    # Previews of images not viewed recently are dropped above this
+    "memory_budget_mb": 512,
+    # Off by default: the app only contacts GitHub when asked to
+    "check_updates_on_startup": False,
+}
+
+
+def load_settings(path=SETTINGS_PATH):
+    """Saved settings merged over the defaults; unknown keys are ignored"""
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        with open(path, encoding="utf-8") as f:
+            saved = json.load(f)
+        settings.update({key: value for key, value in saved.items() if key in DEFAULT_SETTINGS})
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        log(f"Could not read settings, using defaults: {e}")
+    return settings
+
+
+def save_settings(settings, path=SETTINGS_PATH):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(settings, f, indent=2)
+    except OSError as e:
+        log(f"Could not save settings: {e}")
+
+
+def available_providers():
+    """Execution providers this onnxruntime build offers, plus "auto" for rembg's choice"""
+    import onnxruntime as ort
+
+    return ["auto"] + ort.get_available_providers()
+
+
+def build_session_options(settings):
+    """Translate settings into an onnxruntime SessionOptions"""
+    import onnxruntime as ort
+
+    levels = {
+        "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = int(settings.get("intra_op_num_threads", 0))
+    options.inter_op_num_threads = int(settings.get("inter_op_num_threads", 0))
+    options.graph_optimization_level = levels[settings.get("graph_optimization_level", "all")]
+    options.enable_cpu_mem_arena = bool(settings.get("enable_cpu_mem_arena", True))
+    return options
+
+
+def session_providers(settings):
+    """Provider list for the session, or None to let rembg pick"""
+    provider = settings.get("provider", "auto")
+    if provider == "auto":
+        return None
+    if provider == "CPUExecutionProvider":
+        return [provider]
+    return [provider, "CPUExecutionProvider"]
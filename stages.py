@@ -0,0 +1,114 @@
+"""A chain of processing stages, each on its own thread, joined by bounded queues.
+
+While one image is in inference the next can be decoding and the previous
+one compositing or encoding, so with a steady stream of images each one costs
+about as much as the slowest stage instead of the sum of all of them. The
+queues between stages are bounded: a slow stage makes the faster ones ahead
+of it wait instead of piling up decoded images in memory.
+"""
+import queue
+import threading
+import time
+
+from app_log import log
+
+# Items allowed to wait between two stages
+DEFAULT_QUEUE_SIZE = 2
+
+
+class StagePipeline:
+    """Runs every submitted item through stages, a list of (name, func) pairs.
+
+    Each func(item, payload) returns the payload for the next stage; the first
+    stage gets the payload given to submit(). on_stage(item, name) is called
+    as an item enters a stage, on_result(item, payload) with the last stage's
+    payload and on_error(item, exception) when a stage raises. All three are
+    called on the stage threads; an exception from one is logged and does not
+    stop the stage or the item.
+    """
+
+    def __init__(self, stages, queue_size=DEFAULT_QUEUE_SIZE, on_stage=None, on_result=None, on_error=None):
+        self.stage_names = [name for name, _ in stages]
+        self.on_stage = on_stage
+        self.on_result = on_result
+        self.on_error = on_error
+        # Seconds each stage has spent working, to find the bottleneck
+        self.busy_seconds = dict.fromkeys(self.stage_names, 0.0)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._pending = 0
+        # Submitted items only wait as paths and options, so the intake is unbounded
+        self._queues = [queue.Queue()] + [queue.Queue(maxsize=queue_size) for _ in stages[1:]]
+        for index, (name, func) in enumerate(stages):
+            threading.Thread(target=self._stage_loop, args=(index, name, func),
+                             name=f"stage-{name}", daemon=True).start()
+
+    @property
+    def pending(self):
+        """Items submitted since the last cancel() and not yet finished or failed"""
+        with self._lock:
+            return self._pending
+
+    def submit(self, item, payload=None):
+        with self._lock:
+            self._pending += 1
+            generation = self._generation
+        self._queues[0].put((generation, item, payload))
+
+    def cancel(self):
+        """Drop every unfinished item; nothing more is reported for them"""
+        with self._lock:
+            self._generation += 1
+            self._pending = 0
+        # Items already between stages are dropped by the stage that picks them up
+        while True:
+            try:
+                self._queues[0].get_nowait()
+            except queue.Empty:
+                break
+
+    def _stage_loop(self, index, name, func):
+        inbox = self._queues[index]
+        outbox = self._queues[index + 1] if index + 1 < len(self._queues) else None
+        while True:
+            generation, item, payload = inbox.get()
+            if generation != self._generation:
+                continue
+            self._notify(self.on_stage, item, name)
+
+            start = time.perf_counter()
+            try:
+                payload = func(item, payload)
+            except Exception as e:
+                self._finish_item(generation, name, start)
+                if generation == self._generation:
+                    self._notify(self.on_error, item, e)
+                continue
+
+            if outbox is not None:
+                self._add_busy(name, start)
+                # Blocks while the next stage is behind, holding this one back too
+                outbox.put((generation, item, payload))
+            else:
+                self._finish_item(generation, name, start)
+                if generation == self._generation:
+                    self._notify(self.on_result, item, payload)
+
+    def _notify(self, callback, item, value):
+        """Call a callback, logging what it raises so the stage thread keeps running"""
+        if callback is None:
+            return
+        try:
+            callback(item, value)
+        except Exception as e:
+            log(f"Pipeline callback {callback.__name__} failed for {item}: {e}")
+
+    def _add_busy(self, name, start):
+        with self._lock:
+            self.busy_seconds[name] += time.perf_counter() - start
+
+    def _finish_item(self, generation, name, start):
+        self._add_busy(name, start)
+        with self._lock:
+            if generation == self._generation:
+                self._pending -= 1
@@ -0,0 +1,59 @@
+import importlib
+import json
+import os
+import sys
+import time
+
+from app_log import log
+
+
+class StartupReport:
+    """Records cold-start milestones and the cost of heavy imports.
+
+    All times are seconds since the report was created, which the GUI does
+    as the very first thing it imports.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks = {}
+        self.imports = {}
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def mark(self, name):
+        """Record a milestone the first time it is reached"""
+        if name not in self.marks:
+            self.marks[name] = self.elapsed()
+
+    def timed_import(self, module_name):
+        """Import module_name, recording how long it took if it was not loaded yet"""
+        if module_name in sys.modules:
+            return sys.modules[module_name]
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        self.imports[module_name] = time.perf_counter() - start
+        return module
+
+    def as_dict(self):
+        return {
+            "python": sys.version.split()[0],
+            "frozen": bool(getattr(sys, "frozen", False)),
+            "marks": {name: round(seconds, 4) for name, seconds in self.marks.items()},
+            "imports": {name: round(seconds, 4) for name, seconds in self.imports.items()},
+        }
+
+    def summary(self):
+        """One line for the status bar and the log"""
+        parts = [f"{name.replace('_', ' ')} {seconds * 1000:.0f} ms" for name, seconds in self.marks.items()]
+        return "Startup: " + ", ".join(parts)
+
+    def save(self, path):
+        """Write the report as JSON so cold starts can be compared between releases"""
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(self.as_dict(), f, indent=2)
+        except OSError as e:
+            log(f"Could not save startup report: {e}")
@@ -0,0 +1,41 @@
+"""A local HTTP server that answers with canned replies, for the updater tests."""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        self.server.respond(self)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer:
+    """Serves respond(handler) on 127.0.0.1 and records the headers of every request"""
+
+    def __init__(self, respond):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self._server.respond = respond
+        self._server.requests = []
+        self.url = f"http://127.0.0.1:{self._server.server_port}/"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def requests(self):
+        return self._server.requests
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def reply(handler, status, body=b"", headers=None):
+    handler.send_response(status)
+    for name, value in (headers or {}).items():
+        handler.send_header(name, value)
+    handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
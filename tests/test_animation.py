@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from animation import remove_background_animation
+
+DURATIONS = [40, 60, 80, 100]
+
+
+class BrightnessSession:
+    """Stands in for a model: everything brighter than mid-grey is foreground"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, image):
+        self.calls += 1
+        return [image.convert("L").point(lambda value: 255 if value > 160 else 0)]
+
+
+def textured_frame(seed, width=160, height=120):
+    """Smooth noise to track motion by, with a bright square as the subject"""
+    noise = np.random.default_rng(seed).integers(40, 120, (height, width), dtype=np.uint8)
+    pixels = np.array(Image.fromarray(noise).filter(ImageFilter.GaussianBlur(2)))
+    pixels[40:80, 50:90] = 230
+    return pixels
+
+
+def synthetic_clip(path):
+    """A frame, the same frame with a few pixels changed, the frame shifted, and a new scene"""
+    first = textured_frame(1)
+    nudged = first.copy()
+    nudged[5:9, 5:9] = 0
+    shifted = np.roll(first, (6, 10), axis=(0, 1))
+    frames = [Image.fromarray(pixels).convert("RGB") for pixels in (first, nudged, shifted, textured_frame(2))]
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=DURATIONS, loop=0)
+    return frames
+
+
+def test_animation_reuses_and_warps_masks(tmp_path):
+    src, dst = str(tmp_path / "clip.png"), str(tmp_path / "cutout.png")
+    frames = synthetic_clip(src)
+    session = BrightnessSession()
+
+    stats = remove_background_animation(src, dst, session)
+
+    assert (stats["frames"], stats["inferred"], stats["reused"], stats["warped"]) == (4, 2, 1, 1)
+    assert session.calls == 2
+    with Image.open(dst) as result:
+        assert result.n_frames == 4
+        durations = []
+        for index in range(result.n_frames):
+            result.seek(index)
+            durations.append(result.info["duration"])
+            alpha = np.asarray(result.convert("RGBA").getchannel("A")).astype(int)
+            expected = np.asarray(session.predict(frames[index])[0]).astype(int)
+            # The warped mask is the first one moved, so only its edges may differ
+            assert np.mean(np.abs(alpha - expected) > 64) < 0.01
+    assert durations == DURATIONS
+    assert not os.path.exists(dst + ".partial")
+
+
+def test_mask_only_writes_grayscale_frames_to_both_outputs(tmp_path):
+    src = str(tmp_path / "clip.png")
+    synthetic_clip(src)
+
+    remove_background_animation(src, str(tmp_path / "masks.png"), BrightnessSession(), mask_only=True)
+    remove_background_animation(src, str(tmp_path / "masks"), BrightnessSession(), mask_only=True)
+
+    with Image.open(tmp_path / "masks.png") as animated:
+        assert (animated.mode, animated.n_frames) == ("L", 4)
+    names = sorted(os.listdir(tmp_path / "masks"))
+    assert names == [f"frame_{index:05d}.png" for index in range(1, 5)]
+    for name in names:
+        with Image.open(tmp_path / "masks" / name) as frame:
+            assert frame.mode == "L"
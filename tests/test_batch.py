@@ -0,0 +1,19 @@
+import os
+
+from PIL import Image
+
+from batch import find_images
+
+
+def test_find_images_skips_output_folder_inside_input(tmp_path):
+    for relative in ("a.png", "sub/b.jpg", "out/a.png", "out/out/a.png", "sub/out/c.png", "notes.txt"):
+        path = tmp_path / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if relative.endswith("txt"):
+            path.write_text("not an image")
+        else:
+            Image.new("RGB", (4, 4)).save(path)
+
+    found = [os.path.relpath(path, tmp_path) for path in find_images(str(tmp_path), str(tmp_path / "out"))]
+
+    assert found == ["a.png", os.path.join("sub", "b.jpg"), os.path.join("sub", "out", "c.png")]
@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from compositing import CompositeSource, DEFAULT_VARIANT
+from mask_refine import alpha_matte, trimap_from_mask
+from refine_options import REFINE_DEFAULTS
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def portrait(size=200):
+    """A disc on a two-tone background and its soft mask"""
+    image = Image.new("RGB", (size, size), (30, 120, 200))
+    ImageDraw.Draw(image).rectangle((0, 0, size // 2, size), fill=(200, 200, 40))
+    mask = Image.new("L", (size, size), 0)
+    ImageDraw.Draw(mask).ellipse((size // 4, size // 4, 3 * size // 4, 3 * size // 4), fill=255)
+    ImageDraw.Draw(image).ellipse((size // 4, size // 4, 3 * size // 4, 3 * size // 4), fill=(220, 60, 60))
+    return image, mask.filter(ImageFilter.GaussianBlur(4))
+
+
+def test_trimap_thresholds():
+    alpha = np.array([[0, 5, 20, 128, 235, 250, 255]], dtype=np.uint8)
+
+    assert trimap_from_mask(alpha, 1).tolist() == [[0, 0, 128, 128, 128, 255, 255]]
+    assert trimap_from_mask(alpha, 1, 200, 30).tolist() == [[0, 0, 0, 128, 255, 255, 255]]
+
+
+def test_matting_defaults_match_explicit_options():
+    image, mask = portrait()
+    defaults = {key: value for key, value in REFINE_DEFAULTS.items() if key.startswith("matting_")}
+
+    implicit = np.asarray(alpha_matte(image, mask)[1])
+    explicit = np.asarray(alpha_matte(image, mask, defaults)[1])
+
+    assert np.array_equal(implicit, explicit)
+
+
+def test_matting_options_change_the_result():
+    image, mask = portrait()
+    source = CompositeSource(image, mask)
+    variant = dict(DEFAULT_VARIANT, matting=True)
+
+    default = np.asarray(source.effective_mask(variant))
+    wider = np.asarray(source.effective_mask(dict(variant, matting_erode_size=30, matting_iterations=5)))
+
+    assert not np.array_equal(default, wider)
+    # Changing the parameters back reuses nothing computed for the other ones
+    assert np.array_equal(np.asarray(source.effective_mask(variant)), default)
+
+
+def test_gui_starts_without_numpy():
+    # mask_refine and NumPy are imported when a mask is first refined, not when the window opens
+    result = subprocess.run([sys.executable, "-c", "import sys, remove_background_new; print('numpy' in sys.modules)"],
+                            cwd=REPO, capture_output=True, text=True, check=True)
+
+    assert result.stdout.strip() == "False"
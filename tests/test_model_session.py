@@ -0,0 +1,34 @@
+import threading
+import time
+
+import model_session
+from model_session import ModelSessionManager
+
+
+class SlowSession:
+    def predict(self, image):
+        time.sleep(0.2)
+        return [image]
+
+
+def test_warm_up_reports_its_own_load_time_across_a_switch(monkeypatch):
+    monkeypatch.setattr(model_session, "create_session", lambda name, settings: SlowSession())
+    manager = ModelSessionManager("u2net")
+    finished = threading.Event()
+    results = []
+
+    def callback(load_seconds, error):
+        results.append((load_seconds, error))
+        finished.set()
+
+    manager.warm_up(callback)
+    # The switch clears the manager's load time while the warm-up inference runs
+    while not manager.is_loaded:
+        time.sleep(0.01)
+    manager.switch_model("u2netp")
+    assert finished.wait(5)
+
+    load_seconds, error = results[0]
+    assert error is None
+    assert isinstance(load_seconds, float)
+    assert manager.load_seconds is None
@@ -0,0 +1,48 @@
+import os
+
+from PIL import Image
+
+from result_cache import ResultCache
+
+
+def mask(angle, size=64):
+    return Image.linear_gradient("L").rotate(angle).resize((size, size))
+
+
+def test_opening_does_not_walk_the_cache(tmp_path, monkeypatch):
+    ResultCache(str(tmp_path)).put("ab" * 32, mask(50))
+
+    def walk():
+        raise AssertionError("walked the cache directory")
+
+    monkeypatch.setattr(ResultCache, "_entries", lambda self: walk())
+    ResultCache(str(tmp_path))
+
+
+def test_overwriting_an_entry_counts_its_size_once(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    key = "cd" * 32
+    for _ in range(5):
+        cache.put(key, mask(50))
+
+    assert cache._total_bytes == sum(size for _, _, size in cache._entries())
+
+
+def test_first_put_counts_existing_entries(tmp_path):
+    ResultCache(str(tmp_path)).put("ab" * 32, mask(50))
+    cache = ResultCache(str(tmp_path))
+    cache.put("cd" * 32, mask(60))
+
+    assert cache._total_bytes == sum(size for _, _, size in cache._entries())
+    assert cache.get("ab" * 32) is not None
+
+
+def test_evicts_oldest_over_the_cap(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("ab" * 32, mask(50))
+    os.utime(cache._path("ab" * 32), (1, 1))
+    cache.max_bytes = cache._total_bytes + 1
+    cache.put("cd" * 32, mask(50))
+
+    assert cache.get("ab" * 32) is None
+    assert cache.get("cd" * 32) is not None
@@ -0,0 +1,104 @@
+import io
+import threading
+import time
+
+import pytest
+import requests
+from PIL import Image
+
+from server import MicroBatcher, create_server
+
+# Images this size make the stub model fail
+BROKEN_SIZE = (13, 13)
+
+
+class StubSession:
+    """Records the size of every batch; predict_batch is what predict_masks uses when a session has it"""
+
+    def __init__(self, gate=None):
+        self.batches = []
+        self.gate = gate
+        self.entered = threading.Event()
+
+    def predict_batch(self, images, max_batch_size=None):
+        self.entered.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.batches.append(len(images))
+        if any(image.size == BROKEN_SIZE for image in images):
+            raise RuntimeError("bad input")
+        return [Image.new("L", image.size, 255) for image in images]
+
+    def predict(self, image):
+        if image.size == BROKEN_SIZE:
+            raise RuntimeError("bad input")
+        return [Image.new("L", image.size, 128)]
+
+
+def png_bytes(size=(20, 10)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_batches_are_capped_at_max_batch_size():
+    session = StubSession()
+    batcher = MicroBatcher(session, max_batch_size=3, max_wait=0.5)
+
+    futures = [batcher.submit(Image.new("RGB", (8, 8))) for _ in range(7)]
+
+    assert all(future.result(5).size == (8, 8) for future in futures)
+    assert session.batches == [3, 3, 1]
+
+
+def test_a_lone_request_waits_at_most_max_wait():
+    session = StubSession()
+    batcher = MicroBatcher(session, max_batch_size=8, max_wait=0.2)
+
+    start = time.perf_counter()
+    batcher.submit(Image.new("RGB", (8, 8))).result(5)
+    elapsed = time.perf_counter() - start
+
+    assert session.batches == [1]
+    assert 0.2 <= elapsed < 2
+
+
+def test_failed_batch_is_retried_one_request_at_a_time():
+    session = StubSession()
+    batcher = MicroBatcher(session, max_batch_size=3, max_wait=0.5)
+
+    good, broken, other = [batcher.submit(Image.new("RGB", size)) for size in [(8, 8), BROKEN_SIZE, (6, 6)]]
+
+    assert good.result(5).getextrema() == (128, 128)
+    assert other.result(5).size == (6, 6)
+    with pytest.raises(RuntimeError, match="bad input"):
+        broken.result(5)
+    assert session.batches == [3]
+
+
+def test_busy_server_answers_503_with_retry_after():
+    gate = threading.Event()
+    session = StubSession(gate)
+    server = create_server(session, "stub", port=0, max_queue=1, max_wait=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/remove?output=mask"
+    try:
+        first = {}
+        worker = threading.Thread(target=lambda: first.update(response=requests.post(url, data=png_bytes())))
+        worker.start()
+        assert session.entered.wait(5)
+
+        busy = requests.post(url, data=png_bytes())
+        gate.set()
+        worker.join(5)
+
+        assert busy.status_code == 503
+        assert busy.headers["Retry-After"] == "1"
+        assert first["response"].status_code == 200
+        assert Image.open(io.BytesIO(first["response"].content)).size == (20, 10)
+        metrics = requests.get(url.replace("/remove?output=mask", "/metrics")).json()
+        assert (metrics["requests"], metrics["rejected"]) == (2, 1)
+    finally:
+        gate.set()
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,36 @@
+import threading
+
+from stages import StagePipeline
+
+
+def test_failing_callbacks_do_not_stop_the_pipeline():
+    finished = threading.Event()
+    results, errors = [], []
+
+    def on_stage(item, name):
+        raise RuntimeError("on_stage failed")
+
+    def on_result(item, payload):
+        results.append((item, payload))
+        if len(results) + len(errors) == 3:
+            finished.set()
+        raise RuntimeError("on_result failed")
+
+    def on_error(item, exception):
+        errors.append(item)
+        if len(results) + len(errors) == 3:
+            finished.set()
+        raise RuntimeError("on_error failed")
+
+    def divide(item, payload):
+        return 10 // payload
+
+    pipeline = StagePipeline([("add", lambda item, payload: payload + 1), ("divide", divide)],
+                             on_stage=on_stage, on_result=on_result, on_error=on_error)
+    for item, payload in [("first", 1), ("broken", -1), ("last", 4)]:
+        pipeline.submit(item, payload)
+
+    assert finished.wait(5)
+    assert results == [("first", 5), ("last", 2)]
+    assert errors == ["broken"]
+    assert pipeline.pending == 0
@@ -0,0 +1,121 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import tiled
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs remove_background_tiled in a fresh interpreter and prints the growth of
+# its peak RSS over the resident memory before the call, then the estimate.
+# The high-water mark is read from /proc and reset just before the call;
+# getrusage would report the pytest process the child was forked from.
+MEASURE = """
+import sys
+from PIL import Image
+import tiled
+
+def status_bytes(key):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(key + ":"):
+                return int(line.split()[1]) * 1024
+
+class Session:
+    def predict(self, image):
+        return [Image.linear_gradient("L").resize(image.size)]
+
+src, dst = sys.argv[1], sys.argv[2]
+reader = tiled.StripReader(src)
+estimate = tiled.estimate_peak_bytes(*reader.size, reader.decode_bytes)
+reader.close()
+with open("/proc/self/clear_refs", "w") as f:
+    f.write("5")
+before = status_bytes("VmRSS")
+tiled.remove_background_tiled(src, dst, Session(), memory_limit=estimate)
+print(status_bytes("VmHWM") - before, estimate)
+"""
+
+
+class RecordingSession:
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, image):
+        self.calls += 1
+        return [Image.new("L", image.size, 255)]
+
+
+def noise_image(width, height, mode="RGB"):
+    pixels = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    return Image.fromarray(pixels).convert(mode)
+
+
+def test_over_limit_fails_before_any_work(tmp_path):
+    src = str(tmp_path / "in.png")
+    dst = str(tmp_path / "out.png")
+    noise_image(64, 48).save(src)
+    session = RecordingSession()
+
+    with pytest.raises(MemoryError):
+        tiled.remove_background_tiled(src, dst, session, memory_limit=1024)
+
+    assert session.calls == 0
+    assert sorted(os.listdir(tmp_path)) == ["in.png"]
+
+
+def test_output_matches_source(tmp_path):
+    src = str(tmp_path / "in.png")
+    dst = str(tmp_path / "out.png")
+    noise_image(300, 200).save(src)
+
+    tiled.remove_background_tiled(src, dst, RecordingSession(), tile_rows=64)
+
+    with Image.open(dst) as output:
+        assert output.mode == "RGBA"
+        assert np.array_equal(np.asarray(output)[..., :3], np.asarray(noise_image(300, 200)))
+
+
+def test_decode_bytes_counts_source_and_rgb_copy(tmp_path):
+    noise_image(100, 50, "L").save(tmp_path / "gray.png")
+    noise_image(100, 50).save(tmp_path / "rgb.bmp")
+
+    gray = tiled.StripReader(str(tmp_path / "gray.png"))
+    raw = tiled.StripReader(str(tmp_path / "rgb.bmp"))
+    try:
+        assert gray.decode_bytes == 100 * 50 * (1 + 4)
+        assert raw.lazy and raw.decode_bytes == 0
+    finally:
+        gray.close()
+        raw.close()
+
+
+def test_rotated_source_is_upright(tmp_path):
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    noise_image(60, 40).save(tmp_path / "rotated.png", exif=exif)
+
+    reader = tiled.StripReader(str(tmp_path / "rotated.png"))
+    try:
+        assert reader.size == (40, 60)
+        assert reader.read(0, 60).size == (40, 60)
+        assert reader.decode_bytes == 2 * 40 * 60 * 4
+    finally:
+        reader.close()
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/clear_refs"), reason="peak RSS is measured through /proc")
+@pytest.mark.parametrize("name, mode", [("in.bmp", "RGB"), ("in.png", "RGB"), ("gray.png", "L")])
+def test_peak_memory_within_estimate(tmp_path, name, mode):
+    src = str(tmp_path / name)
+    noise_image(3000, 2000, mode).save(src, **({"compress_level": 1} if name.endswith(".png") else {}))
+
+    result = subprocess.run([sys.executable, "-c", MEASURE, src, str(tmp_path / "out.png")],
+                            cwd=REPO, capture_output=True, text=True, check=True)
+    peak, estimate = map(int, result.stdout.split())
+
+    assert peak <= estimate
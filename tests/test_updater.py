@@ -0,0 +1,212 @@
+import hashlib
+import json
+import time
+
+import pytest
+
+import updater
+from http_stub import StubServer, reply
+
+PAYLOAD = bytes(range(256)) * 800
+PAYLOAD_SHA256 = hashlib.sha256(PAYLOAD).hexdigest()
+
+
+def serve_file(data, honour_range=True, drop_first_after=None):
+    """A reply function serving data, with Range support unless honour_range is off.
+
+    drop_first_after cuts the first response off after that many bytes of
+    its body, as a dropped connection would.
+    """
+    dropped = []
+
+    def respond(handler):
+        start = 0
+        range_header = handler.headers.get("Range")
+        if range_header and honour_range:
+            start = int(range_header[len("bytes="):].rstrip("-"))
+            if start >= len(data):
+                reply(handler, 416, headers={"Content-Range": f"bytes */{len(data)}"})
+                return
+        body = data[start:]
+        handler.send_response(206 if start else 200)
+        if start:
+            handler.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        if drop_first_after is not None and not dropped:
+            dropped.append(True)
+            handler.wfile.write(body[:drop_first_after])
+            handler.close_connection = True
+            return
+        handler.wfile.write(body)
+
+    return respond
+
+
+@pytest.fixture
+def server_for():
+    servers = []
+
+    def start(respond):
+        servers.append(StubServer(respond))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(updater.time, "sleep", lambda seconds: None)
+
+
+def download(server, tmp_path, expected=PAYLOAD_SHA256):
+    return updater.download_file(server.url, str(tmp_path / "app.exe"), expected, chunk_size=4096)
+
+
+def test_resumes_from_partial_file(server_for, tmp_path):
+    (tmp_path / "app.exe.partial").write_bytes(PAYLOAD[:1000])
+    server = server_for(serve_file(PAYLOAD))
+
+    download(server, tmp_path)
+
+    assert server.requests[0]["Range"] == "bytes=1000-"
+    assert (tmp_path / "app.exe").read_bytes() == PAYLOAD
+    assert not (tmp_path / "app.exe.partial").exists()
+
+
+def test_restarts_when_range_is_ignored(server_for, tmp_path):
+    # Bytes that do not belong to the file must not survive a 200 reply
+    (tmp_path / "app.exe.partial").write_bytes(b"x" * 1000)
+    server = server_for(serve_file(PAYLOAD, honour_range=False))
+
+    download(server, tmp_path)
+
+    assert len(server.requests) == 1
+    assert (tmp_path / "app.exe").read_bytes() == PAYLOAD
+
+
+def test_complete_partial_file_is_installed_on_416(server_for, tmp_path):
+    (tmp_path / "app.exe.partial").write_bytes(PAYLOAD)
+    server = server_for(serve_file(PAYLOAD))
+
+    download(server, tmp_path)
+
+    assert server.requests[0]["Range"] == f"bytes={len(PAYLOAD)}-"
+    assert (tmp_path / "app.exe").read_bytes() == PAYLOAD
+
+
+def test_checksum_mismatch_is_not_installed(server_for, tmp_path):
+    server = server_for(serve_file(PAYLOAD))
+
+    with pytest.raises(updater.UpdateError, match="Checksum mismatch"):
+        download(server, tmp_path, expected="0" * 64)
+
+    assert not (tmp_path / "app.exe").exists()
+    assert not (tmp_path / "app.exe.partial").exists()
+
+
+def test_stale_partial_file_gets_one_clean_retry(server_for, tmp_path):
+    (tmp_path / "app.exe.partial").write_bytes(b"x" * 1000)
+    server = server_for(serve_file(PAYLOAD))
+
+    download(server, tmp_path)
+
+    assert "Range" in server.requests[0] and "Range" not in server.requests[1]
+    assert (tmp_path / "app.exe").read_bytes() == PAYLOAD
+
+
+def test_retries_after_dropped_connection(server_for, tmp_path):
+    server = server_for(serve_file(PAYLOAD, drop_first_after=50_000))
+
+    download(server, tmp_path)
+
+    assert len(server.requests) == 2
+    assert server.requests[1]["Range"].startswith("bytes=")
+    assert (tmp_path / "app.exe").read_bytes() == PAYLOAD
+
+
+def test_gives_up_after_retries(server_for, tmp_path):
+    server = server_for(lambda handler: reply(handler, 503))
+
+    with pytest.raises(updater.UpdateError, match="retries"):
+        updater.download_file(server.url, str(tmp_path / "app.exe"), PAYLOAD_SHA256, retries=2)
+
+    assert len(server.requests) == 3
+    assert not (tmp_path / "app.exe").exists()
+
+
+RELEASE = {"tag_name": "v2.0.0", "assets": []}
+
+
+def serve_release(release, etag='"v2"'):
+    """A reply function for the releases API, answering a matching If-None-Match with 304"""
+    def respond(handler):
+        if handler.headers.get("If-None-Match") == etag:
+            reply(handler, 304, headers={"ETag": etag})
+        else:
+            reply(handler, 200, json.dumps(release).encode(), {"ETag": etag, "Content-Type": "application/json"})
+
+    return respond
+
+
+def write_cache(path, url, release, etag='"v2"', age=0):
+    path.write_text(json.dumps({"url": url, "etag": etag, "checked_at": time.time() - age, "release": release}))
+
+
+def test_fresh_cache_sends_no_request(server_for, tmp_path):
+    server = server_for(serve_release(RELEASE))
+    cache_path = tmp_path / "update_check.json"
+    write_cache(cache_path, server.url, RELEASE)
+
+    release, source = updater.fetch_latest_release(server.url, cache_path=str(cache_path))
+
+    assert (release, source) == (RELEASE, "cache")
+    assert server.requests == []
+
+
+def test_expired_cache_is_confirmed_with_304(server_for, tmp_path):
+    server = server_for(serve_release({"tag_name": "v3.0.0"}))
+    cache_path = tmp_path / "update_check.json"
+    write_cache(cache_path, server.url, RELEASE, age=updater.CHECK_TTL + 1)
+
+    release, source = updater.fetch_latest_release(server.url, cache_path=str(cache_path))
+
+    assert (release, source) == (RELEASE, "not-modified")
+    assert server.requests[0]["If-None-Match"] == '"v2"'
+    # The 304 restarts the TTL
+    assert time.time() - json.loads(cache_path.read_text())["checked_at"] < 60
+
+
+def test_forced_check_skips_ttl(server_for, tmp_path):
+    newer = {"tag_name": "v3.0.0", "assets": []}
+    server = server_for(serve_release(newer, etag='"v3"'))
+    cache_path = tmp_path / "update_check.json"
+    write_cache(cache_path, server.url, RELEASE)
+
+    release, source = updater.fetch_latest_release(server.url, force=True, cache_path=str(cache_path))
+
+    assert (release, source) == (newer, "network")
+    assert server.requests[0]["If-None-Match"] == '"v2"'
+    cache = json.loads(cache_path.read_text())
+    assert (cache["etag"], cache["release"]) == ('"v3"', newer)
+
+
+def test_corrupt_cache_is_replaced(server_for, tmp_path):
+    server = server_for(serve_release(RELEASE))
+    cache_path = tmp_path / "update_check.json"
+    cache_path.write_text("{not json")
+
+    release, source = updater.fetch_latest_release(server.url, cache_path=str(cache_path))
+
+    assert (release, source) == (RELEASE, "network")
+    assert "If-None-Match" not in server.requests[0]
+    assert json.loads(cache_path.read_text())["release"] == RELEASE
+
+
+def test_error_status_raises(server_for, tmp_path):
+    server = server_for(lambda handler: reply(handler, 403, b"rate limited"))
+
+    with pytest.raises(updater.UpdateError, match="403"):
+        updater.fetch_latest_release(server.url, cache_path=str(tmp_path / "update_check.json"))
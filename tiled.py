@@ -0,0 +1,249 @@
+"""Strip-by-strip background removal for images too large to hold several copies of.
+
+Memory ceiling: the full-size mask (1 byte per pixel), one strip of working
+data (about TILE_BYTES_PER_PIXEL bytes per pixel of the strip), the model
+proxy and the guided filter coefficients. Uncompressed BMP, PPM and TIFF
+sources are read strip by strip straight from the file; other formats have to
+be decoded whole by Pillow. Decoding holds the source's own pixels and their
+RGB copy (Pillow stores RGB in 4 bytes per pixel) at once, or two RGB copies
+while an EXIF rotation is applied; only the RGB copy is kept after that.
+estimate_peak_bytes() computes this and remove_background_tiled() refuses to
+start when it is over the limit.
+"""
+import math
+import os
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image
+
+from mask_ops import STRIP_ROWS, guided_upsample_rows
+from pipeline import DEFAULT_PROXY_SIZE, cutout, make_proxy
+from png_stream import PNG_SIGNATURE, sub_filter_rows, write_png_chunk
+
+DEFAULT_TILE_ROWS = 256
+DEFAULT_MEMORY_LIMIT = 1024 * 1024 * 1024
+# Source strip, its RGBA copy, the transparent base, the composite and the
+# filtered PNG rows
+TILE_BYTES_PER_PIXEL = 24
+# Three float32 working rows of the guided filter, plus the raw bytes, RGB
+# strip (4 bytes per pixel in Pillow) and gray rows read for the guide
+GUIDED_BYTES_PER_PIXEL = 24
+
+# Raw layouts that can be sliced into rows directly from the file
+RAW_BYTES_PER_PIXEL = {"RGB": 3, "BGR": 3, "RGBA": 4, "BGRA": 4, "RGBX": 4, "BGRX": 4, "L": 1}
+
+# Bytes per pixel of Pillow's in-memory storage: single-band modes take their
+# own size, every multi-band mode (RGB included) a 4-byte pixel
+STORED_BYTES_PER_PIXEL = {"1": 1, "L": 1, "P": 1, "I;16": 2, "I;16L": 2, "I;16B": 2, "I;16N": 2}
+# EXIF orientation -> the transpose that makes the image upright, as ImageOps.exif_transpose
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def stored_bytes_per_pixel(mode):
+    return STORED_BYTES_PER_PIXEL.get(mode, 4)
+
+
+class StripReader:
+    """Reads horizontal strips of an image as RGB, lazily where the format allows"""
+
+    def __init__(self, path):
+        self.path = path
+        self._image = Image.open(path)
+        self._raw = self._raw_layout(self._image)
+        self.lazy = self._raw is not None
+        self._decoded = None
+        self.size = self._image.size
+        self._orientation = 1 if self.lazy else self._image.getexif().get(0x0112, 1)
+        # EXIF orientations 5-8 swap width and height once transposed
+        if self._orientation in (5, 6, 7, 8):
+            self.size = self.size[::-1]
+        self.width, self.height = self.size
+
+    @property
+    def decode_bytes(self):
+        """Peak memory of decoding a compressed source whole, 0 when it is read lazily"""
+        if self.lazy:
+            return 0
+        pixels = self.width * self.height
+        rgb = pixels * stored_bytes_per_pixel("RGB")
+        source = 0 if self._image.mode == "RGB" else pixels * stored_bytes_per_pixel(self._image.mode)
+        rotated = rgb if self._orientation in ORIENTATION_TRANSPOSE else 0
+        return max(source + rgb, rgb + rotated)
+
+    def _full_image(self):
+        """Compressed formats can only be decoded whole; do it once, on first use.
+
+        Each intermediate is closed as soon as the next one exists, so only
+        the upright RGB copy stays.
+        """
+        if self._decoded is None:
+            image = self._image
+            image.load()
+            decoded = image if image.mode == "RGB" else image.convert("RGB")
+            if decoded is not image:
+                image.close()
+            method = ORIENTATION_TRANSPOSE.get(self._orientation)
+            if method is not None:
+                upright = decoded.transpose(method)
+                decoded.close()
+                decoded = upright
+            self._decoded = decoded
+        return self._decoded
+
+    @staticmethod
+    def _raw_layout(image):
+        """Return (offset, rawmode, stride, orientation) for a single raw tile, else None"""
+        if len(image.tile) != 1:
+            return None
+        tile = image.tile[0]
+        if tile[0] != "raw" or tuple(tile[1]) != (0, 0) + image.size:
+            return None
+        if image.getexif().get(0x0112, 1) != 1:
+            return None
+        args = tile[3] if isinstance(tile[3], tuple) else (tile[3],)
+        rawmode = args[0]
+        if rawmode not in RAW_BYTES_PER_PIXEL:
+            return None
+        stride = args[1] if len(args) > 1 and args[1] else image.width * RAW_BYTES_PER_PIXEL[rawmode]
+        orientation = args[2] if len(args) > 2 else 1
+        return tile[2], rawmode, stride, orientation
+
+    def read(self, top, bottom):
+        """Return rows top..bottom as an RGB image"""
+        if not self.lazy:
+            return self._full_image().crop((0, top, self.width, bottom))
+
+        offset, rawmode, stride, orientation = self._raw
+        rows = bottom - top
+        # Bottom-up files store image row y at file row height - 1 - y
+        first_row = top if orientation > 0 else self.height - bottom
+        with open(self.path, "rb") as f:
+            f.seek(offset + first_row * stride)
+            data = f.read(rows * stride)
+        strip = Image.frombytes(self._image.mode, (self.width, rows), data, "raw", rawmode, stride, orientation)
+        return strip if strip.mode == "RGB" else strip.convert("RGB")
+
+    def read_gray(self, top, bottom):
+        return np.asarray(self.read(top, bottom).convert("L"))
+
+    def proxy(self, max_size):
+        """Downscaled copy for inference, built strip by strip when lazy"""
+        if not self.lazy:
+            image = self._full_image()
+            # Reduced before make_proxy copies it, so the full-size image is never copied
+            factor = max(self.size) // (2 * max_size)
+            return make_proxy(image.reduce(factor) if factor > 1 else image, max_size)
+
+        factor = max(1, math.ceil(max(self.size) / (2 * max_size)))
+        rows_per_strip = max(factor, DEFAULT_TILE_ROWS // factor * factor)
+        proxy = Image.new("RGB", (math.ceil(self.width / factor), math.ceil(self.height / factor)))
+        for top in range(0, self.height, rows_per_strip):
+            bottom = min(top + rows_per_strip, self.height)
+            proxy.paste(self.read(top, bottom).reduce(factor), (0, top // factor))
+        proxy.thumbnail((max_size, max_size), Image.Resampling.BILINEAR)
+        return proxy
+
+    def close(self):
+        self._image.close()
+        if self._decoded is not None:
+            self._decoded.close()
+            self._decoded = None
+
+
+class PNGStreamWriter:
+    """Writes an 8-bit RGBA PNG incrementally, a block of rows at a time"""
+
+    def __init__(self, path, width, height, compress_level=6):
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self._compressor = zlib.compressobj(compress_level)
+        self._file = open(path, "wb")
+        self._file.write(PNG_SIGNATURE)
+        # 8 bits per channel, color type 6 (RGBA), no interlacing
+        write_png_chunk(self._file, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+
+    def write_rows(self, rows):
+        """Append an RGBA image or (rows, width, 4) uint8 array"""
+        rows = np.asarray(rows, dtype=np.uint8).reshape(-1, self.width * 4)
+        data = self._compressor.compress(sub_filter_rows(rows).tobytes())
+        if data:
+            write_png_chunk(self._file, b"IDAT", data)
+        self.rows_written += rows.shape[0]
+
+    def close(self):
+        if self.rows_written != self.height:
+            self._file.close()
+            raise ValueError(f"Wrote {self.rows_written} rows, expected {self.height}")
+        write_png_chunk(self._file, b"IDAT", self._compressor.flush())
+        write_png_chunk(self._file, b"IEND", b"")
+        self._file.close()
+
+    def abort(self):
+        """Close the file without finishing it"""
+        self._file.close()
+
+
+def estimate_peak_bytes(width, height, decode_bytes=0, tile_rows=DEFAULT_TILE_ROWS, proxy_size=DEFAULT_PROXY_SIZE):
+    """Approximate peak memory of remove_background_tiled for an image.
+
+    decode_bytes is StripReader.decode_bytes: 0 for a source read strip by
+    strip, else the peak of decoding it whole.
+    """
+    mask = width * height
+    source = decode_bytes
+    strip = width * max(tile_rows * TILE_BYTES_PER_PIXEL, STRIP_ROWS * GUIDED_BYTES_PER_PIXEL)
+    # proxy image plus the guided filter coefficients widened to full width
+    proxy_height = proxy_size * height // max(width, height) + 1
+    proxy = proxy_size * proxy_size * 3 + 2 * width * proxy_height * 4
+    return mask + source + strip + proxy
+
+
+def remove_background_tiled(src, dst, session, proxy_size=DEFAULT_PROXY_SIZE, tile_rows=DEFAULT_TILE_ROWS,
+                            memory_limit=DEFAULT_MEMORY_LIMIT, compress_level=6):
+    """Remove the background of src into the PNG dst without full-size RGBA copies.
+
+    Raises MemoryError before doing any work if the estimated peak memory is
+    above memory_limit.
+    """
+    reader = StripReader(src)
+    try:
+        width, height = reader.size
+        estimate = estimate_peak_bytes(width, height, reader.decode_bytes, tile_rows, proxy_size)
+        if memory_limit and estimate > memory_limit:
+            raise MemoryError(
+                f"{os.path.basename(src)} needs about {estimate // (1024 * 1024)} MB, "
+                f"over the {memory_limit // (1024 * 1024)} MB limit; lower the tile size or raise the limit"
+            )
+
+        proxy = reader.proxy(proxy_size)
+        low_mask = session.predict(proxy)[0].convert("L")
+        mask = guided_upsample_rows(reader.size, reader.read_gray, low_mask, proxy)
+        del proxy, low_mask
+
+        partial_path = dst + ".partial"
+        writer = PNGStreamWriter(partial_path, width, height, compress_level)
+        try:
+            for top in range(0, height, tile_rows):
+                bottom = min(top + tile_rows, height)
+                strip = reader.read(top, bottom)
+                writer.write_rows(cutout(strip, mask.crop((0, top, width, bottom))))
+            writer.close()
+        except Exception:
+            writer.abort()
+            os.remove(partial_path)
+            raise
+        os.replace(partial_path, dst)
+    finally:
+        reader.close()
+    return estimate
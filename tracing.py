@@ -0,0 +1,218 @@
+"""Structured timing spans for the processing pipeline.
+
+Work wrapped in tracer.trace() records every span() entered below it, on the
+same thread, with its duration and the change in resident memory. Work that
+moves between threads (the GUI's stage pipeline) uses tracer.start() once,
+tracer.activate() around each piece on whichever thread runs it, and
+tracer.finish(). Finished traces are appended to TRACE_PATH as JSON lines, one
+line per span. Outside a trace span() does nothing, so batch workers and the
+CLI pay nothing for the spans inside shared pipeline code.
+
+With profiling switched on, each trace also runs under cProfile (saved as a
+.prof file for pstats or snakeviz) and tracemalloc (peak and top allocation
+sites added to the trace's root record).
+"""
+import contextvars
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+from app_log import log
+from app_paths import app_data_dir
+from perf import current_rss_bytes
+
+TRACE_PATH = os.path.join(app_data_dir(), "traces.jsonl")
+PROFILE_DIR = os.path.join(app_data_dir(), "profiles")
+# The trace file is rotated to TRACE_PATH + ".1" when it grows past this
+MAX_TRACE_BYTES = 10 * 1024 * 1024
+TRACEMALLOC_TOP = 10
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """Spans recorded for one unit of work, such as processing one image"""
+
+    def __init__(self, name, attrs):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.wall_start = time.time()
+        self.duration = None
+        self.spans = []
+        self.profile_path = None
+        self.tracemalloc = None
+        self._stack = []
+        # Profile stats of each activation, merged when the trace finishes
+        self._profile_stats = None
+
+    def summary(self):
+        """Top-level stage times of at least 1 ms, e.g. "decode 12 · inference 340 · composite 20 ms" """
+        totals = {}
+        for record in self.spans:
+            if record["depth"] == 0:
+                totals[record["name"]] = totals.get(record["name"], 0.0) + record["duration_ms"]
+        parts = [f"{name} {ms:.0f}" for name, ms in totals.items() if ms >= 1]
+        return " · ".join(parts) + " ms" if parts else ""
+
+    def records(self):
+        root = {
+            "trace": self.id,
+            "name": self.name,
+            "timestamp": round(self.wall_start, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+            "depth": -1,
+        }
+        root.update(self.attrs)
+        if self.profile_path:
+            root["profile"] = self.profile_path
+        if self.tracemalloc:
+            root["tracemalloc"] = self.tracemalloc
+        return [root] + [dict(record, trace=self.id) for record in self.spans]
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time the enclosed block as a stage of the current trace, if any"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    parent = trace._stack[-1] if trace._stack else None
+    trace._stack.append(name)
+    rss_before = current_rss_bytes()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        trace._stack.pop()
+        record = {
+            "name": name,
+            "parent": parent,
+            "depth": len(trace._stack),
+            "offset_ms": round((start - trace.start) * 1000, 3),
+            "duration_ms": round(duration * 1000, 3),
+            "rss_delta": current_rss_bytes() - rss_before,
+            "thread": threading.current_thread().name,
+        }
+        record.update(attrs)
+        trace.spans.append(record)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+class Tracer:
+    """Starts traces and writes them out as JSON lines"""
+
+    def __init__(self, path=TRACE_PATH, profile_dir=PROFILE_DIR):
+        self.path = path
+        self.profile_dir = profile_dir
+        self.profile = False
+        self._write_lock = threading.Lock()
+        # cProfile and tracemalloc are process-wide, so profiled blocks run one
+        # at a time; with profiling on, pipeline stages no longer overlap
+        self._profile_lock = threading.Lock()
+
+    @contextmanager
+    def trace(self, name, **attrs):
+        """Collect the spans of the enclosed block into a new trace and save it"""
+        trace = self.start(name, **attrs)
+        try:
+            with self.activate(trace):
+                yield trace
+        finally:
+            self.finish(trace)
+
+    def start(self, name, **attrs):
+        """A new trace for work that runs in several blocks, possibly on several threads"""
+        return Trace(name, attrs)
+
+    @contextmanager
+    def activate(self, trace):
+        """Record the spans of the enclosed block, on this thread, into trace"""
+        token = _current_trace.set(trace)
+        profiler = self._start_profiling() if self.profile else None
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+            if profiler is not None:
+                self._stop_profiling(profiler, trace)
+
+    def finish(self, trace):
+        """Stop trace's clock and save it, with its merged profile if it has one"""
+        trace.duration = time.perf_counter() - trace.start
+        if trace._profile_stats is not None:
+            try:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                trace.profile_path = os.path.join(self.profile_dir, f"{trace.name}-{trace.id}.prof")
+                trace._profile_stats.dump_stats(trace.profile_path)
+                log(f"Profile saved to {trace.profile_path}")
+            except OSError as e:
+                log(f"Could not save profile: {e}")
+            trace._profile_stats = None
+        self._write(trace)
+
+    def _start_profiling(self):
+        self._profile_lock.acquire()
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # Another profiler (a debugger, or cProfile on another thread) is active
+            log(f"Could not start cProfile: {e}")
+            self._profile_lock.release()
+            return None
+        tracemalloc.start()
+        return profiler
+
+    def _stop_profiling(self, profiler, trace):
+        try:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        finally:
+            self._profile_lock.release()
+
+        # A trace activated several times keeps the allocation sites of its
+        # hungriest block and the sum of all its profiles
+        if trace.tracemalloc is None or peak > trace.tracemalloc["peak"]:
+            trace.tracemalloc = {
+                "peak": peak,
+                "top": [
+                    {"where": str(stat.traceback), "size": stat.size, "count": stat.count}
+                    for stat in snapshot.statistics("lineno")[:TRACEMALLOC_TOP]
+                ],
+            }
+        if trace._profile_stats is None:
+            trace._profile_stats = pstats.Stats(profiler)
+        else:
+            trace._profile_stats.add(profiler)
+
+    def _write(self, trace):
+        lines = "".join(json.dumps(record) + "\n" for record in trace.records())
+        with self._write_lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                if os.path.exists(self.path) and os.path.getsize(self.path) > MAX_TRACE_BYTES:
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+            except OSError as e:
+                log(f"Could not write trace: {e}")
+
+
+# Shared by the GUI and anything else that wants its work traced
+tracer = Tracer()
@@ -0,0 +1,240 @@
+"""Checking for, downloading and verifying application updates.
+
+The latest-release lookup is cached on disk with its ETag. Within
+CHECK_TTL the cached answer is used without any request; after that (or
+when forced) the request is conditional, and GitHub answers an unchanged
+release with an empty 304 that does not count against the rate limit.
+
+Downloads go to a .partial file in a persistent folder and resume with an
+HTTP Range request after a dropped connection or an app restart. The finished
+file is only handed over for installation once its SHA-256 matches the
+checksum published with the release.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+
+from app_log import log
+from app_paths import app_data_dir
+
+UPDATE_DIR = os.path.join(app_data_dir(), "updates")
+RELEASE_CACHE_PATH = os.path.join(app_data_dir(), "update_check.json")
+CHECK_TTL = 6 * 60 * 60
+CHECK_TIMEOUT = (5, 10)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# (connect, read) timeouts; the read timeout applies between chunks, not to the whole file
+DOWNLOAD_TIMEOUT = (10, 30)
+DOWNLOAD_RETRIES = 3
+PROGRESS_INTERVAL = 0.25
+SHA256_PATTERN = re.compile(r"\b([0-9a-fA-F]{64})\b")
+
+
+class UpdateError(Exception):
+    """An update could not be downloaded or verified"""
+
+
+def _load_release_cache(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        log(f"Ignoring unreadable update check cache: {e}")
+        return {}
+
+
+def _save_release_cache(path, cache):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+    except OSError as e:
+        log(f"Could not save update check cache: {e}")
+
+
+def fetch_latest_release(url, headers=None, force=False, ttl=CHECK_TTL, cache_path=RELEASE_CACHE_PATH):
+    """Return (release, source) for the latest release at url.
+
+    source is "cache" when the cached release is younger than ttl (skipped
+    when force is set), "not-modified" when the server confirmed it with a
+    304, and "network" for a fresh response.
+    """
+    import requests
+
+    cache = _load_release_cache(cache_path)
+    if cache.get("url") != url:
+        cache = {}
+    if cache and not force and time.time() - cache.get("checked_at", 0) < ttl:
+        return cache["release"], "cache"
+
+    request_headers = dict(headers or {})
+    if cache.get("etag"):
+        request_headers["If-None-Match"] = cache["etag"]
+    response = requests.get(url, headers=request_headers, timeout=CHECK_TIMEOUT)
+    log(f"GitHub API Response Status: {response.status_code}")
+
+    if response.status_code == 304 and cache:
+        cache["checked_at"] = time.time()
+        _save_release_cache(cache_path, cache)
+        return cache["release"], "not-modified"
+    if response.status_code != 200:
+        raise UpdateError(f"GitHub API returned {response.status_code}: {response.text[:200]}")
+
+    release = response.json()
+    _save_release_cache(cache_path, {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "checked_at": time.time(),
+        "release": release,
+    })
+    return release, "network"
+
+
+def find_asset(release, suffix=".exe"):
+    for asset in release.get("assets", []):
+        if asset.get("name", "").lower().endswith(suffix):
+            return asset
+    return None
+
+
+def parse_checksum(text, file_name, allow_bare=True):
+    """SHA-256 for file_name from sha256sum-style text, or a lone digest if allow_bare"""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    for line in lines:
+        match = SHA256_PATTERN.search(line)
+        if match and file_name in line:
+            return match.group(1).lower()
+    if allow_bare and len(lines) == 1:
+        match = SHA256_PATTERN.search(lines[0])
+        if match:
+            return match.group(1).lower()
+    return None
+
+
+def release_checksum(release, asset):
+    """The SHA-256 published for asset, or None.
+
+    Looks at GitHub's own asset digest first, then a "<asset>.sha256" or
+    checksums asset, then a "<digest>  <asset>" line in the release notes.
+    """
+    digest = asset.get("digest") or ""
+    if digest.startswith("sha256:"):
+        return digest.split(":", 1)[1].lower()
+
+    import requests
+
+    names = [name.lower() for name in (asset["name"] + ".sha256", "sha256sums", "sha256sums.txt", "checksums.txt")]
+    for candidate in release.get("assets", []):
+        if candidate.get("name", "").lower() in names:
+            response = requests.get(candidate["browser_download_url"], timeout=DOWNLOAD_TIMEOUT)
+            response.raise_for_status()
+            checksum = parse_checksum(response.text, asset["name"])
+            if checksum:
+                return checksum
+
+    return parse_checksum(release.get("body") or "", asset["name"], allow_bare=False)
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def download_file(url, dest, expected_sha256, progress=None, cancel_event=None,
+                  chunk_size=DOWNLOAD_CHUNK_SIZE, retries=DOWNLOAD_RETRIES, timeout=DOWNLOAD_TIMEOUT):
+    """Download url to dest, resuming from dest + ".partial" if it exists.
+
+    progress(downloaded, total, bytes_per_second) is called from this thread
+    at most every PROGRESS_INTERVAL seconds; total is 0 when unknown. Raises
+    UpdateError when the checksum does not match (the partial file is then
+    discarded) or the download keeps failing.
+    """
+    import requests
+
+    partial_path = dest + ".partial"
+    os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+    resumed = os.path.exists(partial_path)
+    attempt = 0
+    while True:
+        try:
+            _download_range(url, partial_path, progress, cancel_event, chunk_size, timeout)
+        except requests.exceptions.RequestException as e:
+            attempt += 1
+            if attempt > retries:
+                raise UpdateError(f"Download failed after {retries} retries: {e}")
+            log(f"Download interrupted ({e}), resuming (attempt {attempt} of {retries})")
+            resumed = True
+            time.sleep(min(2 ** attempt, 10))
+            continue
+
+        actual = sha256_file(partial_path)
+        if actual == expected_sha256.lower():
+            break
+        os.remove(partial_path)
+        # A stale partial file from an older upload can poison a resumed
+        # download, so a mismatch after resuming gets one clean retry
+        if not resumed:
+            raise UpdateError(f"Checksum mismatch: expected {expected_sha256}, got {actual}")
+        log("Checksum mismatch after resuming, downloading again from the start")
+        resumed = False
+
+    os.replace(partial_path, dest)
+    return dest
+
+
+def _download_range(url, partial_path, progress, cancel_event, chunk_size, timeout):
+    """Fetch whatever is missing from partial_path"""
+    import requests
+
+    existing = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+    headers = {"Range": f"bytes={existing}-"} if existing else {}
+    with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 416:
+            # Nothing left to fetch: the partial file is already complete
+            return
+        response.raise_for_status()
+        if existing and response.status_code != 206:
+            log("Server ignored the range request, downloading from the start")
+            existing = 0
+        total = int(response.headers.get("Content-Length", 0))
+        total = total + existing if total else 0
+
+        downloaded = existing
+        started = time.perf_counter()
+        last_report = 0.0
+        with open(partial_path, "ab" if existing else "wb") as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise UpdateError("Download cancelled")
+                f.write(chunk)
+                downloaded += len(chunk)
+                now = time.perf_counter()
+                if progress and (now - last_report >= PROGRESS_INTERVAL or downloaded == total):
+                    last_report = now
+                    progress(downloaded, total, (downloaded - existing) / max(now - started, 1e-6))
+        if total and downloaded < total:
+            raise requests.exceptions.ConnectionError(f"Connection closed after {downloaded} of {total} bytes")
+
+
+def download_update(release, progress=None, cancel_event=None, update_dir=UPDATE_DIR):
+    """Download and verify the release's .exe and return its local path"""
+    asset = find_asset(release)
+    if asset is None:
+        raise UpdateError("No executable found in release assets")
+    checksum = release_checksum(release, asset)
+    if not checksum:
+        raise UpdateError(f"The release publishes no SHA-256 checksum for {asset['name']}; not installing it")
+
+    version = release.get("tag_name", "").lstrip("v") or "latest"
+    dest = os.path.join(update_dir, version, asset["name"])
+    if os.path.exists(dest) and sha256_file(dest) == checksum:
+        log(f"Update {version} already downloaded")
+        return dest
+    log(f"Downloading {asset['browser_download_url']} to {dest}")
+    return download_file(asset["browser_download_url"], dest, checksum, progress, cancel_event)
@@ -0,0 +1,186 @@
+"""Watch a folder and remove the background of every image dropped into it.
+
+Each poll walks the folder with os.scandir and compares every image's
+(size, mtime) with an in-memory index; file contents are only read once an
+image is processed. A new or changed image is queued when its size and mtime
+have stayed the same for settle_seconds, so files still being copied are left
+alone. Finished images are recorded in a small JSON state file next to the
+outputs, so a restarted watcher skips everything it has already handled.
+"""
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from app_log import log
+from batch import IMAGE_EXTENSIONS, output_path_for, process_file, _init_worker
+from model_session import DEFAULT_MODEL
+
+STATE_VERSION = 1
+STATE_FILE_NAME = ".bg_remover_watch.json"
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_SETTLE_SECONDS = 2.0
+DEFAULT_WORKERS = 2
+
+
+def scan(in_dir, exclude_dir=None):
+    """Return {relative path: (size, mtime_ns)} for every image under in_dir"""
+    index = {}
+    pending = [in_dir]
+    while pending:
+        directory = pending.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if exclude_dir is None or os.path.abspath(entry.path) != exclude_dir:
+                        pending.append(entry.path)
+                elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    stat = entry.stat()
+                    index[os.path.relpath(entry.path, in_dir)] = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                # Deleted or renamed between listing and stat
+                continue
+    return index
+
+
+def load_state(path):
+    """Processed files as {relative path: {"size", "mtime_ns", "status"}}"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("version") == STATE_VERSION:
+            return state.get("files", {})
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        log(f"Could not read watch state, starting fresh: {e}")
+    return {}
+
+
+def save_state(path, files):
+    partial_path = path + ".partial"
+    try:
+        with open(partial_path, "w", encoding="utf-8") as f:
+            json.dump({"version": STATE_VERSION, "files": files}, f)
+        os.replace(partial_path, path)
+    except OSError as e:
+        log(f"Could not save watch state: {e}")
+
+
+class FolderWatcher:
+    """Polls in_dir and feeds settled new or changed images to a worker pool"""
+
+    def __init__(self, in_dir, out_dir, state_path=None, poll_interval=DEFAULT_POLL_INTERVAL,
+                 settle_seconds=DEFAULT_SETTLE_SECONDS):
+        self.in_dir = in_dir
+        self.out_dir = out_dir
+        self.state_path = state_path or os.path.join(out_dir, STATE_FILE_NAME)
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.done = load_state(self.state_path)
+        # relative path -> (signature, time it was first seen with that signature)
+        self._settling = {}
+        # Settled files waiting for a worker, in arrival order
+        self._queued = {}
+        self._in_flight = {}
+        self._dirty = False
+        # Never watch our own outputs when out_dir is inside in_dir
+        self._exclude_dir = os.path.abspath(out_dir)
+
+    def is_handled(self, relative, signature):
+        entry = self.done.get(relative)
+        return entry is not None and (entry["size"], entry["mtime_ns"]) == tuple(signature)
+
+    def ready_files(self, now=None):
+        """(relative path, signature) pairs of new or changed images whose stat has settled"""
+        now = time.monotonic() if now is None else now
+        index = scan(self.in_dir, self._exclude_dir)
+        ready = []
+        for relative, signature in index.items():
+            if relative in self._in_flight or relative in self._queued or self.is_handled(relative, signature):
+                self._settling.pop(relative, None)
+                continue
+            seen = self._settling.get(relative)
+            if seen is None or seen[0] != signature:
+                self._settling[relative] = (signature, now)
+            elif now - seen[1] >= self.settle_seconds:
+                del self._settling[relative]
+                ready.append((relative, signature))
+
+        # Forget files that have been deleted from the watched folder
+        for relative in [relative for relative in self._settling if relative not in index]:
+            del self._settling[relative]
+        for relative in [relative for relative in self.done if relative not in index]:
+            del self.done[relative]
+            self._dirty = True
+        return ready
+
+    def record(self, relative, signature, status):
+        self.done[relative] = {"size": signature[0], "mtime_ns": signature[1], "status": status}
+        self._dirty = True
+
+    def flush_state(self):
+        if self._dirty:
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            save_state(self.state_path, self.done)
+            self._dirty = False
+
+    def run(self, workers=DEFAULT_WORKERS, model_name=DEFAULT_MODEL, options=None, once=False):
+        """Process images as they arrive until interrupted.
+
+        options are the batch worker options (see batch.run_batch). With once,
+        return after everything currently in the folder has been processed.
+        """
+        if not os.path.isdir(self.in_dir):
+            raise FileNotFoundError(f"Input directory not found: {self.in_dir}")
+        log(f"Watching {self.in_dir} -> {self.out_dir} ({len(self.done)} files already processed)")
+
+        max_in_flight = workers * 2
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name, options or {})
+        ) as executor:
+            try:
+                while True:
+                    self._queued.update(self.ready_files())
+                    while self._queued and len(self._in_flight) < max_in_flight:
+                        relative = next(iter(self._queued))
+                        signature = self._queued.pop(relative)
+                        src = os.path.join(self.in_dir, relative)
+                        dst = output_path_for(src, self.in_dir, self.out_dir)
+                        future = executor.submit(process_file, src, dst)
+                        self._in_flight[relative] = (future, signature)
+
+                    if self._in_flight:
+                        futures = [future for future, _ in self._in_flight.values()]
+                        wait(futures, timeout=0 if self._queued else self.poll_interval, return_when=FIRST_COMPLETED)
+                    self._collect()
+                    self.flush_state()
+
+                    if once and not self._queued and not self._in_flight and not self._settling:
+                        return
+                    if not self._in_flight:
+                        time.sleep(self.poll_interval)
+            finally:
+                self.flush_state()
+
+    def _collect(self):
+        for relative, (future, signature) in list(self._in_flight.items()):
+            if not future.done():
+                continue
+            del self._in_flight[relative]
+            try:
+                timings = future.result()
+            except Exception as e:
+                log(f"Failed to process {relative}: {e}")
+                self.record(relative, signature, "failed")
+                continue
+            log(f"Processed {relative} in {sum(timings.values()):.2f}s")
+            self.record(relative, signature, "done")